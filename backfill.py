@@ -0,0 +1,86 @@
+"""
+Price store integrity check.
+
+    python backfill.py [--trading-days 504] [--scan-only]
+
+Compares every security's stored days against the trading sessions of the
+lookback, reports the ranges missing inside each security's history (feed
+outages, halts) and fetches only those ranges. Rows already stored are
+skipped, so the backfill is safe to re-run.
+"""
+
+import argparse
+import os
+
+from dotenv import find_dotenv, load_dotenv
+
+
+def main(argv=None):
+    arguments = argparse.ArgumentParser(description="Find and backfill price gaps")
+    arguments.add_argument("--trading-days", type=int, default=252 * 2)
+    arguments.add_argument(
+        "--scan-only", action="store_true", help="report the gaps without fetching"
+    )
+    args = arguments.parse_args(argv)
+
+    load_dotenv(find_dotenv())
+
+    import sqlalchemy
+    from database import init_db
+    from ingestion import ALPACA_REQUESTS_PER_MINUTE, backfill_gaps
+    from log import log
+    from rolling import RollingStatistics
+    from store import open_store
+
+    engine = sqlalchemy.create_engine("sqlite:///securities.db")
+    # tables and columns added since the database was created
+    init_db(engine)
+    db_session = sqlalchemy.orm.Session(bind=engine, expire_on_commit=False)
+    store = RollingStatistics(
+        open_store(engine=engine, db_session=db_session), db_session
+    )
+
+    gaps = store.gaps(trading_days=args.trading_days)
+    for ticker, ranges in sorted(gaps.items()):
+        log(
+            "{0}: {1}".format(
+                ticker,
+                ", ".join(
+                    "{0} - {1}".format(
+                        start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")
+                    )
+                    for start_date, end_date in ranges
+                ),
+            ),
+            "debug",
+        )
+    log(
+        "{0} securities with {1} missing ranges".format(
+            len(gaps), sum(len(ranges) for ranges in gaps.values())
+        ),
+        "warning" if gaps else "success",
+    )
+
+    if gaps and not args.scan_only:
+        import alpaca_trade_api as tradeapi
+
+        alpaca_api = tradeapi.REST(
+            os.getenv("ALPACA_KEY_ID"),
+            os.getenv("ALPACA_SECRET_KEY"),
+            base_url=os.getenv("ALPACA_BASE_URL"),
+        )
+        backfill_gaps(
+            alpaca_api,
+            store,
+            gaps,
+            workers=int(os.getenv("INGEST_WORKERS", 4)),
+            requests_per_minute=int(
+                os.getenv("ALPACA_REQUESTS_PER_MINUTE", ALPACA_REQUESTS_PER_MINUTE)
+            ),
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
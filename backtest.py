@@ -0,0 +1,383 @@
+"""
+Backtest of the momentum strategy over stored prices.
+
+Replays the live pipeline at every historical rebalance date: market regime,
+momentum screen, portfolio selection with kept positions and inverse
+volatility sizing. Rolling statistics are computed once for the whole panel
+from prefix sums, so each rebalance only gathers rows out of precomputed
+arrays.
+
+The FRED retail sales check is replayed from the observations cached by
+macro.MacroData when they are passed in; without them the regime is the
+market trend filter alone.
+"""
+
+import argparse
+import configparser
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from helper import (
+    inverse_volatility_weights,
+    model_parameters,
+    select_portfolio,
+    share_quantity,
+)
+from log import log
+from macro import macro_yoy
+from screener import rank, score_from_sums
+
+TRADING_DAYS_IN_YEAR = 252
+MA_WINDOW = 100
+
+
+def _prefix_sum(values):
+    # prefix[k] is the sum of rows before k, so rows [lo, hi) sum to
+    # prefix[hi] - prefix[lo]
+    prefix = np.zeros((values.shape[0] + 1,) + values.shape[1:])
+    np.cumsum(values, axis=0, out=prefix[1:])
+    return prefix
+
+
+def rolling_statistics(
+    panel,
+    rows,
+    trading_days=TRADING_DAYS_IN_YEAR,
+    ma_window=MA_WINDOW,
+    gap_window=125,
+    vola_window=20,
+):
+    """
+    Input:  Date x ticker price panel and the row of each rebalance date.
+    Output: Dict of rebalance x ticker arrays with the same statistics the live
+            run computes from the trailing ``trading_days`` rows: observations,
+            close, moving average, largest move, momentum score and volatility.
+    """
+    values = panel.to_numpy(dtype=np.float64)
+    valid = ~np.isnan(values)
+    rows = np.asarray(rows)
+    hi = rows + 1
+    lo = np.maximum(hi - trading_days, 0)
+
+    # log prices relative to each column's first close keep the sums small
+    first = pd.DataFrame(values).bfill().to_numpy()[0]
+    y = np.where(valid, np.log(np.where(valid, values, 1.0)) - np.log(first), 0.0)
+    position = np.where(valid, np.cumsum(valid, axis=0) - 1.0, 0.0)
+
+    count = _prefix_sum(valid.astype(np.float64))
+    sum_y = _prefix_sum(y)
+    sum_yy = _prefix_sum(y * y)
+    sum_xy = _prefix_sum(position * y)
+
+    # regression of log price on the position of each close in the window
+    n = count[hi] - count[lo]
+    s_y = sum_y[hi] - sum_y[lo]
+    s_xy = sum_xy[hi] - sum_xy[lo] - count[lo] * s_y
+    score = score_from_sums(
+        n, s_y, s_xy, sum_yy[hi] - sum_yy[lo], trading_days=trading_days
+    )
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ma_lo = np.maximum(hi - ma_window, lo)
+        sum_close = _prefix_sum(np.where(valid, values, 0.0))
+        moving_average = (sum_close[hi] - sum_close[ma_lo]) / (count[hi] - count[ma_lo])
+
+        previous = panel.ffill().shift(1).to_numpy(dtype=np.float64)
+        returns = np.where(valid, values / previous - 1, np.nan)
+
+    closes = panel.ffill().to_numpy(dtype=np.float64)[rows]
+
+    moves = pd.DataFrame(np.abs(returns)).rolling(gap_window - 1, min_periods=1).max()
+    max_move = np.nan_to_num(moves.to_numpy()[rows], nan=0.0)
+
+    # mean of the rolling standard deviation inside each trailing window
+    rolling_std = pd.DataFrame(returns).rolling(vola_window).std().to_numpy()
+    std_count = _prefix_sum((~np.isnan(rolling_std)).astype(np.float64))
+    std_sum = _prefix_sum(np.nan_to_num(rolling_std, nan=0.0))
+    vola_lo = np.minimum(lo + vola_window, hi)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        volatility = (std_sum[hi] - std_sum[vola_lo]) / (
+            std_count[hi] - std_count[vola_lo]
+        )
+
+    return {
+        "observations": n,
+        "close": closes,
+        "moving_average": moving_average,
+        "max_move": max_move,
+        "score": score,
+        "volatility": volatility,
+    }
+
+
+def rebalance_rows(index, start=None, end=None, frequency="M", warmup=0):
+    """
+    Input:  Panel date index, backtest range and rebalance frequency
+            ("M" monthly or "W" weekly).
+    Output: Row of the first trading day of every period, skipping periods
+            without ``warmup`` rows of history behind them.
+    """
+    rows = pd.Series(np.arange(len(index)), index=index)
+    if start is not None:
+        rows = rows[rows.index >= pd.Timestamp(start)]
+    if end is not None:
+        rows = rows[rows.index <= pd.Timestamp(end)]
+
+    rows = rows.groupby(rows.index.to_period(frequency)).first()
+    return rows[rows >= warmup].to_numpy()
+
+
+def run_backtest(
+    panel,
+    parameters,
+    start=None,
+    end=None,
+    initial_capital=100000.0,
+    frequency="M",
+    trading_days=TRADING_DAYS_IN_YEAR,
+    macro=None,
+):
+    """
+    Input:  Date x ticker price panel including the market ticker, model
+            parameters from helper.model_parameters, the backtest range and
+            optionally the macro observations for the regime check.
+    Output: Dict with the daily ``equity`` curve, one ``rebalances`` row per
+            rebalance date (regime, value, turnover, positions) and the
+            ``holdings`` chosen at each rebalance.
+    """
+    market = parameters["market"]
+    universe = panel.drop(columns=[market], errors="ignore")
+    tickers = universe.columns
+
+    rows = rebalance_rows(
+        panel.index, start=start, end=end, frequency=frequency, warmup=trading_days - 1
+    )
+    if not len(rows):
+        raise ValueError("not enough price history for the backtest range")
+
+    statistics = rolling_statistics(
+        universe,
+        rows,
+        trading_days=trading_days,
+        ma_window=MA_WINDOW,
+        gap_window=parameters["slope_window_days"],
+        vola_window=parameters["vola_window"],
+    )
+
+    market_closes = panel[market]
+    market_trend = market_closes.rolling(
+        parameters["trend_window_days"], min_periods=1
+    ).mean()
+    market_closes = market_closes.ffill()
+
+    cash = float(initial_capital)
+    holdings = pd.Series(dtype=np.float64)
+    quantities = np.zeros((len(rows), len(tickers)))
+    cash_balances = np.zeros(len(rows))
+    rebalances = []
+    holdings_history = []
+    unfiltered = []
+
+    for i, row in enumerate(rows):
+        date = panel.index[row]
+        prices = pd.Series(statistics["close"][i], index=tickers)
+        value = cash + float((holdings * prices.loc[holdings.index]).sum())
+
+        screened = pd.DataFrame(
+            {
+                "score": statistics["score"][i],
+                "has_data": statistics["observations"][i] > 0,
+                "above_ma": statistics["close"][i] > statistics["moving_average"][i],
+                "within_gap": ~(
+                    statistics["max_move"][i] > parameters["max_stock_gap"]
+                ),
+                "above_minimum": ~(
+                    statistics["score"][i] <= parameters["minimum_score_momentum"]
+                ),
+            },
+            index=tickers,
+        )
+        ranking_table = rank(screened)
+
+        is_bull_market = market_closes.iloc[row] > market_trend.iloc[row]
+        if is_bull_market and macro is not None:
+            change = macro_yoy(macro, as_of=date)
+            # before a year of published observations the check is skipped
+            if np.isnan(change):
+                unfiltered.append(date)
+            else:
+                is_bull_market = change > 0.0
+
+        target = pd.Series(dtype=np.float64)
+        if is_bull_market:
+            kept_positions = [
+                ticker for ticker in holdings.index if ticker in ranking_table.index
+            ]
+            new_portfolio = select_portfolio(
+                ranking_table, kept_positions, parameters["portfolio_size"]
+            )
+
+            volatility = pd.Series(statistics["volatility"][i], index=tickers)[
+                new_portfolio.index
+            ]
+            volatility = volatility[np.isfinite(volatility) & (volatility > 0)]
+            weights = inverse_volatility_weights(volatility)
+
+            target = pd.Series(
+                {
+                    ticker: share_quantity(
+                        price=prices[ticker],
+                        weight=weights[ticker],
+                        portfolio_value=value,
+                    )
+                    for ticker in weights.index
+                },
+                dtype=np.float64,
+            )
+            target = target[target > 0]
+
+        trades = target.sub(holdings, fill_value=0.0)
+        traded_value = trades * prices.loc[trades.index]
+        cash -= float(traded_value.sum())
+        holdings = target
+
+        quantities[i] = holdings.reindex(tickers, fill_value=0.0).to_numpy()
+        cash_balances[i] = cash
+        rebalances.append(
+            {
+                "date": date,
+                "regime": "bull" if is_bull_market else "bear",
+                "value": value,
+                "turnover": float(traded_value.abs().sum()) / value if value else 0.0,
+                "positions": len(holdings),
+            }
+        )
+        for ticker, qty in holdings.items():
+            holdings_history.append(
+                {
+                    "date": date,
+                    "ticker": ticker,
+                    "qty": int(qty),
+                    "price": prices[ticker],
+                    "weight": qty * prices[ticker] / value,
+                }
+            )
+
+    if unfiltered:
+        log(
+            "No year over year macro change for {0} rebalances up to {1}, "
+            "skipped the macro check".format(
+                len(unfiltered), unfiltered[-1].strftime("%Y-%m-%d")
+            ),
+            "warning",
+        )
+
+    rebalances = pd.DataFrame(rebalances).set_index("date")
+    holdings = pd.DataFrame(
+        holdings_history, columns=["date", "ticker", "qty", "price", "weight"]
+    )
+
+    # hold each rebalance's quantities and cash until the next one
+    daily = panel.index[rows[0] :]
+    if end is not None:
+        daily = daily[daily <= pd.Timestamp(end)]
+    period = (
+        np.searchsorted(rows, np.arange(rows[0], rows[0] + len(daily)), "right") - 1
+    )
+    closes = universe.ffill().fillna(0.0).to_numpy()[rows[0] : rows[0] + len(daily)]
+    equity = pd.Series(
+        (quantities[period] * closes).sum(axis=1) + cash_balances[period],
+        index=daily,
+        name="equity",
+    )
+
+    return {"equity": equity, "rebalances": rebalances, "holdings": holdings}
+
+
+def performance(equity, rebalances, trading_days=TRADING_DAYS_IN_YEAR):
+    """
+    Input:  Equity curve and rebalance table from run_backtest.
+    Output: Dict of CAGR, maximum drawdown, annualized volatility and average
+            turnover per rebalance.
+    """
+    years = len(equity) / trading_days
+    total_return = equity.iloc[-1] / equity.iloc[0]
+    drawdown = equity / equity.cummax() - 1
+
+    return {
+        "cagr": total_return ** (1 / years) - 1 if years else np.nan,
+        "max_drawdown": drawdown.min(),
+        "volatility": equity.pct_change().std() * np.sqrt(trading_days),
+        "turnover": rebalances["turnover"].mean(),
+    }
+
+
+if __name__ == "__main__":
+    import sqlalchemy
+    from database import init_db
+    from dotenv import find_dotenv, load_dotenv
+    from macro import MacroData
+    from store import open_store
+    from trading_calendar import sessions_between
+    from universe import constituents
+
+    load_dotenv(find_dotenv())
+
+    arguments = argparse.ArgumentParser(description="Backtest the momentum algo")
+    arguments.add_argument("--start", required=True, help="first rebalance date")
+    arguments.add_argument("--end", default=None, help="last date of the backtest")
+    arguments.add_argument("--capital", type=float, default=100000.0)
+    arguments.add_argument("--frequency", default="M", choices=["M", "W"])
+    arguments.add_argument("--output", default="backtest", help="results directory")
+    args = arguments.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(f'{os.getenv("CONFIG_FILE_ABSOLUTE_PATH")}/algo_settings.cfg')
+    parameters = model_parameters(config["model"])
+
+    engine = sqlalchemy.create_engine("sqlite:///securities.db")
+    # tables and columns added since the database was created
+    init_db(engine)
+    db_session = sqlalchemy.orm.Session(bind=engine)
+    store = open_store(engine=engine, db_session=db_session)
+
+    companies = constituents(db_session, sources=os.getenv("SP_CONSITUENTS").split(","))
+
+    # enough history for the first rebalance's trailing window
+    trading_days = (
+        len(sessions_between(pd.Timestamp(args.start), datetime.now()))
+        + TRADING_DAYS_IN_YEAR
+    )
+    panel = store.history(
+        tickers=[company["Symbol"] for company in companies] + [parameters["market"]],
+        trading_days=trading_days,
+    )
+
+    # FRED is only called for history older than the cached observations
+    macro_data = MacroData(db_session)
+    try:
+        macro_data.backfill(args.start)
+    except Exception as e:
+        db_session.rollback()
+        log(f"{macro_data.series} backfill failed, using cache: {e}", "error")
+    macro = macro_data.observations(refresh=False)
+
+    results = run_backtest(
+        panel,
+        parameters,
+        start=args.start,
+        end=args.end,
+        initial_capital=args.capital,
+        frequency=args.frequency,
+        macro=macro if len(macro) else None,
+    )
+
+    os.makedirs(args.output, exist_ok=True)
+    results["equity"].to_csv(os.path.join(args.output, "equity.csv"))
+    results["rebalances"].to_csv(os.path.join(args.output, "rebalances.csv"))
+    results["holdings"].to_csv(os.path.join(args.output, "holdings.csv"), index=False)
+
+    for name, value in performance(results["equity"], results["rebalances"]).items():
+        log(f"{name}: {round(value, 4)}", "info")
@@ -0,0 +1,354 @@
+"""
+Benchmarks for the production hot paths.
+
+Builds synthetic price databases of the requested sizes and times the history
+load, the screen (vectorized over a panel, from one windowed history read,
+from cold and warm rolling states and the legacy per-ticker momentum_score),
+the weighting step, the ingestion write path against a fake Alpaca client and a dry-run rebalance against
+broker.SimulatedBroker and a fake FRED. Results are saved as JSON so runs can
+be compared:
+
+    python benchmark.py --tickers 500,1500 --years 2,10 --repeat 3 \
+        --output benchmarks --compare benchmarks/baseline.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from log import flush, log
+
+TRADING_DAYS_IN_YEAR = 252
+UNIX_EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+PARAMETERS = {
+    "trend_window_days": 200,
+    "vola_window": 20,
+    "portfolio_size": 20,
+    "minimum_score_momentum": 40.0,
+    "slope_window_days": 125,
+    "max_stock_gap": 0.15,
+    "market": "SPY",
+}
+
+
+def session_index(ordinals):
+    return pd.to_datetime(np.asarray(ordinals) - UNIX_EPOCH_ORDINAL, unit="D")
+
+
+def synthetic_closes(tickers, days, seed=0):
+    """
+    Input:  Tickers, number of business days and random seed.
+    Output: Date x ticker panel of geometric random walk closes over the
+            sessions ending with the last complete one.
+    """
+    from trading_calendar import sessions_between, window_start
+
+    rng = np.random.default_rng(seed)
+    index = session_index(sessions_between(window_start(days), datetime.now()))
+    drift = rng.normal(0.0004, 0.0006, len(tickers))
+    returns = rng.normal(drift, 0.015, (days, len(tickers)))
+    closes = 50.0 * np.exp(np.cumsum(returns, axis=0))
+
+    return pd.DataFrame(closes, index=index, columns=tickers)
+
+
+def synthetic_database(path, n_tickers, years, seed=0):
+    """
+    Input:  Directory, number of tickers (plus the market), years of history.
+    Output: (engine, db_session, tickers) for a SQLite database holding the
+            synthetic closes and a constituent snapshot of the tickers.
+    """
+    import models
+    from database import Base
+
+    tickers = [f"T{i:05d}" for i in range(n_tickers)]
+    panel = synthetic_closes(
+        tickers + [PARAMETERS["market"]], years * TRADING_DAYS_IN_YEAR, seed
+    )
+
+    engine = sqlalchemy.create_engine(f"sqlite:///{os.path.join(path, 'bench.db')}")
+    Base.metadata.create_all(bind=engine)
+
+    dates = [day.to_pydatetime() for day in panel.index]
+    with engine.begin() as connection:
+        connection.execute(
+            models.Security.__table__.insert(),
+            [
+                {"id": i + 1, "ticker": ticker, "name": ticker, "type": "stock"}
+                for i, ticker in enumerate(panel.columns)
+            ],
+        )
+        for i, ticker in enumerate(panel.columns):
+            connection.execute(
+                models.Price.__table__.insert(),
+                [
+                    {"security_id": i + 1, "date": date, "close": float(close)}
+                    for date, close in zip(dates, panel[ticker].to_numpy())
+                ],
+            )
+
+    db_session = sqlalchemy.orm.Session(bind=engine)
+    snapshot = models.ConstituentSnapshot("500", datetime.now())
+    db_session.add(snapshot)
+    db_session.flush()
+    db_session.add_all(
+        [
+            models.Constituent(snapshot_id=snapshot.id, ticker=ticker, name=ticker)
+            for ticker in tickers
+        ]
+    )
+    db_session.commit()
+
+    return engine, db_session, tickers
+
+
+class FakeAlpaca(object):
+    """
+    get_bars stand-in returning deterministic daily bars for every symbol.
+    """
+
+    def __init__(self, seed=0):
+        self.seed = seed
+        self.requests = 0
+
+    def get_bars(self, symbols, timeframe, start, end, adjustment=None):
+        self.requests += 1
+        from trading_calendar import sessions_between
+
+        days = session_index(sessions_between(pd.Timestamp(start), pd.Timestamp(end)))
+        panel = synthetic_closes(list(symbols), len(days), self.seed)
+        return [
+            SimpleNamespace(S=ticker, t=day.isoformat(), c=float(close))
+            for ticker in panel.columns
+            for day, close in zip(days, panel[ticker].to_numpy())
+        ]
+
+
+class FakeFred(object):
+    """
+    get_series stand-in for a steadily growing monthly series.
+    """
+
+    def get_series(self, series, observation_start=None, observation_end=None):
+        index = pd.date_range(observation_start, observation_end, freq="MS")
+        return pd.Series(100.0 + np.arange(len(index)), index=index)
+
+
+def timed(func, repeat, setup=None):
+    """
+    Input:  Callable to time, number of repeats and an optional setup callable
+            run untimed before each repeat.
+    Output: List of wall times in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            started = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - started)
+            flush()
+
+    return times
+
+
+def run_benchmarks(n_tickers, years, repeat=3, ingest_tickers=500):
+    """
+    Input:  Database size, repeats per benchmark and the number of tickers the
+            ingestion benchmark writes.
+    Output: List of result dicts with min, median and max wall time.
+    """
+    import models
+    from broker import BrokerSnapshot, SimulatedBroker
+    from helper import momentum_score
+    from ingestion import ingest_securities
+    from macro import MacroData
+    from pipeline import position_weights, run_rebalance
+    from rolling import RollingStatistics
+    from screener import rank, screen, screen_store
+    from store import SQLiteStore
+
+    path = tempfile.mkdtemp(prefix="bench-")
+    try:
+        log(f"Building {n_tickers} tickers x {years} years", "info")
+        engine, db_session, tickers = synthetic_database(path, n_tickers, years)
+        store = SQLiteStore(engine, db_session)
+        panel = store.history(tickers, TRADING_DAYS_IN_YEAR)
+        ranking = rank(screen(panel, minimum_score_momentum=0))
+        portfolio = ranking.head(PARAMETERS["portfolio_size"])
+
+        def clear_states():
+            db_session.query(models.RollingState).delete()
+            db_session.commit()
+
+        def screen_rolling():
+            RollingStatistics(store, db_session).screen(tickers)
+
+        def ingest():
+            ingest_path = tempfile.mkdtemp(prefix="ingest-", dir=path)
+            ingest_engine = sqlalchemy.create_engine(
+                f"sqlite:///{os.path.join(ingest_path, 'ingest.db')}"
+            )
+            models.Base.metadata.create_all(bind=ingest_engine)
+            ingest_session = sqlalchemy.orm.Session(bind=ingest_engine)
+            ingest_securities(
+                FakeAlpaca(),
+                RollingStatistics(
+                    SQLiteStore(ingest_engine, ingest_session), ingest_session
+                ),
+                [
+                    {"ticker": ticker, "name": ticker, "type": "stock"}
+                    for ticker in tickers[:ingest_tickers]
+                ],
+                requests_per_minute=10**9,
+            )
+            ingest_session.close()
+            ingest_engine.dispose()
+
+        def rebalance():
+            broker = BrokerSnapshot(
+                SimulatedBroker(prices=dict(panel.iloc[-1].dropna()))
+            )
+            run_rebalance(
+                PARAMETERS,
+                broker,
+                RollingStatistics(store, db_session),
+                db_session,
+                dry_run=True,
+                macro=MacroData(db_session, fred=FakeFred()),
+            )
+
+        os.environ.setdefault("SP_CONSITUENTS", "500")
+        benchmarks = [
+            ("history", lambda: store.history(tickers, TRADING_DAYS_IN_YEAR), None),
+            ("screen_panel", lambda: screen(panel), None),
+            ("screen_windows", lambda: screen_store(store, tickers), None),
+            ("screen_rolling_cold", screen_rolling, clear_states),
+            ("screen_rolling_warm", screen_rolling, None),
+            (
+                "momentum_score",
+                lambda: [momentum_score(panel[ticker].dropna()) for ticker in tickers],
+                None,
+            ),
+            ("weight", lambda: position_weights(PARAMETERS, store, portfolio), None),
+            ("ingest", ingest, None),
+            ("rebalance", rebalance, None),
+        ]
+
+        results = []
+        for name, func, setup in benchmarks:
+            times = timed(func, repeat, setup=setup)
+            results.append(
+                {
+                    "benchmark": name,
+                    "tickers": n_tickers,
+                    "years": years,
+                    "repeat": repeat,
+                    "min": min(times),
+                    "median": statistics.median(times),
+                    "max": max(times),
+                }
+            )
+            log(
+                "{0} ({1} x {2}y): {3}s median".format(
+                    name, n_tickers, years, round(statistics.median(times), 4)
+                ),
+                "info",
+            )
+
+        db_session.close()
+        engine.dispose()
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+    return results
+
+
+def compare(results, baseline, threshold=0.1):
+    """
+    Input:  Results of this run and of a saved run, and the relative change
+            reported as a regression or speedup.
+    Output: List of (benchmark, tickers, years, ratio) for every benchmark in
+            both runs, ratio being the new median over the baseline one.
+    """
+    previous = {
+        (result["benchmark"], result["tickers"], result["years"]): result["median"]
+        for result in baseline["results"]
+    }
+
+    ratios = []
+    for result in results:
+        key = (result["benchmark"], result["tickers"], result["years"])
+        if key not in previous or not previous[key]:
+            continue
+
+        ratio = result["median"] / previous[key]
+        ratios.append(key + (ratio,))
+        if ratio > 1 + threshold:
+            type = "error"
+        elif ratio < 1 - threshold:
+            type = "success"
+        else:
+            type = "info"
+        log("{0} ({1} x {2}y): {3}x baseline".format(*key, round(ratio, 3)), type)
+
+    return ratios
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Benchmark the hot paths")
+    arguments.add_argument("--tickers", default="500", help="e.g. 500,1500,5000")
+    arguments.add_argument("--years", default="2", help="e.g. 2,10")
+    arguments.add_argument("--repeat", type=int, default=3)
+    arguments.add_argument(
+        "--ingest-tickers", type=int, default=500, help="tickers the ingest writes"
+    )
+    arguments.add_argument("--output", default="benchmarks", help="results directory")
+    arguments.add_argument("--compare", default=None, help="saved results to compare")
+    args = arguments.parse_args()
+
+    results = []
+    for n_tickers in [int(value) for value in args.tickers.split(",")]:
+        for years in [int(value) for value in args.years.split(",")]:
+            results += run_benchmarks(
+                n_tickers,
+                years,
+                repeat=args.repeat,
+                ingest_tickers=args.ingest_tickers,
+            )
+
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(
+        args.output,
+        "benchmark-{0}.json".format(datetime.now().strftime("%Y%m%d-%H%M%S")),
+    )
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "created_at": datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "processor": platform.processor(),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    log(f"Results written to {path}", "success")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
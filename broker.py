@@ -0,0 +1,160 @@
+"""
+Broker state snapshot.
+
+Fetches the account, open positions and asset tradability from Alpaca in
+bulk once per run and serves every later lookup from memory. Any object
+exposing the Alpaca REST calls used here (get_account, list_positions,
+list_assets, get_asset) can be passed as ``api``. SimulatedBroker is an
+in-memory one for tests.
+"""
+
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+
+class BrokerSnapshot(object):
+    def __init__(self, api):
+        self.api = api
+        self.calls = 0
+        self.lookups = 0
+        self.refresh()
+
+    def _call(self, method, *args, **kwargs):
+        self.calls += 1
+        return getattr(self.api, method)(*args, **kwargs)
+
+    def refresh(self):
+        self.account = self._call("get_account")
+        self._positions = {
+            position.symbol: position for position in self._call("list_positions")
+        }
+        self._tradable = {
+            asset.symbol: asset.tradable
+            for asset in self._call("list_assets", status="active")
+        }
+
+    @property
+    def portfolio_value(self):
+        return round(float(self.account.equity), 3)
+
+    def positions(self):
+        self.lookups += 1
+        return list(self._positions.values())
+
+    def position(self, symbol):
+        self.lookups += 1
+        return self._positions.get(symbol)
+
+    def is_tradable(self, symbol):
+        self.lookups += 1
+        if symbol not in self._tradable:
+            # inactive assets are missing from the bulk listing
+            self._tradable[symbol] = self._call("get_asset", symbol).tradable
+
+        return self._tradable[symbol] is True
+
+    @property
+    def saved_calls(self):
+        # the account is fetched either way; every lookup would otherwise
+        # have been its own request
+        return max(self.lookups + 1 - self.calls, 0)
+
+
+class SimulatedBroker(object):
+    """
+    In-memory stand-in for the Alpaca REST client. Market orders fill at the
+    given prices ``fill_delay`` seconds after submission, at most
+    ``liquidity[symbol]`` shares per order listing, so larger orders are
+    partially filled over several polls; orders for symbols without a price
+    are rejected.
+    """
+
+    def __init__(
+        self,
+        equity=100000.0,
+        positions=None,
+        prices=None,
+        untradable=(),
+        fill_delay=0.0,
+        liquidity=None,
+        clock=time.monotonic,
+    ):
+        self.equity = equity
+        self.positions = dict(positions or {})
+        self.prices = dict(prices or {})
+        self.untradable = set(untradable)
+        self.fill_delay = fill_delay
+        self.liquidity = dict(liquidity or {})
+        self.clock = clock
+        self.orders = {}
+        self.lock = threading.Lock()
+
+    def get_account(self):
+        return SimpleNamespace(equity=str(self.equity))
+
+    def list_positions(self):
+        return [
+            SimpleNamespace(symbol=symbol, qty=str(qty))
+            for symbol, qty in self.positions.items()
+            if qty
+        ]
+
+    def get_position(self, symbol):
+        return SimpleNamespace(symbol=symbol, qty=str(self.positions[symbol]))
+
+    def list_assets(self, status=None):
+        return [
+            SimpleNamespace(symbol=symbol, tradable=symbol not in self.untradable)
+            for symbol in set(self.prices) | set(self.positions)
+        ]
+
+    def get_asset(self, symbol):
+        return SimpleNamespace(symbol=symbol, tradable=symbol not in self.untradable)
+
+    def submit_order(self, symbol, qty, side, type="market", time_in_force="day"):
+        with self.lock:
+            order = SimpleNamespace(
+                id=str(uuid.uuid4()),
+                symbol=symbol,
+                qty=str(qty),
+                side=side,
+                status="new" if symbol in self.prices else "rejected",
+                filled_qty="0",
+                filled_avg_price=None,
+                submitted_at=self.clock(),
+            )
+            self.orders[order.id] = order
+
+        return order
+
+    def _fill(self, order):
+        if order.status not in ("new", "partially_filled"):
+            return
+        if self.clock() - order.submitted_at < self.fill_delay:
+            return
+
+        filled_qty = int(order.filled_qty)
+        qty = min(
+            int(order.qty) - filled_qty,
+            self.liquidity.get(order.symbol, int(order.qty)),
+        )
+        order.filled_qty = str(filled_qty + qty)
+        order.status = (
+            "filled" if int(order.filled_qty) == int(order.qty) else "partially_filled"
+        )
+        order.filled_avg_price = str(self.prices[order.symbol])
+        self.positions[order.symbol] = self.positions.get(order.symbol, 0) + (
+            qty if order.side == "buy" else -qty
+        )
+
+    def list_orders(self, status=None, symbols=None, limit=None, **kwargs):
+        with self.lock:
+            orders = []
+            for order in self.orders.values():
+                self._fill(order)
+                if symbols is None or order.symbol in symbols:
+                    orders.append(order)
+
+        return orders[:limit]
@@ -0,0 +1,358 @@
+"""
+Resident scheduler for ingest and rebalance jobs.
+
+Instead of cold-starting ``python ingest.py && python algo_momentum.py`` from
+cron, the daemon imports everything once and keeps the database session, the
+price store with its rolling states and cache and the Alpaca client warm
+between jobs. Jobs run one at a time on the main thread; a small HTTP server
+reports their health and accepts run-now triggers:
+
+    python daemon.py
+    curl localhost:8080/health
+    curl localhost:8080/metrics
+    curl -X POST localhost:8080/run/rebalance
+
+Schedules come from the environment: INGEST_DAYS/INGEST_TIME (default
+weekdays at 16:30, after the close, so the ingest picks up that day's bar)
+and REBALANCE_DAYS/REBALANCE_TIME (default Wednesdays at 11:00). Times are
+New York time whatever the host's timezone. Days are ``weekdays``,
+``daily``, weekday names (``mon,wed``) or days of the month (``1``).
+"""
+
+import configparser
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from log import log
+
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+
+class Schedule(object):
+    """
+    Runs at ``at`` (HH:MM) on the given weekdays (0 is Monday) or days of
+    the month.
+    """
+
+    def __init__(self, at, weekdays=None, monthdays=None):
+        hour, minute = at.split(":")
+        self.at = (int(hour), int(minute))
+        self.weekdays = set(weekdays) if weekdays is not None else None
+        self.monthdays = set(monthdays) if monthdays is not None else None
+
+    def _matches(self, day):
+        if self.weekdays is not None and day.weekday() not in self.weekdays:
+            return False
+        if self.monthdays is not None and day.day not in self.monthdays:
+            return False
+        return True
+
+    def next_run(self, after):
+        day = after.date()
+        for _ in range(366):
+            candidate = datetime(day.year, day.month, day.day, *self.at)
+            if candidate > after and self._matches(day):
+                return candidate
+            day += timedelta(days=1)
+
+        raise ValueError("schedule never runs")
+
+
+def parse_schedule(days, at):
+    """
+    Input:  Days specification and HH:MM time.
+    Output: Schedule.
+    """
+    days = days.strip().lower()
+    if days == "daily":
+        return Schedule(at)
+    if days == "weekdays":
+        return Schedule(at, weekdays=range(5))
+
+    values = [value.strip() for value in days.split(",")]
+    if all(value in WEEKDAYS for value in values):
+        return Schedule(at, weekdays=[WEEKDAYS.index(value) for value in values])
+    if all(value.isdigit() and 1 <= int(value) <= 31 for value in values):
+        return Schedule(at, monthdays=[int(value) for value in values])
+
+    raise ValueError('invalid schedule days: "%s"' % days)
+
+
+class Daemon(object):
+    def __init__(self, jobs, clock=datetime.now, on_error=None):
+        """
+        Input:  Dict of job name to (callable, Schedule) and an optional
+                on_error(name, exception) called after a job raises, e.g. to
+                roll back the shared database session.
+        """
+        self.clock = clock
+        self.on_error = on_error
+        self.started_at = clock()
+        self.triggers = queue.Queue()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.jobs = {}
+        for name, (func, schedule) in jobs.items():
+            self.jobs[name] = {
+                "func": func,
+                "schedule": schedule,
+                "next_run": schedule.next_run(self.started_at),
+                "last_run": None,
+                "last_duration": None,
+                "last_error": None,
+                "status": "idle",
+                "runs": 0,
+                "failures": 0,
+            }
+
+    def trigger(self, name):
+        if name not in self.jobs:
+            raise KeyError(name)
+        self.triggers.put(name)
+
+    def status(self):
+        with self.lock:
+            jobs = {
+                name: {
+                    key: (value.isoformat() if isinstance(value, datetime) else value)
+                    for key, value in job.items()
+                    if key not in ("func", "schedule")
+                }
+                for name, job in self.jobs.items()
+            }
+
+        return {
+            "status": (
+                "ok"
+                if all(job["last_error"] is None for job in jobs.values())
+                else "degraded"
+            ),
+            "started_at": self.started_at.isoformat(),
+            "pending_triggers": self.triggers.qsize(),
+            "jobs": jobs,
+        }
+
+    def run_job(self, name):
+        job = self.jobs[name]
+        with self.lock:
+            job["status"] = "running"
+            job["last_run"] = self.clock()
+
+        log(f"Running {name}", "info")
+        started = time.monotonic()
+        error = None
+        try:
+            job["func"]()
+        except Exception as e:
+            error = str(e)
+            traceback.print_exc()
+            if self.on_error is not None:
+                try:
+                    self.on_error(name, e)
+                except Exception:
+                    traceback.print_exc()
+
+        duration = time.monotonic() - started
+        with self.lock:
+            job["status"] = "idle"
+            job["runs"] += 1
+            job["last_duration"] = round(duration, 3)
+            job["last_error"] = error
+            if error is not None:
+                job["failures"] += 1
+
+        if error is None:
+            log(f"{name} finished in {round(duration, 3)}s", "success")
+        else:
+            log(f"{name} failed after {round(duration, 3)}s: {error}", "error")
+
+    def run_forever(self, poll_seconds=60):
+        while not self.stopped.is_set():
+            now = self.clock()
+            due = [name for name, job in self.jobs.items() if job["next_run"] <= now]
+            for name in due:
+                self.run_job(name)
+                with self.lock:
+                    self.jobs[name]["next_run"] = self.jobs[name]["schedule"].next_run(
+                        self.clock()
+                    )
+            if due:
+                continue
+
+            wait = min(job["next_run"] for job in self.jobs.values()) - now
+            try:
+                name = self.triggers.get(
+                    timeout=min(max(wait.total_seconds(), 0), poll_seconds)
+                )
+            except queue.Empty:
+                continue
+            if name is not None:
+                self.run_job(name)
+
+    def stop(self):
+        self.stopped.set()
+        self.triggers.put(None)
+
+
+def serve_status(daemon, host="127.0.0.1", port=8080, metrics=None):
+    """
+    Input:  Daemon, the address to listen on and optionally a callable
+            returning Prometheus text for GET /metrics.
+    Output: Running HTTPServer serving GET /health and POST /run/<job> from a
+            background thread.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code, body):
+            content = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/health":
+                status = daemon.status()
+                self._reply(200 if status["status"] == "ok" else 503, status)
+            elif self.path.rstrip("/") == "/metrics" and metrics is not None:
+                content = metrics().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            prefix = "/run/"
+            name = self.path[len(prefix) :].strip("/")
+            if not self.path.startswith(prefix) or name not in daemon.jobs:
+                self._reply(404, {"error": "unknown job"})
+                return
+
+            daemon.trigger(name)
+            self._reply(202, {"queued": name})
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+if __name__ == "__main__":
+    import alpaca_trade_api as tradeapi
+    import sqlalchemy
+    from broker import BrokerSnapshot
+    from database import init_db
+    from dotenv import find_dotenv, load_dotenv
+    from helper import str2bool
+    from ingest import ingest_universe
+    from instrumentation import RunReport
+    from pipeline import run_rebalance
+    from rolling import RollingStatistics
+    from store import open_store
+    from trading_calendar import EXCHANGE_TIMEZONE
+
+    load_dotenv(find_dotenv())
+
+    # warm state shared by every job
+    alpaca_api = tradeapi.REST(
+        os.getenv("ALPACA_KEY_ID"),
+        os.getenv("ALPACA_SECRET_KEY"),
+        base_url=os.getenv("ALPACA_BASE_URL"),
+    )
+    engine = sqlalchemy.create_engine("sqlite:///securities.db")
+    # tables and columns added since the database was created
+    init_db(engine)
+    db_session = sqlalchemy.orm.Session(bind=engine, expire_on_commit=False)
+    # the screen and the weighting both read the rolling states
+    store = RollingStatistics(
+        open_store(engine=engine, db_session=db_session), db_session
+    )
+
+    # latest run report of each instrumented job, served on /metrics
+    reports = {}
+
+    def ingest():
+        ingest_universe(alpaca_api, store, db_session)
+
+    def rebalance():
+        # states are re-read from the database once per rebalance
+        store.reset()
+        # bring prices up to date first, as the cron job did
+        ingest()
+
+        config = configparser.ConfigParser()
+        config.read(f'{os.getenv("CONFIG_FILE_ABSOLUTE_PATH")}/algo_settings.cfg')
+
+        run_report = RunReport()
+        reports["rebalance"] = run_report
+
+        # positions and the account are read fresh for every rebalance
+        with run_report.stage("broker"):
+            broker = BrokerSnapshot(alpaca_api)
+        result = run_rebalance(
+            config["model"],
+            broker,
+            store,
+            db_session,
+            live_trade=str2bool(os.getenv("LIVE_TRADE", False)),
+            run_report=run_report,
+        )
+        if result is None:
+            raise RuntimeError("no equities passed momentum screening")
+
+    def recover(name, error):
+        # a failed flush leaves the shared session unusable until rolled
+        # back, and the states loaded by the job may be rolled back with it
+        db_session.rollback()
+        store.reset()
+
+    def exchange_time():
+        return datetime.now(EXCHANGE_TIMEZONE).replace(tzinfo=None)
+
+    daemon = Daemon(
+        {
+            "ingest": (
+                ingest,
+                parse_schedule(
+                    os.getenv("INGEST_DAYS", "weekdays"),
+                    os.getenv("INGEST_TIME", "16:30"),
+                ),
+            ),
+            "rebalance": (
+                rebalance,
+                parse_schedule(
+                    os.getenv("REBALANCE_DAYS", "wed"),
+                    os.getenv("REBALANCE_TIME", "11:00"),
+                ),
+            ),
+        },
+        clock=exchange_time,
+        on_error=recover,
+    )
+    serve_status(
+        daemon,
+        host=os.getenv("DAEMON_HOST", "127.0.0.1"),
+        port=int(os.getenv("DAEMON_PORT", 8080)),
+        metrics=lambda: "".join(report.prometheus() for report in reports.values()),
+    )
+
+    for name, job in daemon.jobs.items():
+        log(f"{name} next runs at {job['next_run']}", "info")
+
+    try:
+        daemon.run_forever()
+    except KeyboardInterrupt:
+        daemon.stop()
@@ -1,7 +1,7 @@
 import os
 
 from dotenv import find_dotenv, load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import scoped_session, sessionmaker
 
@@ -10,7 +10,10 @@ load_dotenv(find_dotenv())
 PROJECT_ROOT = os.path.dirname(os.path.realpath(__file__))
 DATABASE = os.path.join(PROJECT_ROOT, os.getenv("DATABASE_NAME", "securities.db"))
 
-engine = create_engine(f"sqlite:///{DATABASE}", echo=True)
+# SQL_ECHO=true prints every statement
+engine = create_engine(
+    f"sqlite:///{DATABASE}", echo=os.getenv("SQL_ECHO", "").lower() in ("1", "true")
+)
 db_session = scoped_session(
     sessionmaker(autocommit=False, autoflush=False, bind=engine)
 )
@@ -19,10 +22,47 @@ Base = declarative_base()
 Base.query = db_session.query_property()
 
 
-def init_db():
+def init_db(bind=None):
     # import all modules here that might define models so that
     # they will be registered properly on the metadata.  Otherwise
     # you will have to import them first before calling init_db()
     import models
 
-    Base.metadata.create_all(bind=engine)
+    # creates missing tables only, so entry points run it before every job
+    Base.metadata.create_all(bind=bind or engine)
+    migrate_db(bind)
+
+
+def migrate_db(bind=None):
+    with (bind or engine).begin() as connection:
+        # the OHLCV columns were added after the price table
+        columns = {
+            row[1] for row in connection.execute(text("PRAGMA table_info(price)"))
+        }
+        for column in ["open", "high", "low", "volume"]:
+            if column not in columns:
+                connection.execute(text(f"ALTER TABLE price ADD COLUMN {column} FLOAT"))
+
+        # existing databases predate the unique (security_id, date) index, so
+        # drop duplicate rows before creating it
+        exists = connection.execute(
+            text(
+                "SELECT 1 FROM sqlite_master "
+                "WHERE type = 'index' AND name = 'ix_price_security_id_date'"
+            )
+        ).first()
+        if exists:
+            return
+
+        connection.execute(
+            text(
+                "DELETE FROM price WHERE id NOT IN "
+                "(SELECT MIN(id) FROM price GROUP BY security_id, date)"
+            )
+        )
+        connection.execute(
+            text(
+                "CREATE UNIQUE INDEX ix_price_security_id_date "
+                "ON price (security_id, date)"
+            )
+        )
@@ -10,6 +10,11 @@ init_db()
 echo "📥 Ingesting equities once..."
 python ingest.py
 
+if [ "${RUN_MODE}" = "daemon" ]; then
+  echo "🚀 Starting scheduler daemon..."
+  exec python daemon.py
+fi
+
 echo "📝 Creating cron log..."
 touch /var/log/cron.log
 
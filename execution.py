@@ -0,0 +1,162 @@
+"""
+Concurrent order execution.
+
+A rebalance queues its orders and submits them in two waves, sells before
+buys so the sale proceeds are available as buying power. Each wave is sent
+concurrently over a bounded pool of workers and then reconciled by polling
+the broker's order list in batches until every order reaches a final status
+or the timeout passes. Any object exposing the Alpaca ``submit_order`` and
+``list_orders`` calls, such as broker.SimulatedBroker, can be passed as
+``api``.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from helper import ALPACA_SYMBOLS_PER_REQUEST
+from log import log
+
+BUY = "buy"
+SELL = "sell"
+
+# statuses after which Alpaca no longer changes an order
+FINAL_ORDER_STATUSES = {
+    "filled",
+    "canceled",
+    "expired",
+    "rejected",
+    "replaced",
+    "done_for_day",
+}
+
+
+class OrderExecutor(object):
+    def __init__(
+        self,
+        api,
+        workers=8,
+        poll_interval=1.0,
+        timeout=60.0,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        self.api = api
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.clock = clock
+        self.sleep = sleep
+        self.orders = []
+        self.requests = 0
+
+    def queue(self, symbol, side, qty):
+        self.orders.append(
+            {"symbol": symbol, "side": side, "qty": abs(int(float(qty)))}
+        )
+
+    def _submit(self, order):
+        started = self.clock()
+        try:
+            submitted = self.api.submit_order(
+                symbol=order["symbol"],
+                time_in_force="day",
+                side=order["side"],
+                type="market",
+                qty=order["qty"],
+            )
+        except Exception as e:
+            order.update(status="error", error=str(e))
+            log(f"{order['symbol']} {order['side']} order failed: {e}", "error")
+        else:
+            order.update(id=submitted.id, status=submitted.status)
+        order["submitted_at"] = self.clock()
+        order["submit_latency"] = order["submitted_at"] - started
+
+        return order
+
+    def _reconcile(self, orders):
+        pending = {order["id"]: order for order in orders if "id" in order}
+        deadline = self.clock() + self.timeout
+
+        while pending:
+            symbols = sorted({order["symbol"] for order in pending.values()})
+            for i in range(0, len(symbols), ALPACA_SYMBOLS_PER_REQUEST):
+                self.requests += 1
+                for update in self.api.list_orders(
+                    status="all",
+                    symbols=symbols[i : i + ALPACA_SYMBOLS_PER_REQUEST],
+                    limit=500,
+                ):
+                    order = pending.get(update.id)
+                    if order is None:
+                        continue
+
+                    order["status"] = update.status
+                    order["filled_qty"] = float(update.filled_qty or 0)
+                    if update.filled_avg_price is not None:
+                        order["filled_avg_price"] = float(update.filled_avg_price)
+                    if update.status in FINAL_ORDER_STATUSES:
+                        order["fill_latency"] = self.clock() - order["submitted_at"]
+                        del pending[update.id]
+
+            if not pending or self.clock() >= deadline:
+                break
+            self.sleep(self.poll_interval)
+
+        for order in pending.values():
+            log(
+                f"{order['symbol']} {order['side']} order still {order['status']}",
+                "warning",
+            )
+
+    def _wave(self, side):
+        orders = [
+            order for order in self.orders if order["side"] == side and order["qty"]
+        ]
+        if not orders:
+            return []
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(self._submit, orders))
+        # one submit request per order, counted here rather than on the
+        # workers so no increment is lost
+        self.requests += len(orders)
+        self._reconcile(orders)
+
+        return orders
+
+    def execute(self):
+        """
+        Output: The queued orders as dicts with the broker ``id``, final
+                ``status``, ``filled_qty``, ``filled_avg_price`` and the
+                ``submit_latency`` and ``fill_latency`` in seconds.
+        """
+        started = self.clock()
+        orders = self._wave(SELL) + self._wave(BUY)
+        self.elapsed = self.clock() - started
+
+        filled = [order for order in orders if order.get("status") == "filled"]
+        log(
+            "{0}/{1} orders filled in {2}s".format(
+                len(filled), len(orders), round(self.elapsed, 3)
+            ),
+            "success" if len(filled) == len(orders) else "warning",
+        )
+        for order in orders:
+            log(
+                "{0} {1} {2}: {3}, submit {4}s, fill {5}".format(
+                    order["side"],
+                    order["qty"],
+                    order["symbol"],
+                    order["status"],
+                    round(order["submit_latency"], 3),
+                    (
+                        f"{round(order['fill_latency'], 3)}s"
+                        if "fill_latency" in order
+                        else "-"
+                    ),
+                ),
+                "info",
+            )
+
+        return orders
@@ -1,7 +1,11 @@
 """
 Helper functions.
+
+lxml, scipy and the Alpaca client are imported inside the functions that use
+them, so importing this module stays cheap.
 """
 
+import itertools
 import math
 import time
 from datetime import datetime, timedelta
@@ -9,15 +13,14 @@ from datetime import datetime, timedelta
 import models
 import numpy as np
 import pandas as pd
-import requests
 import sqlalchemy
-from alpaca_trade_api.rest import TimeFrame
-from dateutil import parser as time_parser
 from log import log
-from lxml import html
-from pandas.tseries.offsets import BDay
-from scipy import stats
-from sqlalchemy.sql import text
+from trading_calendar import last_session, next_session, window_start
+
+SQLITE_MAX_VARIABLES = 900
+# keeps the comma separated symbols query parameter well under URL limits
+ALPACA_SYMBOLS_PER_REQUEST = 100
+HISTORY_ROWS_PER_FETCH = 10000
 
 
 def str2bool(value):
@@ -41,199 +44,199 @@ def str2bool(value):
         raise ValueError('invalid literal for boolean: "%s"' % value)
 
 
-def last_trading_day_of_week(ref_date=None):
+WIKI_CONSTITUENT_PAGES = {
+    "500": (
+        "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies",
+        "S&P 500 Large-Cap",
+    ),
+    "400": (
+        "https://en.wikipedia.org/wiki/List_of_S%26P_400_companies",
+        "S&P 400 Mid-Cap",
+    ),
+    "600": (
+        "https://en.wikipedia.org/wiki/List_of_S%26P_600_companies",
+        "S&P 600 Small-Cap",
+    ),
+    "aristocrats": (
+        "https://en.wikipedia.org/wiki/S%26P_500_Dividend_Aristocrats",
+        "S&P 500 Dividend Aristocrats",
+    ),
+}
+
+
+def parse_wiki_constituents_page(source, page):
     """
-    Returns the last trading day (Friday) of the current week based on ref_date.
-    If today is a weekend (Saturday or Sunday), returns the previous Friday.
+    Input:  Constituent list source ("500", "400", "600" or "aristocrats") and
+            the Wikipedia page HTML.
+    Output: List of {"Symbol", "Name"} dicts.
     """
-    if ref_date is None:
-        ref_date = datetime.now()
+    from lxml import html
 
-    weekday = ref_date.weekday()  # Monday=0, Sunday=6
+    mainTree = html.fromstring(page)
 
-    if weekday >= 5:
-        # Saturday (5) or Sunday (6): go back to last Friday
-        days_to_subtract = weekday - 4
-        last_friday = ref_date - timedelta(days=days_to_subtract)
-    else:
-        # Weekday: compute Friday of current week
-        days_to_add = 4 - weekday
-        last_friday = ref_date + timedelta(days=days_to_add)
+    companies = []
+    for row in mainTree.xpath('//table[contains(@id, "constituents")]/tbody/tr'):
+        if not len(row.xpath("td")):
+            continue
+
+        if source == "500":
+            company = {
+                "Symbol": row.xpath("td/a/text()")[0],
+                "Name": row.xpath("td/a/text()")[1],
+            }
+        elif source == "400":
+            company = {
+                "Symbol": row.xpath("td[1]/a/text()")[0].strip(),
+                "Name": row.xpath("td[2]/a/text()")[0],
+            }
+        elif source == "600":
+            company = {
+                "Symbol": row.xpath("td[1]/descendant::text()")[0].strip(),
+                "Name": row.xpath("td[2]/descendant::text()")[0].strip(),
+            }
+        else:
+            company = {
+                "Symbol": row.xpath("td[2]/descendant::text()")[0].strip(),
+                "Name": row.xpath("td[1]/descendant::text()")[0].strip(),
+            }
+        companies.append(company)
 
-    return last_friday.date()
+    return companies
 
 
-def parse_wiki_sp_consituents(sources=[]):
-    companies = []
-    if "500" in sources:
-        log("\nParsing S&P 500 Large-Cap Wiki Constituents", "info")
-        response = requests.get(
-            "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
-        )
-        mainTree = html.fromstring(response.text)
-
-        companies500 = []
-        for row in mainTree.xpath('//table[contains(@id, "constituents")]/tbody/tr'):
-            if len(row.xpath("td")):
-                companies500.append(
-                    {
-                        "Symbol": row.xpath("td/a/text()")[0],
-                        "Name": row.xpath("td/a/text()")[1],
-                    }
-                )
+def price_histories(api, tickers, start_date, end_date):
+    """
+    Input:  Tickers sharing the same start/end window.
+    Output: Dict of ticker to bars, from one multi-symbol request. The Alpaca
+            client follows next_page_token until every page is read.
+    """
+    from alpaca_trade_api.rest import TimeFrame
 
-        log(
-            "{0} Companies found on Wikipedia: S&P 500 Constituents Page".format(
-                len(companies500)
-            ),
-            "success",
+    histories = {ticker: [] for ticker in tickers}
+    try:
+        bars = api.get_bars(
+            list(tickers),
+            TimeFrame.Day,
+            start_date.strftime("%Y-%m-%d"),
+            end_date.strftime("%Y-%m-%d"),
+            adjustment="raw",
         )
-        companies += companies500
+    except TypeError as te:
+        log("{}\n".format(te), "error")
+        return histories
 
-    if "400" in sources:
-        log("\nParsing S&P 400 Mid-Cap Wiki Constituents", "info")
-        response = requests.get(
-            "https://en.wikipedia.org/wiki/List_of_S%26P_400_companies"
-        )
-        mainTree = html.fromstring(response.text)
-
-        companies400 = []
-        for row in mainTree.xpath('//table[contains(@id, "constituents")]/tbody/tr'):
-            if len(row.xpath("td")):
-                companies400.append(
-                    {
-                        "Symbol": row.xpath("td[1]/a/text()")[0].strip(),
-                        "Name": row.xpath("td[2]/a/text()")[0],
-                    }
-                )
+    for bar in bars:
+        histories.setdefault(bar.S, []).append(bar)
 
-        log(
-            "{0} Companies found on Wikipedia: S&P 400 Constituents Page".format(
-                len(companies400)
-            ),
-            "success",
-        )
-        companies += companies400
+    return histories
 
-    if "600" in sources:
-        log("\nParsing S&P 600 Small-Cap Wiki Constituents", "info")
-        response = requests.get(
-            "https://en.wikipedia.org/wiki/List_of_S%26P_600_companies"
-        )
-        mainTree = html.fromstring(response.text)
-
-        companies600 = []
-        for row in mainTree.xpath('//table[contains(@id, "constituents")]/tbody/tr'):
-            if len(row.xpath("td")):
-                companies600.append(
-                    {
-                        "Symbol": row.xpath("td[1]/descendant::text()")[0].strip(),
-                        "Name": row.xpath("td[2]/descendant::text()")[0].strip(),
-                    }
-                )
 
-        log(
-            "{0} Companies found on Wikipedia: S&P 600 Constituents Page".format(
-                len(companies600)
-            ),
-            "success",
-        )
-        companies += companies600
-    if "aristocrats" in sources:
-        log("\nParsing S&P 500 Dividend Aristocrats", "info")
-        response = requests.get(
-            "https://en.wikipedia.org/wiki/S%26P_500_Dividend_Aristocrats"
+def corporate_actions(api, tickers, since, until, window_days=90):
+    """
+    Input:  Alpaca client, tickers of interest and the ex-date range.
+    Output: List of dicts with ``ticker``, ``type`` ("split" or "dividend"),
+            ``date`` (ex-date), ``ratio`` (old / new shares) and ``cash``
+            per share, for the announcements that already went ex.
+    """
+    tickers = set(tickers)
+    until = min(until, datetime.now())
+
+    actions = []
+    start = since
+    # the announcements endpoint accepts at most 90 days per request
+    while start <= until:
+        end = min(start + timedelta(days=window_days - 1), until)
+        # alpaca_trade_api has no wrapper for this endpoint, so it is called
+        # through the client's authenticated REST get
+        announcements = api.get(
+            "/corporate_actions/announcements",
+            {
+                "ca_types": "Dividend,Split",
+                "since": start.strftime("%Y-%m-%d"),
+                "until": end.strftime("%Y-%m-%d"),
+                "date_type": "ex_date",
+            },
         )
-        mainTree = html.fromstring(response.text)
-
-        companiesAristocrats = []
-        for row in mainTree.xpath('//table[contains(@id, "constituents")]/tbody/tr'):
-            if len(row.xpath("td")):
-                companiesAristocrats.append(
-                    {
-                        "Symbol": row.xpath("td[2]/descendant::text()")[0].strip(),
-                        "Name": row.xpath("td[1]/descendant::text()")[0].strip(),
-                    }
+        for announcement in announcements:
+            ticker = announcement.get("target_symbol") or announcement.get(
+                "initiating_symbol"
+            )
+            if ticker not in tickers or not announcement.get("ex_date"):
+                continue
+
+            action = {
+                "ticker": ticker,
+                "date": datetime.strptime(announcement["ex_date"], "%Y-%m-%d"),
+                "ratio": None,
+                "cash": None,
+            }
+            if announcement["ca_type"] == "split":
+                action["type"] = "split"
+                action["ratio"] = float(announcement["old_rate"]) / float(
+                    announcement["new_rate"]
                 )
-        companies += companiesAristocrats
-    return companies
+            elif announcement["ca_type"] == "dividend" and announcement.get("cash"):
+                action["type"] = "dividend"
+                action["cash"] = float(announcement["cash"])
+            else:
+                continue
+            actions.append(action)
 
+        start = end + timedelta(days=1)
 
-def price_history(api, ticker, start_date, end_date, print_test=False):
-    try:
-        return api.get_bars(
-            ticker,
-            TimeFrame.Day,
-            start_date.strftime("%Y-%m-%d"),
-            end_date.strftime("%Y-%m-%d"),
-            adjustment="all",
-        )
-    except TypeError as te:
-        log("{}\n".format(te), "error")
+    return actions
+
+
+def batch_windows(windows, batch_size=ALPACA_SYMBOLS_PER_REQUEST):
+    """
+    Input:  Iterable of (ticker, start_date, end_date).
+    Output: List of (tickers, start_date, end_date) requests, grouping tickers
+            that need the same window into chunks of at most batch_size.
+    """
+    groups = {}
+    for ticker, start_date, end_date in windows:
+        # requests are made by calendar day, so group on the day only
+        key = (start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"))
+        groups.setdefault(key, (start_date, end_date, []))[2].append(ticker)
 
-    return []
+    batches = []
+    for start_date, end_date, tickers in groups.values():
+        for i in range(0, len(tickers), batch_size):
+            batches.append((tickers[i : i + batch_size], start_date, end_date))
 
+    return batches
 
-def ingest_security(
-    alpaca_api, db_session, ticker, name="", type="stock", trading_days=252 * 2
-):
-    now = datetime.now()
-    # Use last trading day of the current week as end_date
-    end_date = last_trading_day_of_week(ref_date=now) - timedelta(days=1)
-    # Convert to datetime at market close time (e.g., 16:00) for consistency if needed
-    # Here, assuming you want midnight of that day:
-    end_date = datetime.combine(end_date, datetime.min.time())
 
-    log(f"\n{ticker}", "success")
+def ingest_window(store, ticker, name="", type="stock", trading_days=252 * 2):
+    """
+    Input:  Price store and the security to ingest.
+    Output: (security, start_date, end_date) for the bars missing from the
+            store, or None when the security is already up to date.
+    """
+    # the latest session with a complete daily bar
+    end_date = last_session()
 
-    # insert security in database if it doesn't exist
-    security = (
-        db_session.query(models.Security)
-        .filter(models.Security.ticker == ticker)
-        .first()
-    )
-    if not security:
-        security = models.Security(ticker=ticker, name=name, type="stock")
-        db_session.add(security)
-        db_session.commit()
-        # Approximate calendar days for trading_days (e.g. 252 trading days ≈ 365 calendar days)
-        # Set start_date some days back from end_date (you may want to implement a function to get trading days back)
-        start_date = end_date - timedelta(days=int(trading_days * 1.5))
+    # insert security in the store if it doesn't exist
+    security = store.security(ticker, name=name, type=type)
+
+    # retrieve latest price date from the store
+    last_date = store.last_date(security)
+    if not last_date:
+        start_date = window_start(trading_days)
     else:
-        # retrieve latest price data from sql database
-        last_price = (
-            db_session.query(models.Price)
-            .filter(models.Price.security_id == security.id)
-            .order_by(sqlalchemy.desc("date"))
-            .first()
-        )
-        if not last_price:
-            start_date = end_date - timedelta(days=int(trading_days * 1.5))
-        else:
-            start_date = last_price.date + timedelta(days=1)
-            if start_date > end_date:
-                return True
+        start_date = next_session(last_date)
 
+    # no session without a bar, nothing to request
     if start_date > end_date:
-        log("0 day prices inserted", "info")
-        return True
-
-    # Call price_history here (make sure it accepts datetime or date objects as arguments)
-    hist = price_history(alpaca_api, ticker, start_date, end_date)
-
-    for price in hist:
-        db_session.add(
-            models.Price(
-                close=price.c,  # retrieve close price
-                date=time_parser.parse(str(price.t)),
-                security_id=security.id,
-            )
-        )
-    db_session.commit()
+        return None
+
+    return security, start_date, end_date
+
 
-    log(f"{len(hist)} day prices inserted")
+def store_prices(store, security, hist):
+    store.write(security, hist)
 
-    return True
+    log(f"{len(hist)} day prices inserted", "debug")
 
 
 def _pos_neg(pct_change):
@@ -249,6 +252,8 @@ def momentum_score(ts, trading_days=252):
     Output: Annualized exponential regression slope,
             multiplied by the R2
     """
+    from scipy import stats
+
     if len(ts) < 2 or ts.isnull().any():
         return np.nan
 
@@ -269,42 +274,121 @@ def volatility(ts, vola_window=20):
     return ts.pct_change().rolling(vola_window).std().mean()
 
 
-def history(engine, db_session, tickers, trading_days):
-    # Step 1: Query securities by ticker
-    security_query = db_session.query(models.Security).filter(
-        models.Security.ticker.in_(tuple(tickers))
+def compact_history(engine, tickers, trading_days, dtype=np.float64, now=None):
+    """
+    Input:  Tickers, the number of trading days to look back, the dtype of
+            the closes (float64 or float32) and the time the window ends at,
+            by default now.
+    Output: panel.PricePanel of closing prices, loaded with one query per
+            chunk of tickers. Rows come back as (security, day ordinal,
+            close) numbers, so no ticker string or timestamp is built per row.
+    """
+    from panel import PricePanel
+
+    tickers = sorted(set(tickers))
+    past = window_start(trading_days, now)
+    window = models.Price.date >= past
+    if now is not None:
+        # bars after an earlier clock's last session are left out
+        window &= models.Price.date < last_session(now) + timedelta(days=1)
+    # SQLite's julianday of 0001-01-01 00:00 is 1721425.5, date ordinal 1
+    day = sqlalchemy.cast(
+        sqlalchemy.func.julianday(models.Price.date) - 1721424.5, sqlalchemy.Integer
     )
-    security_ids = [s.id for s in security_query.all()]
 
-    # Step 2: Subtract trading days using BDay (business days)
-    past = datetime.now() - BDay(int(trading_days))
+    positions = {ticker: i for i, ticker in enumerate(tickers)}
+    codes = {}
+    rows = []
+    with engine.connect() as connection:
+        # stay under SQLite's bound parameter limit on older builds
+        for i in range(0, len(tickers), SQLITE_MAX_VARIABLES):
+            chunk = tickers[i : i + SQLITE_MAX_VARIABLES]
+            for security_id, ticker in connection.execute(
+                sqlalchemy.select(models.Security.id, models.Security.ticker).where(
+                    models.Security.ticker.in_(chunk)
+                )
+            ):
+                codes[security_id] = positions[ticker]
+
+        ids = list(codes)
+        for i in range(0, len(ids), SQLITE_MAX_VARIABLES):
+            result = connection.execution_options(stream_results=True).execute(
+                sqlalchemy.select(
+                    models.Price.security_id, day, models.Price.close
+                ).where(
+                    models.Price.security_id.in_(ids[i : i + SQLITE_MAX_VARIABLES]),
+                    window,
+                )
+            )
+            # rows are packed into arrays as they arrive instead of being
+            # held as Python tuples
+            for partition in result.partitions(HISTORY_ROWS_PER_FETCH):
+                rows.append(
+                    np.fromiter(
+                        itertools.chain.from_iterable(partition),
+                        dtype=np.float64,
+                        count=3 * len(partition),
+                    ).reshape(-1, 3)
+                )
+
+    if not rows:
+        return PricePanel(np.empty((0, 0), dtype=dtype), [], [], tickers)
 
-    # Step 3: Query prices after `past` date
-    price_query = db_session.query(models.Price).filter(
-        models.Price.security_id.in_(tuple(security_ids)), models.Price.date >= past
-    )
+    security_ids, days, closes = np.concatenate(rows).T
+    code = np.zeros(max(codes) + 1, dtype=np.int32)
+    code[list(codes)] = list(codes.values())
 
-    # Step 4: Compile to raw SQL strings
-    security_sql = str(
-        security_query.statement.compile(compile_kwargs={"literal_binds": True})
-    )
-    price_sql = str(
-        price_query.statement.compile(compile_kwargs={"literal_binds": True})
+    return PricePanel.from_rows(
+        code[security_ids.astype(np.int64)], days, closes, tickers, dtype=dtype
     )
 
-    # Step 5: Execute SQL queries and merge data
-    security_df = pd.read_sql(text(security_sql), con=engine)
-    price_df = pd.read_sql(text(price_sql), con=engine)
 
-    df = security_df.merge(price_df, left_on="id", right_on="security_id")
-    df = df.drop(columns=["security_id", "id_x", "id_y"])
-    df["date"] = pd.to_datetime(df["date"])
-    df = df.set_index("date")
+def model_parameters(model):
+    """
+    Input:  [model] section of algo_settings.cfg.
+    Output: Dict of typed model parameters.
+    """
+    return {
+        "trend_window_days": int(model["trend_window_days"]),
+        "vola_window": int(model["vola_window"]),
+        "portfolio_size": int(model["portfolio_size"]),
+        "minimum_score_momentum": float(model["minimum_score_momentum"]),
+        "slope_window_days": int(model["slope_window_days"]),
+        "max_stock_gap": float(model["max_stock_gap"]),
+        "market": model["market"],
+    }
+
+
+def select_portfolio(ranking_table, kept_positions, portfolio_size):
+    """
+    Input:  Ranking table, held positions that still rank and target size.
+    Output: Ranking rows of the new portfolio, replacements first.
+    """
+    replacement_stocks = int(portfolio_size) - len(kept_positions)
+
+    buy_list = ranking_table.loc[~ranking_table.index.isin(kept_positions)][
+        :replacement_stocks
+    ]
+
+    return pd.concat(
+        (buy_list, ranking_table.loc[ranking_table.index.isin(kept_positions)])
+    )
 
-    return df
+
+def inverse_volatility_weights(volatilities):
+    inv_vola = 1 / volatilities
+    return inv_vola / np.sum(inv_vola)
 
 
 def share_quantity(price, weight, portfolio_value):
+    """
+    Input:  Price and weight, as scalars or matching arrays, and the
+            portfolio value.
+    Output: Whole shares the weight buys at the price.
+    """
+    if np.ndim(price) or np.ndim(weight):
+        return np.floor((portfolio_value * np.asarray(weight)) / price).astype(np.int64)
+
     return math.floor((portfolio_value * weight) / price)
 
 
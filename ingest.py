@@ -1,42 +1,79 @@
 import os
+from datetime import timedelta
 
-import pandas as pd
-import requests
 import sqlalchemy
+from database import init_db
 from dotenv import find_dotenv, load_dotenv
 
 load_dotenv(find_dotenv())
 
-import alpaca_trade_api as tradeapi
-from alpaca_trade_api.rest import TimeFrame
-
-alpaca_api = tradeapi.REST(
-    os.getenv("ALPACA_KEY_ID"),
-    os.getenv("ALPACA_SECRET_KEY"),
-    base_url=os.getenv("ALPACA_BASE_URL"),
+from ingestion import (
+    ALPACA_REQUESTS_PER_MINUTE,
+    ingest_corporate_actions,
+    ingest_securities,
 )
+from rolling import RollingStatistics
+from store import open_store
+from universe import constituents
+
+# Ingest  ETF Data
+ETFS = ["SPY", "SPMD", "IEI", "IEF", "TLH", "TLT", "SHY"]
 
-from helper import ingest_security, parse_wiki_sp_consituents
 
-# open sqllite db
-engine = sqlalchemy.create_engine("sqlite:///securities.db")
-db_session = sqlalchemy.orm.Session(bind=engine)
+def ingest_universe(alpaca_api, store, db_session):
+    """
+    Input:  Alpaca client, price store and database session.
+    Output: Number of price rows inserted for the ETFs and the S&P 500, 400
+            and 600 constituents.
+    """
+    securities = [{"ticker": ETF, "name": None, "type": "etf"} for ETF in ETFS]
 
-# Ingest  ETF Data
-for ETF in ["SPY", "SPMD", "IEI", "IEF", "TLH", "TLT", "SHY"]:
-    ingest_security(
-        alpaca_api=alpaca_api, db_session=db_session, ticker=ETF, name=None, type="etf"
+    # parse s&p 500 companies from wikipedia
+    companies = constituents(
+        db_session,
+        sources=["500", "400", "600"],
+        ttl=timedelta(days=float(os.getenv("CONSTITUENTS_TTL_DAYS", 1))),
     )
 
-# parse s&p 500 companies from wikipedia
-companies = parse_wiki_sp_consituents(sources=["500", "400", "600"])
+    securities += [
+        {"ticker": company["Symbol"], "name": company["Name"], "type": "stock"}
+        for company in companies
+    ]
 
-# iterate through companies
-for company in companies:
-    ingest_security(
+    inserted = ingest_securities(
         alpaca_api=alpaca_api,
-        db_session=db_session,
-        ticker=company["Symbol"],
-        name=company["Name"],
-        type="stock",
+        store=store,
+        securities=securities,
+        workers=int(os.getenv("INGEST_WORKERS", 4)),
+        requests_per_minute=int(
+            os.getenv("ALPACA_REQUESTS_PER_MINUTE", ALPACA_REQUESTS_PER_MINUTE)
+        ),
+    )
+
+    # after the bars, so a dividend's factor sees the close before it
+    ingest_corporate_actions(
+        alpaca_api, store, [security["ticker"] for security in securities]
+    )
+
+    return inserted
+
+
+if __name__ == "__main__":
+    import alpaca_trade_api as tradeapi
+
+    alpaca_api = tradeapi.REST(
+        os.getenv("ALPACA_KEY_ID"),
+        os.getenv("ALPACA_SECRET_KEY"),
+        base_url=os.getenv("ALPACA_BASE_URL"),
     )
+
+    # open sqllite db
+    engine = sqlalchemy.create_engine("sqlite:///securities.db")
+    # tables and columns added since the database was created
+    init_db(engine)
+    db_session = sqlalchemy.orm.Session(bind=engine, expire_on_commit=False)
+    store = RollingStatistics(
+        open_store(engine=engine, db_session=db_session), db_session
+    )
+
+    ingest_universe(alpaca_api, store, db_session)
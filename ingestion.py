@@ -0,0 +1,262 @@
+"""
+Concurrent price ingestion.
+
+Securities needing the same date window are requested together in
+multi-symbol batches. A bounded pool of workers fetches the batches under a
+shared token bucket, retrying failed requests with exponential backoff,
+while the calling thread stays the single writer to the price store. Any
+object exposing the Alpaca ``get_bars`` call, accepting a list of symbols
+and returning bars tagged with their symbol ``S``, can be passed as
+``alpaca_api``.
+
+Bars are stored unadjusted. ingest_corporate_actions records the splits and
+dividends that went ex since the last run, which the store applies on read.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from helper import (
+    ALPACA_SYMBOLS_PER_REQUEST,
+    batch_windows,
+    corporate_actions,
+    ingest_window,
+    price_histories,
+    store_prices,
+)
+from log import log, skip, skip_summary
+
+# Alpaca's free market data plan allows 200 requests per minute
+ALPACA_REQUESTS_PER_MINUTE = 200
+
+# failed batch requests are retried after 1, 2, 4... seconds
+ALPACA_RETRIES = 3
+ALPACA_BACKOFF_SECONDS = 1.0
+
+
+class RateLimiter(object):
+    """
+    Token bucket shared between threads. Holds up to ``burst`` tokens and
+    refills at ``rate`` tokens per ``per`` seconds.
+    """
+
+    def __init__(
+        self, rate, per=60.0, burst=None, clock=time.monotonic, sleep=time.sleep
+    ):
+        self.capacity = float(burst or rate)
+        self.fill_rate = float(rate) / per
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.fill_rate
+                )
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.fill_rate
+
+            self.sleep(wait)
+
+
+def fetch_windows(
+    alpaca_api,
+    store,
+    securities_by_ticker,
+    windows,
+    workers=4,
+    requests_per_minute=ALPACA_REQUESTS_PER_MINUTE,
+    symbols_per_request=ALPACA_SYMBOLS_PER_REQUEST,
+    retries=ALPACA_RETRIES,
+    backoff=ALPACA_BACKOFF_SECONDS,
+    sleep=time.sleep,
+):
+    """
+    Input:  Security records by ticker and (ticker, start_date, end_date)
+            windows to fetch.
+    Output: Number of bars received and written to the store. A failing
+            request is retried ``retries`` times with exponential backoff
+            before its batch is skipped.
+    """
+    limiter = RateLimiter(requests_per_minute, sleep=sleep)
+
+    batches = batch_windows(windows, batch_size=symbols_per_request)
+    log(
+        f"Fetching {len(windows)} windows in {len(batches)} requests "
+        f"with {workers} workers",
+        "info",
+    )
+
+    def fetch(tickers, start_date, end_date):
+        for attempt in range(retries + 1):
+            # retries spend tokens like any other request
+            limiter.acquire()
+            try:
+                return price_histories(alpaca_api, tickers, start_date, end_date)
+            except Exception as e:
+                if attempt == retries:
+                    raise
+                wait = backoff * 2**attempt
+                log(f"{len(tickers)} symbols: {e}, retrying in {wait}s", "warning")
+                sleep(wait)
+
+    inserted = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(fetch, tickers, start_date, end_date): tickers
+            for tickers, start_date, end_date in batches
+        }
+        for future in as_completed(futures):
+            try:
+                histories = future.result()
+            except Exception as e:
+                log(f"{', '.join(futures[future])}: {e}", "error")
+                continue
+
+            for ticker, hist in histories.items():
+                if ticker not in securities_by_ticker:
+                    continue
+
+                log(f"\n{ticker}", "debug")
+                store_prices(store, securities_by_ticker[ticker], hist)
+                inserted += len(hist)
+
+    return inserted
+
+
+def ingest_securities(
+    alpaca_api,
+    store,
+    securities,
+    workers=4,
+    requests_per_minute=ALPACA_REQUESTS_PER_MINUTE,
+    symbols_per_request=ALPACA_SYMBOLS_PER_REQUEST,
+    trading_days=252 * 2,
+):
+    """
+    Input:  Securities as dicts with ``ticker``, ``name`` and ``type`` keys.
+    Output: Number of price rows inserted.
+    """
+    # stores are not thread safe, so windows are planned up front
+    securities_by_ticker = {}
+    windows = []
+    for security in securities:
+        window = ingest_window(
+            store,
+            security["ticker"],
+            name=security.get("name"),
+            type=security.get("type", "stock"),
+            trading_days=trading_days,
+        )
+        if window is None:
+            skip(security["ticker"], "up to date")
+            continue
+
+        security_record, start_date, end_date = window
+        securities_by_ticker[security["ticker"]] = security_record
+        windows.append((security["ticker"], start_date, end_date))
+
+    inserted = fetch_windows(
+        alpaca_api,
+        store,
+        securities_by_ticker,
+        windows,
+        workers=workers,
+        requests_per_minute=requests_per_minute,
+        symbols_per_request=symbols_per_request,
+    )
+
+    skip_summary("Ingest skipped")
+    log(f"{inserted} day prices inserted for {len(windows)} securities", "success")
+
+    return inserted
+
+
+def ingest_corporate_actions(alpaca_api, store, tickers, until=None):
+    """
+    Input:  Alpaca client, a store exposing write_actions and the tickers of
+            the universe.
+    Output: Number of new actions stored. Each ticker's actions are requested
+            from its own actions_since() date, so a security that joins the
+            universe later still gets the splits and dividends behind its
+            history.
+    """
+    if not hasattr(store, "write_actions"):
+        log("Price store does not adjust for corporate actions", "warning")
+        return 0
+
+    until = until or datetime.now()
+    adjusted = store
+    while not hasattr(adjusted, "actions_since"):
+        adjusted = adjusted.store
+    since = adjusted.actions_since(tickers)
+    if not since:
+        return 0
+
+    # the announcements cover the whole market, so one scan from the
+    # earliest date serves every ticker
+    try:
+        actions = corporate_actions(alpaca_api, list(since), min(since.values()), until)
+    except Exception as e:
+        log(f"Corporate actions: {e}", "error")
+        return 0
+
+    inserted = store.write_actions(
+        [action for action in actions if action["date"] >= since[action["ticker"]]]
+    )
+    adjusted.checked(list(since), until)
+    log(
+        "{0} corporate actions stored for {1} securities".format(inserted, len(since)),
+        "success",
+    )
+
+    return inserted
+
+
+def backfill_gaps(
+    alpaca_api,
+    store,
+    gaps,
+    workers=4,
+    requests_per_minute=ALPACA_REQUESTS_PER_MINUTE,
+    symbols_per_request=ALPACA_SYMBOLS_PER_REQUEST,
+):
+    """
+    Input:  Missing ranges by ticker, as returned by the store's gaps().
+    Output: Number of bars received for the ranges. Tickers missing the same
+            range, such as a day every security lacks, share requests.
+    """
+    securities_by_ticker = {}
+    windows = []
+    for ticker, ranges in gaps.items():
+        securities_by_ticker[ticker] = store.security(ticker)
+        windows += [(ticker, start_date, end_date) for start_date, end_date in ranges]
+
+    if not windows:
+        log("No gaps to backfill", "success")
+        return 0
+
+    inserted = fetch_windows(
+        alpaca_api,
+        store,
+        securities_by_ticker,
+        windows,
+        workers=workers,
+        requests_per_minute=requests_per_minute,
+        symbols_per_request=symbols_per_request,
+    )
+    log(f"{inserted} day prices backfilled for {len(gaps)} securities", "success")
+
+    return inserted
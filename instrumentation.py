@@ -0,0 +1,192 @@
+"""
+Stage timing and profiling for a run.
+
+RunReport.stage() is a context manager recording, per stage, wall and CPU
+time, the process's peak RSS, a row count set by the caller and the change of
+every registered counter (broker calls, price store misses, ...). The report
+is written as JSON and optionally in the Prometheus text exposition format.
+Setting PROFILE_STAGE profiles that one stage with cProfile, or pyinstrument
+when PROFILER=pyinstrument, and dumps the result to PROFILE_PATH.
+"""
+
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from log import log
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+class Stage(object):
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_rss_mb = 0.0
+        self.calls = {}
+        self.error = None
+
+    def as_dict(self):
+        return {
+            "stage": self.name,
+            "wall_seconds": round(self.wall_seconds, 6),
+            "cpu_seconds": round(self.cpu_seconds, 6),
+            "peak_rss_mb": round(self.peak_rss_mb, 3),
+            "rows": self.rows,
+            "calls": self.calls,
+            "error": self.error,
+        }
+
+
+class RunReport(object):
+    def __init__(self, name="rebalance", profile_stage=None, profiler=None):
+        self.name = name
+        self.started_at = datetime.now()
+        self.stages = []
+        self.counters = {}
+        self.profile_stage = profile_stage or os.getenv("PROFILE_STAGE")
+        self.profiler = profiler or os.getenv("PROFILER", "cprofile")
+
+    def counter(self, name, read):
+        """
+        Input:  Counter name and a callable returning its current value.
+        """
+        self.counters[name] = read
+
+    def _sample(self):
+        return {name: read() for name, read in self.counters.items()}
+
+    @contextmanager
+    def _profile(self, name):
+        if name != self.profile_stage:
+            yield
+            return
+
+        path = os.getenv("PROFILE_PATH", f"{self.name}-{name}")
+        if self.profiler == "pyinstrument":
+            from pyinstrument import Profiler
+
+            profiler = Profiler()
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                with open(f"{path}.html", "w") as f:
+                    f.write(profiler.output_html())
+            log(f"Profile of {name} written to {path}.html", "info")
+        else:
+            import cProfile
+
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                profiler.dump_stats(f"{path}.prof")
+            log(f"Profile of {name} written to {path}.prof", "info")
+
+    @contextmanager
+    def stage(self, name):
+        stage = Stage(name)
+        before = self._sample()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            with self._profile(name):
+                yield stage
+        except BaseException as e:
+            stage.error = repr(e)
+            raise
+        finally:
+            stage.wall_seconds = time.perf_counter() - wall
+            stage.cpu_seconds = time.process_time() - cpu
+            stage.peak_rss_mb = peak_rss_mb()
+            after = self._sample()
+            stage.calls.update(
+                {
+                    counter: after[counter] - before[counter]
+                    for counter in after
+                    if counter in before and after[counter] != before[counter]
+                }
+            )
+            self.stages.append(stage)
+
+    def as_dict(self):
+        return {
+            "run": self.name,
+            "started_at": self.started_at.isoformat(),
+            "wall_seconds": round(sum(stage.wall_seconds for stage in self.stages), 6),
+            "peak_rss_mb": round(peak_rss_mb(), 3),
+            "stages": [stage.as_dict() for stage in self.stages],
+        }
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+    def prometheus(self, prefix="momentum"):
+        """
+        Output: The stages in the Prometheus text exposition format.
+        """
+        lines = []
+        metrics = [
+            ("stage_wall_seconds", "gauge", "Wall time of the stage.", "wall_seconds"),
+            ("stage_cpu_seconds", "gauge", "CPU time of the stage.", "cpu_seconds"),
+            (
+                "stage_peak_rss_megabytes",
+                "gauge",
+                "Process peak RSS at the end of the stage.",
+                "peak_rss_mb",
+            ),
+            ("stage_rows", "gauge", "Rows processed by the stage.", "rows"),
+        ]
+        for metric, kind, description, field in metrics:
+            lines.append(f"# HELP {prefix}_{metric} {description}")
+            lines.append(f"# TYPE {prefix}_{metric} {kind}")
+            for stage in self.stages:
+                value = getattr(stage, field)
+                if value is not None:
+                    lines.append(
+                        f'{prefix}_{metric}{{run="{self.name}",stage="{stage.name}"}} {value}'
+                    )
+
+        lines.append(f"# HELP {prefix}_stage_calls External calls made by the stage.")
+        lines.append(f"# TYPE {prefix}_stage_calls gauge")
+        for stage in self.stages:
+            for name, value in stage.calls.items():
+                lines.append(
+                    f'{prefix}_stage_calls{{run="{self.name}",stage="{stage.name}",'
+                    f'counter="{name}"}} {value}'
+                )
+
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        with open(path, "w") as f:
+            f.write(self.prometheus())
+
+    def summary(self):
+        for stage in self.stages:
+            log(
+                "{0}: {1}s wall, {2}s cpu, {3} MB peak{4}{5}".format(
+                    stage.name,
+                    round(stage.wall_seconds, 3),
+                    round(stage.cpu_seconds, 3),
+                    round(stage.peak_rss_mb, 1),
+                    f", {stage.rows} rows" if stage.rows is not None else "",
+                    "".join(f", {value} {name}" for name, value in stage.calls.items()),
+                ),
+                "info",
+            )
@@ -1,5 +1,28 @@
 #!/usr/bin/env python
-from xtermcolor import colorize
+"""
+Logging backend.
+
+log() keeps its signature but hands records to the standard logging module
+through a queue, so callers never block on output. A listener thread writes
+them to the configured sinks:
+
+	LOG_SINKS  comma separated: color (default), plain, json
+	LOG_FILE   optional file receiving JSON records
+	LOG_LEVEL  DEBUG, INFO (default), WARNING or ERROR
+
+Per-ticker skip reasons go through skip() and are reported as counts by
+skip_summary(); the individual lines are DEBUG records.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
 
 def enum(**enums):
 	return type('Enum', (), enums)
@@ -14,29 +37,162 @@ ansi_color= enum(
 	light_green=154
 	)
 
-def log(message, type = None, ansi= ansi_color.blue, tag = ''):
-	message = message.encode("ascii", errors="ignore").decode()
-	if type == 'info':
-		print(colorize(message, ansi = ansi_color.blue))
-	elif type == 'success':
-		print(colorize(message, ansi = ansi_color.green))
-	elif type == 'warning':
-		print(colorize(message, ansi = ansi_color.orange))
-	elif type == 'error':
-		print(colorize(message, ansi = ansi_color.red))
-	elif type == 'custom':
-		print(colorize(message, ansi = ansi))
-	else:
-		print(message)
+LEVELS = {
+	'info': logging.INFO,
+	'success': logging.INFO,
+	'warning': logging.WARNING,
+	'error': logging.ERROR,
+	'custom': logging.INFO,
+	'debug': logging.DEBUG,
+	}
+
+COLORS = {
+	'info': ansi_color.blue,
+	'success': ansi_color.green,
+	'warning': ansi_color.orange,
+	'error': ansi_color.red,
+	}
+
+logger = logging.getLogger('momentum')
+logger.propagate = False
+
+class ColorFormatter(logging.Formatter):
+	def format(self, record):
+		message = record.getMessage().encode("ascii", errors="ignore").decode()
+		ansi = getattr(record, 'ansi', None) or COLORS.get(getattr(record, 'type', None))
+		if ansi is None:
+			return message
+		try:
+			from xtermcolor import colorize
+		except ImportError:
+			return message
+		return colorize(message, ansi = ansi)
+
+class JsonFormatter(logging.Formatter):
+	def format(self, record):
+		entry = {
+			'time': datetime.fromtimestamp(record.created).isoformat(),
+			'level': record.levelname.lower(),
+			'type': getattr(record, 'type', None),
+			'message': record.getMessage(),
+			}
+		if getattr(record, 'tag', ''):
+			entry['tag'] = record.tag
+		entry.update(getattr(record, 'fields', None) or {})
+		return json.dumps(entry, default=str)
+
+class StdoutHandler(logging.StreamHandler):
+	# resolves sys.stdout on every record so redirects are honoured
+	def __init__(self):
+		logging.Handler.__init__(self)
+
+	@property
+	def stream(self):
+		return sys.stdout
+
+	@stream.setter
+	def stream(self, value):
+		pass
+
+_queue = None
+_listener = None
+
+def configure(sinks = None, level = None, log_file = None):
+	"""
+	Input:  Sink names, level name and optional JSON log file; each falls
+	        back to LOG_SINKS, LOG_LEVEL and LOG_FILE.
+	"""
+	global _queue, _listener
+	shutdown()
+
+	sinks = sinks or os.getenv('LOG_SINKS', 'color').split(',')
+	level = level or os.getenv('LOG_LEVEL', 'INFO')
+	log_file = log_file or os.getenv('LOG_FILE')
+
+	handlers = []
+	for sink in [sink.strip() for sink in sinks if sink.strip()]:
+		handler = StdoutHandler()
+		if sink == 'color':
+			handler.setFormatter(ColorFormatter())
+		elif sink == 'json':
+			handler.setFormatter(JsonFormatter())
+		elif sink == 'plain':
+			handler.setFormatter(logging.Formatter('%(message)s'))
+		else:
+			raise ValueError('invalid log sink: "%s"' % sink)
+		handlers.append(handler)
+	if log_file:
+		handler = logging.FileHandler(log_file)
+		handler.setFormatter(JsonFormatter())
+		handlers.append(handler)
+
+	logger.setLevel(level.upper())
+	for handler in list(logger.handlers):
+		logger.removeHandler(handler)
+
+	_queue = queue.Queue()
+	logger.addHandler(logging.handlers.QueueHandler(_queue))
+	_listener = logging.handlers.QueueListener(_queue, *handlers, respect_handler_level = True)
+	_listener.start()
+
+def flush():
+	# wait until the listener has written every queued record
+	if _queue is not None:
+		_queue.join()
+
+def shutdown():
+	global _listener
+	if _listener is not None:
+		_listener.stop()
+		_listener = None
+
+atexit.register(shutdown)
+
+def log(message, type = None, ansi= ansi_color.blue, tag = '', **fields):
+	if _listener is None:
+		configure()
+	logger.log(
+		LEVELS.get(type, logging.INFO),
+		message,
+		extra = {
+			'type': type,
+			'ansi': ansi if type == 'custom' else None,
+			'tag': tag,
+			'fields': fields,
+			},
+		)
+
+_skips = Counter()
+_skips_lock = threading.Lock()
+
+def skip(ticker, reason):
+	"""
+	Counts ``reason`` towards the next skip_summary(); the ticker itself is
+	only logged at DEBUG.
+	"""
+	with _skips_lock:
+		_skips[reason] += 1
+	log('{0}: {1}'.format(ticker, reason), 'debug', ticker = ticker, reason = reason)
+
+def skip_summary(label = 'Skipped'):
+	"""
+	Output: Counts by reason since the last summary, also logged.
+	"""
+	with _skips_lock:
+		counts = dict(_skips)
+		_skips.clear()
+	for reason, count in sorted(counts.items(), key = lambda item: -item[1]):
+		log('{0} {1}: {2}'.format(label, reason, count), 'warning', reason = reason, count = count)
+	return counts
 
 def green(message):
-	print(colorize(message, ansi = ansi_color.green))
+	log(message, 'success')
 
 def red(message):
-	print(colorize(message, ansi = ansi_color.red))
+	log(message, 'error')
 
 def blue(message):
-	print(colorize(message, ansi = ansi_color.blue))
+	log(message, 'info')
 
 def orange(message):
-	print(colorize(message, ansi = ansi_color.orange))
+	log(message, 'warning')
@@ -0,0 +1,186 @@
+"""
+Cached FRED macro-economic series.
+
+Observations are stored in the database. Each refresh requests the ones
+newer than the last stored date plus a trailing window of recent months,
+whose revised values overwrite the stored ones. Year over year changes are
+as-of lookups on the stored observations; historical lookups only see an
+observation once it was published, MACRO_RELEASE_LAG after its period
+starts. backfill() fetches the older history a backtest needs once.
+"""
+
+import os
+from datetime import datetime, timedelta
+
+import models
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from helper import yoy
+from log import log
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+# real retail and food services sales, the bull market macro check
+MACRO_SERIES = "RRSFS"
+
+# first fetch covers the year over year lookback with room to spare
+MACRO_LOOKBACK = timedelta(days=600)
+
+# recent months FRED may still revise, re-requested on every refresh
+MACRO_REVISION_WINDOW = timedelta(days=120)
+
+# monthly retail sales are published about six weeks after the month starts
+MACRO_RELEASE_LAG = timedelta(days=45)
+
+# longest gap between two monthly observations
+MACRO_PERIOD = timedelta(days=31)
+
+
+def macro_yoy(observations, as_of=None, release_lag=MACRO_RELEASE_LAG):
+    """
+    Input:  Observations indexed by period date and an optional as-of date.
+    Output: Change of the latest observation published by ``as_of`` (its
+            period date plus ``release_lag``) from the observation in effect
+            one year earlier, NaN without one.
+    """
+    if as_of is not None:
+        observations = observations.loc[: pd.Timestamp(as_of) - release_lag]
+    if len(observations) < 2:
+        return np.nan
+
+    latest = observations.index[-1]
+    previous = observations.asof(latest - pd.DateOffset(years=1))
+
+    return yoy(observations.iloc[-1], previous)
+
+
+class MacroData(object):
+    def __init__(self, db_session, series=MACRO_SERIES, fred=None):
+        self.db_session = db_session
+        self.series = series
+        self.fred = fred
+        self.refreshed = False
+        self.requests = 0
+
+    def _fred(self):
+        if self.fred is None:
+            from fredapi import Fred
+
+            self.fred = Fred(api_key=os.getenv("FRED_API_KEY"))
+
+        return self.fred
+
+    def last_date(self):
+        return (
+            self.db_session.query(sqlalchemy.func.max(models.MacroObservation.date))
+            .filter(models.MacroObservation.series == self.series)
+            .scalar()
+        )
+
+    def first_date(self):
+        return (
+            self.db_session.query(sqlalchemy.func.min(models.MacroObservation.date))
+            .filter(models.MacroObservation.series == self.series)
+            .scalar()
+        )
+
+    def _fetch(self, start, end):
+        # stores FRED's values for the range, overwriting revised ones
+        self.requests += 1
+        observations = (
+            self._fred()
+            .get_series(
+                self.series,
+                observation_start=start.strftime("%Y-%m-%d"),
+                observation_end=end.strftime("%Y-%m-%d"),
+            )
+            .dropna()
+        )
+
+        if len(observations):
+            insert = sqlite_insert(models.MacroObservation).values(
+                [
+                    {
+                        "series": self.series,
+                        "date": date.to_pydatetime(),
+                        "value": float(value),
+                    }
+                    for date, value in observations.items()
+                ]
+            )
+            self.db_session.execute(
+                insert.on_conflict_do_update(
+                    index_elements=["series", "date"],
+                    set_={"value": insert.excluded.value},
+                )
+            )
+            self.db_session.commit()
+
+        return len(observations)
+
+    def refresh(self, now=None):
+        """
+        Fetches the observations newer than the last stored one and the
+        recent months FRED may have revised since.
+        """
+        now = now or datetime.now()
+        last_date = self.last_date()
+        if last_date is None:
+            start = now - MACRO_LOOKBACK
+        else:
+            start = last_date - MACRO_REVISION_WINDOW
+
+        fetched = self._fetch(start, now)
+        self.refreshed = True
+
+        return fetched
+
+    def backfill(self, start):
+        """
+        Input:  First date a year over year change is needed for.
+        Output: Number of observations fetched from before the stored ones.
+        """
+        start = (
+            pd.Timestamp(start)
+            - pd.DateOffset(years=1)
+            - MACRO_RELEASE_LAG
+            - MACRO_PERIOD
+        )
+        first_date = self.first_date()
+        if first_date is not None and first_date <= start + MACRO_PERIOD:
+            return 0
+
+        return self._fetch(start, first_date or datetime.now())
+
+    def observations(self, refresh=True):
+        """
+        Input:  Whether to fetch new observations from FRED first.
+        Output: Stored observations indexed by date.
+        """
+        if refresh and not self.refreshed:
+            try:
+                self.refresh()
+            except Exception as e:
+                self.db_session.rollback()
+                if self.last_date() is None:
+                    raise
+                log(f"{self.series} refresh failed, using cache: {e}", "error")
+
+        rows = (
+            self.db_session.query(
+                models.MacroObservation.date, models.MacroObservation.value
+            )
+            .filter(models.MacroObservation.series == self.series)
+            .order_by(models.MacroObservation.date)
+            .all()
+        )
+
+        return pd.Series(
+            [value for _, value in rows],
+            index=pd.DatetimeIndex([date for date, _ in rows]),
+            name=self.series,
+            dtype=np.float64,
+        )
+
+    def yoy(self, as_of=None, refresh=True):
+        return macro_yoy(self.observations(refresh=refresh), as_of=as_of)
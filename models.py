@@ -1,5 +1,14 @@
 from database import Base
-from sqlalchemy import Column, DateTime, Float, ForeignKey, Integer, String
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+)
 from sqlalchemy.orm import relationship
 
 
@@ -20,12 +29,172 @@ class Security(Base):
 
 class Price(Base):
     __tablename__ = "price"
+    __table_args__ = (
+        Index("ix_price_security_id_date", "security_id", "date", unique=True),
+    )
+
     id = Column(Integer, primary_key=True)
     security_id = Column(Integer, ForeignKey("security.id"))
+    # unadjusted bar; splits and dividends are applied on read from
+    # CorporateAction
+    open = Column(Float)
+    high = Column(Float)
+    low = Column(Float)
     close = Column(Float)
+    volume = Column(Float)
     date = Column(DateTime)
 
-    def __init__(self, security_id, close=None, date=None):
+    def __init__(
+        self,
+        security_id,
+        close=None,
+        date=None,
+        open=None,
+        high=None,
+        low=None,
+        volume=None,
+    ):
+        self.open = open
+        self.high = high
+        self.low = low
         self.close = close
+        self.volume = volume
         self.date = date
         self.security_id = security_id
+
+
+class RollingState(Base):
+    """
+    Running regression and moving average sums over a security's most recent
+    closes, with the closes themselves (float64) and their day ordinals
+    (int32) kept as raw bytes.
+    """
+
+    __tablename__ = "rolling_state"
+
+    ticker = Column(String(10), primary_key=True)
+    date = Column(DateTime)
+    observations = Column(Integer)
+    updates = Column(Integer)
+    sum_y = Column(Float)
+    sum_xy = Column(Float)
+    sum_yy = Column(Float)
+    sum_ma = Column(Float)
+    days = Column(LargeBinary)
+    closes = Column(LargeBinary)
+
+    def __init__(self, ticker):
+        self.ticker = ticker
+        self.observations = 0
+        self.updates = 0
+        self.sum_y = 0.0
+        self.sum_xy = 0.0
+        self.sum_yy = 0.0
+        self.sum_ma = 0.0
+        self.days = b""
+        self.closes = b""
+
+
+class ConstituentSnapshot(Base):
+    """
+    Membership of one constituent list as of ``date``. ``checked_at`` and the
+    HTTP validators record the last time the source was confirmed unchanged.
+    """
+
+    __tablename__ = "constituent_snapshot"
+
+    id = Column(Integer, primary_key=True)
+    source = Column(String(20), index=True)
+    date = Column(DateTime)
+    checked_at = Column(DateTime)
+    etag = Column(String(200))
+    last_modified = Column(String(50))
+    constituents = relationship("Constituent")
+
+    def __init__(self, source, date, etag=None, last_modified=None):
+        self.source = source
+        self.date = date
+        self.checked_at = date
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class Constituent(Base):
+    __tablename__ = "constituent"
+
+    id = Column(Integer, primary_key=True)
+    snapshot_id = Column(Integer, ForeignKey("constituent_snapshot.id"), index=True)
+    ticker = Column(String(10))
+    name = Column(String(200))
+
+    def __init__(self, snapshot_id=None, ticker=None, name=None):
+        self.snapshot_id = snapshot_id
+        self.ticker = ticker
+        self.name = name
+
+
+class MacroObservation(Base):
+    __tablename__ = "macro_observation"
+    __table_args__ = (
+        Index("ix_macro_observation_series_date", "series", "date", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    series = Column(String(20))
+    date = Column(DateTime)
+    value = Column(Float)
+
+    def __init__(self, series, date=None, value=None):
+        self.series = series
+        self.date = date
+        self.value = value
+
+
+class CorporateAction(Base):
+    """
+    Split or cash dividend effective on ``date`` (the ex-date). ``factor``
+    multiplies every close before that date: old_rate / new_rate for a split,
+    1 - cash / previous close for a dividend.
+    """
+
+    __tablename__ = "corporate_action"
+    __table_args__ = (
+        Index(
+            "ix_corporate_action_ticker_type_date",
+            "ticker",
+            "type",
+            "date",
+            unique=True,
+        ),
+    )
+
+    id = Column(Integer, primary_key=True)
+    ticker = Column(String(10))
+    type = Column(String(20))
+    date = Column(DateTime)
+    ratio = Column(Float)
+    cash = Column(Float)
+    factor = Column(Float)
+
+    def __init__(self, ticker, type, date, ratio=None, cash=None, factor=None):
+        self.ticker = ticker
+        self.type = type
+        self.date = date
+        self.ratio = ratio
+        self.cash = cash
+        self.factor = factor
+
+
+class CorporateActionCheck(Base):
+    """
+    Last ex-date through which ``ticker``'s corporate actions were fetched.
+    """
+
+    __tablename__ = "corporate_action_check"
+
+    ticker = Column(String(10), primary_key=True)
+    date = Column(DateTime)
+
+    def __init__(self, ticker, date=None):
+        self.ticker = ticker
+        self.date = date
@@ -0,0 +1,129 @@
+"""
+Compact in-process price panel.
+
+PricePanel holds closes as one C-contiguous session x ticker matrix (float64
+or float32), the sessions as int32 date ordinals and the tickers as
+categorical codes into a single array of names, so no string or timestamp is
+stored per row. It exposes the part of the DataFrame interface the
+screening, weighting and reporting code uses (``columns``, ``index``,
+``to_numpy``, ``panel[ticker]``, ``empty``), so those accept either.
+"""
+
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+UNIX_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+class PricePanel(object):
+    __slots__ = ("values", "days", "codes", "categories", "_positions")
+
+    def __init__(self, values, days, codes, categories):
+        self.values = values
+        self.days = np.asarray(days, dtype=np.int32)
+        self.codes = np.asarray(codes, dtype=np.int32)
+        self.categories = np.asarray(categories, dtype=object)
+        self._positions = None
+
+    @classmethod
+    def from_rows(cls, codes, days, closes, categories, dtype=np.float64):
+        """
+        Input:  Per row ticker codes into ``categories``, date ordinals and
+                closes, e.g. straight from a query.
+        Output: Panel with a column per ticker present, ordered by code, and a
+                row per day. A repeated (ticker, day) keeps the last close.
+        """
+        columns, column = np.unique(np.asarray(codes), return_inverse=True)
+        days, row = np.unique(np.asarray(days), return_inverse=True)
+        values = np.full((len(days), len(columns)), np.nan, dtype=dtype)
+        values[row, column] = closes
+
+        return cls(values, days, columns, categories)
+
+    @classmethod
+    def from_columns(cls, columns, dtype=np.float64):
+        """
+        Input:  Dict of ticker to (date ordinals, closes) arrays.
+        Output: Panel with a column per ticker with closes, in the dict's
+                order.
+        """
+        tickers = list(columns)
+        if not tickers:
+            return cls.from_rows([], [], [], [], dtype=dtype)
+
+        codes = np.repeat(
+            np.arange(len(tickers), dtype=np.int32),
+            [len(days) for days, _ in columns.values()],
+        )
+        return cls.from_rows(
+            codes,
+            np.concatenate([days for days, _ in columns.values()]),
+            np.concatenate([closes for _, closes in columns.values()]),
+            tickers,
+            dtype=dtype,
+        )
+
+    @property
+    def columns(self):
+        return pd.Index(self.categories[self.codes])
+
+    @property
+    def index(self):
+        return pd.to_datetime(
+            self.days.astype(np.int64) - UNIX_EPOCH_ORDINAL, unit="D"
+        ).rename("date")
+
+    @property
+    def empty(self):
+        return self.values.size == 0
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.days.nbytes + self.codes.nbytes
+
+    def __len__(self):
+        return len(self.days)
+
+    def _position(self, ticker):
+        if self._positions is None:
+            self._positions = {
+                ticker: i for i, ticker in enumerate(self.categories[self.codes])
+            }
+        return self._positions[ticker]
+
+    def __contains__(self, ticker):
+        try:
+            self._position(ticker)
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, ticker):
+        return pd.Series(
+            self.values[:, self._position(ticker)], index=self.index, name=ticker
+        )
+
+    def column(self, ticker):
+        """
+        Output: (date ordinals, closes) of the ticker's days with a close,
+                empty arrays for a ticker not in the panel.
+        """
+        if ticker not in self:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=self.values.dtype)
+
+        closes = self.values[:, self._position(ticker)]
+        valid = ~np.isnan(closes)
+        return self.days[valid], closes[valid]
+
+    def to_numpy(self, dtype=None):
+        if dtype is None or self.values.dtype == dtype:
+            return self.values
+        return self.values.astype(dtype)
+
+    def to_frame(self):
+        # the DataFrame shares the matrix, nothing is copied
+        return pd.DataFrame(
+            self.values, index=self.index, columns=self.columns, copy=False
+        )
@@ -0,0 +1,424 @@
+"""
+Monthly rebalance pipeline.
+
+run_rebalance takes its dependencies as arguments (model config, broker
+snapshot, price store, database session and clock) and runs the rebalance as
+explicit stages: history, regime, constituents, screen, select, weight, plan,
+execute and report, each timed on an instrumentation.RunReport.
+Nothing runs at import time and dependencies only one stage needs, such as
+the SES client for the report email, are imported by that stage, so the
+stages can be reused by backtests, the daemon and benchmarks.
+"""
+
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from helper import (
+    inverse_volatility_weights,
+    model_parameters,
+    select_portfolio,
+    str2bool,
+    volatility,
+)
+from instrumentation import RunReport
+from log import log, skip, skip_summary
+from planner import plan_rebalance
+from screener import rank, screen_store
+
+TRADING_DAYS_IN_YEAR = 252
+
+# report emails sent by this process, read by run reports
+emails_sent = 0
+
+
+def market_history(parameters, store, now=None):
+    """
+    Input:  Model parameters, price store and the time the window ends at,
+            by default now.
+    Output: Closes of the market over the trend window.
+    """
+    market = parameters["market"]
+    return store.panel(
+        tickers=[market], trading_days=parameters["trend_window_days"], now=now
+    )[market].dropna()
+
+
+def market_regime(market_history, macro):
+    """
+    Input:  Market closes over the trend window and macro data provider.
+    Output: True in a bull market: the market trades above its trend and the
+            macro series grew over the year. The macro check only runs when
+            the trend is up and is skipped when the change is unknown.
+    """
+    is_bull_market = bool(market_history.tail(1).iloc[0] > market_history.mean())
+    if is_bull_market:
+        change = macro.yoy()
+        # without a year of observations the macro check is skipped
+        if np.isnan(change):
+            log("No year over year macro change, skipping the macro check", "warning")
+        else:
+            is_bull_market = bool(change > 0.0)
+
+    if is_bull_market:
+        log("Bull Market", "success")
+    else:
+        log("Bear Market", "warning")
+
+    return is_bull_market
+
+
+def screen_universe(parameters, store, companies, now=None):
+    """
+    Input:  Model parameters, price store, constituent dicts and the time the
+            windows end at, by default now.
+    Output: Ranking table of the companies passing every filter.
+    """
+    screened = screen_store(
+        store,
+        tickers=[company["Symbol"] for company in companies],
+        gap_window=parameters["slope_window_days"],
+        max_stock_gap=parameters["max_stock_gap"],
+        minimum_score_momentum=parameters["minimum_score_momentum"],
+        trading_days=TRADING_DAYS_IN_YEAR,
+        now=now,
+    )
+
+    # skip reasons are counted; the per-ticker lines are DEBUG records
+    for company in companies:
+        ticker = company["Symbol"]
+        if ticker not in screened.index or not screened.at[ticker, "has_data"]:
+            skip(ticker, "no data")
+        # check if stock traded > 100 day MA
+        elif not screened.at[ticker, "above_ma"]:
+            skip(ticker, "trading below moving average")
+        # if stock moved > 15% in the past 90 days remove
+        elif not screened.at[ticker, "within_gap"]:
+            skip(
+                ticker,
+                "moved more than {0}% in the past {1} days".format(
+                    round(parameters["max_stock_gap"] * 100),
+                    parameters["slope_window_days"],
+                ),
+            )
+        elif not screened.at[ticker, "above_minimum"]:
+            skip(ticker, "score less than minimum")
+        else:
+            log(ticker, "success")
+    skip_summary("Screen skipped")
+
+    return rank(screened)
+
+
+def select_positions(parameters, broker, ranking_table):
+    """
+    Input:  Model parameters, broker snapshot and ranking table.
+    Output: Held positions that still rank and the new portfolio's ranking
+            rows.
+    """
+    kept_positions = []
+    for position in broker.positions():
+        if not broker.is_tradable(position.symbol):
+            log("{0} is not tradable, skipping".format(position.symbol), "error")
+            continue
+
+        if position.symbol not in ranking_table.index:
+            log("drop postion {0}".format(position.symbol), "info")
+        else:
+            kept_positions.append(position.symbol)
+
+    new_portfolio = select_portfolio(
+        ranking_table, kept_positions, parameters["portfolio_size"]
+    )
+
+    return kept_positions, new_portfolio
+
+
+def position_weights(parameters, store, new_portfolio, now=None):
+    """
+    Input:  Model parameters, price store, the new portfolio and the time the
+            window ends at, by default now.
+    Output: Frame indexed by ticker with volatility, last price and inverse
+            volatility weight.
+    """
+    # closes come from the rolling states loaded during screening, so this
+    # does no database I/O
+    portfolio_history = store.panel(
+        tickers=new_portfolio.index.tolist(),
+        trading_days=TRADING_DAYS_IN_YEAR,
+        now=now,
+    )
+
+    position_volatility_data = []
+    for ticker in new_portfolio.index:
+        equity_history = portfolio_history[ticker].dropna()
+
+        position_volatility_data.append(
+            {
+                "ticker": ticker,
+                "volatility": volatility(
+                    equity_history, vola_window=parameters["vola_window"]
+                ),
+                "price": equity_history.tail(1).iloc[0],
+            },
+        )
+
+    position_volatility = pd.DataFrame(
+        position_volatility_data, columns=["ticker", "volatility", "price"]
+    ).set_index("ticker")
+    position_volatility["weight"] = inverse_volatility_weights(
+        position_volatility["volatility"]
+    )
+
+    return position_volatility
+
+
+def plan_orders(broker, position_volatility, is_bull_market):
+    """
+    Input:  Broker snapshot, position weights and the market regime.
+    Output: OrderPlan; a bear market liquidates every tradable position.
+    """
+    log("Positions", "success")
+    current_holdings = {
+        position.symbol: int(float(position.qty)) for position in broker.positions()
+    }
+    untradable = [
+        symbol
+        for symbol in list(current_holdings) + position_volatility.index.tolist()
+        if not broker.is_tradable(symbol)
+    ]
+    for security in position_volatility.index.intersection(untradable):
+        log(f"{security} is not tradable, skipping", "error")
+
+    plan = plan_rebalance(
+        current_holdings,
+        position_volatility if is_bull_market else position_volatility.iloc[:0],
+        portfolio_value=broker.portfolio_value,
+        untradable=untradable,
+    )
+
+    for position in plan.positions:
+        log(
+            f"{position.security}: {position.qty}",
+            "info" if position.qty else "warning",
+        )
+
+    return plan
+
+
+def execute_orders(broker, plan):
+    """
+    Input:  Broker snapshot and the order plan.
+    Output: execution.OrderExecutor after submitting and reconciling the
+            plan's orders.
+    """
+    from execution import OrderExecutor
+
+    orders = OrderExecutor(
+        broker.api,
+        workers=int(os.getenv("ORDER_WORKERS", 8)),
+        timeout=float(os.getenv("ORDER_TIMEOUT_SECONDS", 60)),
+    )
+    for order in plan.orders:
+        orders.queue(order.symbol, order.side, order.qty)
+
+    # sells go out before buys, each wave concurrently
+    orders.execute()
+
+    return orders
+
+
+def report_positions(plan, is_bull_market, live_trade, email=False):
+    """
+    Input:  Order plan, market regime, trading mode and whether to email.
+    Output: Plain text position report.
+    """
+    global emails_sent
+
+    # too lazy to write better
+    message_body_html = "Market Condition: {0}<br>".format(
+        "Bull" if is_bull_market else "Bear"
+    )
+    message_body_plain = "Market Condition: {0}\n".format(
+        "Bull" if is_bull_market else "Bear"
+    )
+
+    message_body_html += "Total Positions: {0}<br>".format(len(plan.positions))
+    message_body_plain += "Total Positions: {0}\n".format(len(plan.positions))
+
+    message_body_html += "---------------------------------------------------<br>"
+    message_body_plain += "---------------------------------------------------\n"
+
+    for position in plan.positions:
+        diff = ""
+
+        if position.diff >= 0:
+            diff = "[+{0}]".format(position.diff)
+        elif position.diff < 0:
+            diff = "[{0}]".format(position.diff)
+
+        message_body_html += '<a clicktracking=off href="https://finviz.com/quote.ashx?t={0}">{1}</a>: {2} {3}<br>'.format(
+            position.security, position.security, position.qty, diff
+        )
+        message_body_plain += "{0}: {1} {2}\n".format(
+            position.security, position.qty, diff
+        )
+
+    if email:
+        from SES import AmazonSES
+
+        TO_ADDRESSES = [
+            addr for addr in os.getenv("TO_ADDRESSES", "").split(",") if addr
+        ]
+        ses = AmazonSES(
+            region=os.environ.get("AWS_SES_REGION_NAME"),
+            access_key=os.environ.get("AWS_SES_ACCESS_KEY_ID"),
+            secret_key=os.environ.get("AWS_SES_SECRET_ACCESS_KEY"),
+            from_address=os.environ.get("FROM_ADDRESS"),
+        )
+        if live_trade:
+            status = "Live"
+        else:
+            status = "Test"
+
+        subject = "Your Monthly Momentum Algo Position Report - {}".format(status)
+
+        for to_address in TO_ADDRESSES:
+            log(f"Email sent to {to_address}", "info")
+            ses.send_html_email(
+                to_address=to_address, subject=subject, content=message_body_html
+            )
+            emails_sent += 1
+
+    if str2bool(os.getenv("VERBOSE", False)):
+        print("---------------------------------------------------\n")
+        print(message_body_plain)
+
+    return message_body_plain
+
+
+def run_rebalance(
+    config,
+    broker,
+    store,
+    db_session,
+    clock=datetime.now,
+    live_trade=False,
+    dry_run=False,
+    macro=None,
+    run_report=None,
+):
+    """
+    Input:  [model] section of algo_settings.cfg (or its model_parameters
+            dict), broker.BrokerSnapshot, price store, database session and
+            clock, read once to end every window of the run. ``dry_run`` plans without sending orders or email. Stage
+            timings are recorded on ``run_report``.
+    Output: Dict with the regime, ranking table, order plan, executed orders,
+            report and run report, or None when nothing passes the screen.
+    """
+    import universe
+
+    parameters = model_parameters(config)
+    live_trade = live_trade and not dry_run
+    log(f"Running in {'LIVE' if live_trade else 'TEST'} mode", "info")
+
+    if macro is None:
+        from macro import MacroData
+
+        macro = MacroData(db_session)
+
+    now = clock()
+    run_report = run_report or RunReport()
+    run_report.counter("broker_calls", lambda: broker.calls)
+    if hasattr(store, "misses"):
+        run_report.counter("price_store_misses", lambda: store.misses)
+    if hasattr(macro, "requests"):
+        run_report.counter("fred_requests", lambda: macro.requests)
+    run_report.counter("wiki_requests", lambda: universe.wiki_requests)
+    run_report.counter("ses_sends", lambda: emails_sent)
+
+    with run_report.stage("history") as stage:
+        closes = market_history(parameters, store, now=now)
+        stage.rows = len(closes)
+
+    # the FRED request, if any, happens here
+    with run_report.stage("regime"):
+        is_bull_market = market_regime(closes, macro)
+
+    with run_report.stage("constituents") as stage:
+        companies = universe.constituents(
+            db_session,
+            sources=os.getenv("SP_CONSITUENTS").split(","),
+            ttl=timedelta(days=float(os.getenv("CONSTITUENTS_TTL_DAYS", 1))),
+            now=now,
+        )
+        stage.rows = len(companies)
+
+    with run_report.stage("screen") as stage:
+        ranking_table = screen_universe(parameters, store, companies, now=now)
+        stage.rows = len(ranking_table)
+    if ranking_table.empty:
+        log("No equities passed momentum screening. Exiting.", "error")
+        return None
+
+    log("Ranking Table", "success")
+    if str2bool(os.getenv("VERBOSE", False)):
+        print(ranking_table)
+
+    with run_report.stage("select") as stage:
+        kept_positions, new_portfolio = select_positions(
+            parameters, broker, ranking_table
+        )
+        stage.rows = len(new_portfolio)
+
+    with run_report.stage("weight") as stage:
+        position_volatility = position_weights(
+            parameters, store, new_portfolio, now=now
+        )
+        stage.rows = len(position_volatility)
+
+    with run_report.stage("plan") as stage:
+        plan = plan_orders(broker, position_volatility, is_bull_market)
+        stage.rows = len(plan.orders)
+    if is_bull_market:
+        if str2bool(os.getenv("VERBOSE", False)):
+            print(f"desired portfolio size: {len(new_portfolio)}")
+            print(f"position size: {sum(1 for p in plan.positions if p.qty)}")
+    else:
+        for position in kept_positions:
+            log(f"drop position {position}", "info")
+
+    with run_report.stage("execute") as stage:
+        orders = []
+        if live_trade:
+            executor = execute_orders(broker, plan)
+            orders = executor.orders
+            stage.calls["order_requests"] = executor.requests
+        stage.rows = len(orders)
+
+    if plan.market_weight:
+        if str2bool(os.getenv("VERBOSE", False)):
+            print("Market weight: {0}".format(round(plan.market_weight, 3)))
+
+    with run_report.stage("report"):
+        report = report_positions(
+            plan,
+            is_bull_market,
+            live_trade,
+            email=str2bool(os.getenv("EMAIL_POSITIONS", False)) and not dry_run,
+        )
+
+    if hasattr(store, "hits"):
+        log(f"Price store: {store.hits} hits, {store.misses} misses", "info")
+    log(f"Broker: {broker.calls} calls, {broker.saved_calls} saved", "info")
+    run_report.summary()
+
+    return {
+        "is_bull_market": is_bull_market,
+        "ranking_table": ranking_table,
+        "plan": plan,
+        "orders": orders,
+        "report": report,
+        "run_report": run_report,
+    }
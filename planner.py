@@ -0,0 +1,89 @@
+"""
+Pre-trade rebalance planner.
+
+Computes the whole rebalance as one vectorized delta between the current
+holdings and the target quantities of the weighted portfolio, and returns
+it as an immutable OrderPlan that order execution and the position report
+both read. Planning touches no broker, so it can be repeated cheaply, e.g.
+with fresh prices.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from execution import BUY, SELL
+from helper import share_quantity
+
+PlannedOrder = namedtuple("PlannedOrder", ["symbol", "side", "qty"])
+PlannedPosition = namedtuple(
+    "PlannedPosition", ["security", "action", "qty", "diff", "weight"]
+)
+
+
+class OrderPlan(namedtuple("OrderPlan", ["positions", "orders", "portfolio_value"])):
+    """
+    ``positions`` holds one row per target security for the report and
+    ``orders`` every order needed to reach them, sells before buys.
+    """
+
+    __slots__ = ()
+
+    @property
+    def sells(self):
+        return tuple(order for order in self.orders if order.side == SELL)
+
+    @property
+    def buys(self):
+        return tuple(order for order in self.orders if order.side == BUY)
+
+    @property
+    def market_weight(self):
+        return sum(position.weight for position in self.positions if position.qty)
+
+
+def plan_rebalance(current, targets, portfolio_value, untradable=()):
+    """
+    Input:  Current share quantities by symbol, target frame indexed by ticker
+            with ``price`` and ``weight`` columns (empty to liquidate), the
+            portfolio value and symbols that cannot be traded.
+    Output: OrderPlan taking the tradable holdings to the target quantities.
+    """
+    current = pd.Series(current, dtype=np.int64)
+    current = current[~current.index.isin(untradable)]
+    targets = targets.loc[~targets.index.isin(untradable)]
+
+    target_qty = pd.Series(
+        share_quantity(
+            price=targets["price"].to_numpy(dtype=np.float64),
+            weight=targets["weight"].to_numpy(dtype=np.float64),
+            portfolio_value=portfolio_value,
+        ),
+        index=targets.index,
+        dtype=np.int64,
+    )
+
+    symbols = targets.index.append(current.index.difference(targets.index))
+    target_qty = target_qty.reindex(symbols, fill_value=0)
+    held = current.reindex(symbols, fill_value=0)
+    delta = target_qty - held
+
+    is_held = symbols.isin(current.index)[: len(targets)]
+    diff = delta.iloc[: len(targets)].to_numpy()
+    qty = target_qty.iloc[: len(targets)].to_numpy()
+    action = np.where(is_held & (qty > 0) & (diff <= 0), SELL, BUY)
+
+    positions = tuple(
+        PlannedPosition(security, str(side), int(shares), int(change), float(weight))
+        for security, side, shares, change, weight in zip(
+            targets.index, action, qty, diff, targets["weight"]
+        )
+    )
+
+    sells = delta[delta < 0]
+    buys = delta[delta > 0]
+    orders = tuple(
+        PlannedOrder(symbol, SELL, int(-change)) for symbol, change in sells.items()
+    ) + tuple(PlannedOrder(symbol, BUY, int(change)) for symbol, change in buys.items())
+
+    return OrderPlan(positions, orders, portfolio_value)
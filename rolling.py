@@ -0,0 +1,327 @@
+"""
+Incremental rolling statistics for the momentum screen.
+
+Each security keeps a persisted models.RollingState holding its most recent
+``window`` closes and the running sums the regression and moving average
+need. Writes through RollingStatistics fold new bars into those sums in
+O(new bars), so the screen reads one row per security instead of rebuilding
+a year of prices. States that are missing or invalidated by a backfill are
+rebuilt from the underlying store the next time they are read; a security
+without stored prices gets an empty state, so it is not rebuilt on every
+screen. Windows ending before the last session, as a past clock asks for,
+are read from the underlying store since the states only hold the latest
+closes. Sessions should be opened with ``expire_on_commit=False``, otherwise
+every commit makes each loaded state reload itself on its next read.
+"""
+
+import math
+from datetime import datetime
+
+import models
+import numpy as np
+import pandas as pd
+from helper import SQLITE_MAX_VARIABLES
+from panel import PricePanel
+from screener import score_from_sums, screen_store
+from store import bar_datetime
+from trading_calendar import last_session, window_start
+
+
+def _buffers(state):
+    return (
+        np.frombuffer(state.days, dtype=np.int32),
+        np.frombuffer(state.closes, dtype=np.float64),
+    )
+
+
+def _set_buffers(state, days, closes):
+    state.days = np.asarray(days, dtype=np.int32).tobytes()
+    state.closes = np.asarray(closes, dtype=np.float64).tobytes()
+    state.observations = len(closes)
+    state.date = datetime.fromordinal(int(days[-1]))
+
+
+def _recompute(state, ma_window):
+    days, closes = _buffers(state)
+    y = np.log(closes)
+    x = np.arange(len(y))
+
+    state.sum_y = float(y.sum())
+    state.sum_xy = float((x * y).sum())
+    state.sum_yy = float((y * y).sum())
+    state.sum_ma = float(closes[-ma_window:].sum())
+    state.updates = 0
+
+
+def _append(state, days, closes, window, ma_window):
+    buffer_days, buffer_closes = _buffers(state)
+    buffer_days = buffer_days.tolist()
+    buffer_closes = buffer_closes.tolist()
+
+    for day, close in zip(days, closes):
+        y = math.log(close)
+        if len(buffer_closes) == window:
+            # slide the window: the oldest close leaves and every x shifts down
+            y_0 = math.log(buffer_closes.pop(0))
+            buffer_days.pop(0)
+            state.sum_xy += (window - 1) * y - (state.sum_y - y_0)
+            state.sum_y += y - y_0
+            state.sum_yy += y * y - y_0 * y_0
+        else:
+            state.sum_xy += len(buffer_closes) * y
+            state.sum_y += y
+            state.sum_yy += y * y
+
+        if len(buffer_closes) >= ma_window:
+            state.sum_ma -= buffer_closes[-ma_window]
+        state.sum_ma += close
+
+        buffer_days.append(day)
+        buffer_closes.append(close)
+        state.updates += 1
+
+    _set_buffers(state, buffer_days, buffer_closes)
+
+    # bound floating point drift in the running sums
+    if state.updates >= window:
+        _recompute(state, ma_window)
+
+
+class RollingStatistics(object):
+    """
+    Store wrapper that keeps each security's RollingState current as bars are
+    written and screens the universe from those states. ``hits`` counts the
+    tickers read from a state, ``misses`` the ones read from the underlying
+    store.
+    """
+
+    def __init__(self, store, db_session, window=252, ma_window=100):
+        self.store = store
+        self.db_session = db_session
+        self.window = window
+        self.ma_window = ma_window
+        self.states = {}
+        self.hits = 0
+        self.misses = 0
+
+    def security(self, ticker, name=None, type="stock"):
+        return self.store.security(ticker, name=name, type=type)
+
+    def last_date(self, security):
+        return self.store.last_date(security)
+
+    def _load(self, tickers):
+        missing = [
+            ticker for ticker in dict.fromkeys(tickers) if ticker not in self.states
+        ]
+        for i in range(0, len(missing), SQLITE_MAX_VARIABLES):
+            chunk = missing[i : i + SQLITE_MAX_VARIABLES]
+            for state in self.db_session.query(models.RollingState).filter(
+                models.RollingState.ticker.in_(chunk)
+            ):
+                self.states[state.ticker] = state
+            for ticker in chunk:
+                self.states.setdefault(ticker, None)
+
+        return self.states
+
+    def _rebuild(self, tickers):
+        panel = self.store.history(tickers, self.window)
+        for ticker in tickers:
+            state = self.states.get(ticker) or models.RollingState(ticker)
+            self.db_session.add(state)
+            self.states[ticker] = state
+            if ticker not in panel.columns:
+                # no stored prices, the empty state marks it as known
+                continue
+
+            closes = panel[ticker].dropna().tail(self.window)
+            _set_buffers(
+                state,
+                [day.toordinal() for day in closes.index.date],
+                closes.to_numpy(),
+            )
+            _recompute(state, self.ma_window)
+
+        self.db_session.commit()
+
+    def write(self, security, hist):
+        inserted = self.store.write(security, hist)
+
+        ticker = getattr(security, "ticker", security)
+        state = self._load([ticker])[ticker]
+        if state is None or not len(hist):
+            return inserted
+
+        if not state.observations:
+            # the first bars of an empty state, rebuild it on the next read
+            self.db_session.delete(state)
+            self.states[ticker] = None
+            self.db_session.commit()
+            return inserted
+
+        days = np.array([bar_datetime(price).date().toordinal() for price in hist])
+        closes = np.array([price.c for price in hist], dtype=np.float64)
+        order = np.argsort(days, kind="stable")
+        days, closes = days[order], closes[order]
+
+        buffer_days, _ = _buffers(state)
+        older = days <= buffer_days[-1]
+        if not np.isin(days[older], buffer_days).all():
+            # a backfill landed inside the window, rebuild it on the next read
+            self.db_session.delete(state)
+            self.states[ticker] = None
+        else:
+            _append(state, days[~older], closes[~older], self.window, self.ma_window)
+
+        self.db_session.commit()
+
+        return inserted
+
+    def gaps(self, trading_days=252 * 2, sessions=None):
+        return self.store.gaps(trading_days=trading_days, sessions=sessions)
+
+    def raw_since(self, tickers):
+        return self.store.raw_since(tickers)
+
+    def reset(self):
+        # forget the loaded states, they are reloaded on their next read
+        self.states = {}
+
+    def write_actions(self, actions):
+        # states hold adjusted closes, so a new action rebuilds them on the
+        # next read
+        tickers = list({action["ticker"] for action in actions})
+        states = self._load(tickers)
+        for ticker in tickers:
+            if states[ticker] is not None:
+                self.db_session.delete(states[ticker])
+                self.states[ticker] = None
+
+        inserted = self.store.write_actions(actions)
+        self.db_session.commit()
+
+        return inserted
+
+    def _current(self, now):
+        # the states end on the latest stored close, not an earlier one
+        return now is None or last_session(now) >= last_session()
+
+    def panel(self, tickers, trading_days, now=None):
+        """
+        Closes inside the stored windows are served from the states, other
+        tickers, longer lookbacks and earlier windows from the underlying
+        store's compact read.
+        """
+        if int(trading_days) > self.window or not self._current(now):
+            self.misses += len(tickers)
+            return self.store.panel(tickers, trading_days, now=now)
+
+        past = window_start(trading_days, now).toordinal()
+
+        columns = {}
+        missing = []
+        for ticker in dict.fromkeys(tickers):
+            state = self.states.get(ticker)
+            if state is None:
+                missing.append(ticker)
+                continue
+
+            days, closes = _buffers(state)
+            recent = days >= past
+            columns[ticker] = days[recent], closes[recent]
+
+        self.hits += len(columns)
+        self.misses += len(missing)
+        if not columns:
+            return self.store.panel(missing, trading_days, now=now)
+
+        if missing:
+            panel = self.store.panel(missing, trading_days, now=now)
+            for ticker in missing:
+                columns[ticker] = panel.column(ticker)
+
+        return PricePanel.from_columns(columns)
+
+    def history(self, tickers, trading_days, now=None):
+        return self.panel(tickers, trading_days, now=now).to_frame()
+
+    def screen(
+        self,
+        tickers,
+        gap_window=125,
+        max_stock_gap=0.15,
+        minimum_score_momentum=40,
+        trading_days=252,
+        now=None,
+    ):
+        """
+        Input:  Tickers, the model's filter parameters and the time the
+                windows end at, by default now.
+        Output: Same table as screener.screen, computed from the states.
+        """
+        tickers = list(dict.fromkeys(tickers))
+        if not self._current(now):
+            self.misses += len(tickers)
+            return screen_store(
+                self.store,
+                tickers,
+                gap_window=gap_window,
+                max_stock_gap=max_stock_gap,
+                minimum_score_momentum=minimum_score_momentum,
+                trading_days=trading_days,
+                ma_window=self.ma_window,
+                now=now,
+            )
+
+        states = self._load(tickers)
+        missing = [ticker for ticker in tickers if states[ticker] is None]
+        self.hits += len(tickers) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            self._rebuild(missing)
+
+        # states that stopped updating before the window are treated as empty
+        past = window_start(trading_days, now)
+        states = [
+            self.states[ticker]
+            for ticker in tickers
+            if self.states.get(ticker) is not None
+            and self.states[ticker].observations
+            and self.states[ticker].date >= past
+        ]
+
+        n = np.array([state.observations for state in states], dtype=np.float64)
+        closes = np.empty(len(states))
+        max_move = np.zeros(len(states))
+        for i, state in enumerate(states):
+            _, buffer_closes = _buffers(state)
+            closes[i] = buffer_closes[-1]
+            recent = buffer_closes[-gap_window:]
+            if len(recent) > 1:
+                max_move[i] = np.abs(recent[1:] / recent[:-1] - 1).max()
+
+        result = pd.DataFrame(
+            {
+                "observations": n.astype(int),
+                "close": closes,
+                "moving_average": np.array([state.sum_ma for state in states])
+                / np.minimum(n, self.ma_window),
+                "max_move": max_move,
+                "score": score_from_sums(
+                    n,
+                    np.array([state.sum_y for state in states]),
+                    np.array([state.sum_xy for state in states]),
+                    np.array([state.sum_yy for state in states]),
+                    trading_days=trading_days,
+                ),
+            },
+            index=pd.Index([state.ticker for state in states], name="ticker"),
+        )
+
+        result["has_data"] = result["observations"] > 0
+        result["above_ma"] = result["close"] > result["moving_average"]
+        result["within_gap"] = ~(result["max_move"] > max_stock_gap)
+        result["above_minimum"] = ~(result["score"] <= minimum_score_momentum)
+
+        return result
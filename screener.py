@@ -0,0 +1,252 @@
+"""
+Vectorized momentum screen over a date x ticker price panel.
+
+Every column is treated as its own series of valid (non-NaN) closes, so the
+results match running the per-ticker helpers on ``panel[ticker].dropna()``.
+Panels may be DataFrames or panel.PricePanel objects.
+"""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+
+def momentum_scores(panel, trading_days=252):
+    """
+    Input:  Date x ticker price panel.
+    Output: Series of annualized exponential regression slopes multiplied by
+            the R2, one per ticker. Same values as helper.momentum_score.
+    """
+    return pd.Series(
+        _momentum_scores(panel.to_numpy(dtype=np.float64), trading_days),
+        index=panel.columns,
+        name="score",
+    )
+
+
+def _momentum_scores(values, trading_days=252):
+    # float32 closes are widened, the regression sums need the precision
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    n = valid.sum(axis=0).astype(np.float64)
+
+    # regress on the position of each valid close, shared by every column
+    x = np.cumsum(valid, axis=0) - 1.0
+    y = np.log(np.where(valid, values, 1.0))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_x = (n - 1.0) / 2.0
+        mean_y = np.where(valid, y, 0.0).sum(axis=0) / n
+        dx = np.where(valid, x - mean_x, 0.0)
+        dy = np.where(valid, y - mean_y, 0.0)
+
+        ss_x = n * (n * n - 1.0) / 12.0
+        ss_y = (dy * dy).sum(axis=0)
+        ss_xy = (dx * dy).sum(axis=0)
+
+        slope = ss_xy / ss_x
+        # scipy.stats.linregress reports r = 0 for a flat series
+        r_squared = np.where(
+            (ss_x == 0.0) | (ss_y == 0.0), 0.0, ss_xy * ss_xy / (ss_x * ss_y)
+        )
+
+        annualized_slope = (np.power(np.exp(slope), trading_days) - 1) * 100
+        scores = annualized_slope * r_squared
+
+    scores[n < 2] = np.nan
+    return scores
+
+
+def score_from_sums(n, sum_y, sum_xy, sum_yy, trading_days=252):
+    """
+    Input:  Per-ticker count of closes and the sums of y, x*y and y*y, where y
+            is the log close and x its position (0 .. n-1) in the window.
+    Output: Array of momentum scores, as momentum_scores computes them.
+    """
+    n = np.asarray(n, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        ss_x = n * (n * n - 1.0) / 12.0
+        ss_xy = sum_xy - (n - 1.0) / 2.0 * sum_y
+        ss_y = sum_yy - sum_y * sum_y / n
+
+        slope = ss_xy / ss_x
+        r_squared = np.where(
+            (ss_x <= 0.0) | (ss_y <= 0.0), 0.0, ss_xy * ss_xy / (ss_x * ss_y)
+        )
+        scores = (np.power(np.exp(slope), trading_days) - 1) * 100 * r_squared
+
+    return np.where(n < 2, np.nan, scores)
+
+
+def screen(
+    panel,
+    ma_window=100,
+    gap_window=125,
+    max_stock_gap=0.15,
+    minimum_score_momentum=40,
+    trading_days=252,
+):
+    """
+    Input:  Date x ticker price panel (DataFrame or PricePanel) and the
+            model's filter parameters.
+    Output: DataFrame indexed by ticker with the number of observations, last
+            close, moving average over the last ``ma_window`` closes, largest
+            absolute daily move over the last ``gap_window`` closes, the
+            momentum score and a flag per filter.
+    """
+    values = panel.to_numpy(dtype=np.float64)
+    valid = ~np.isnan(values)
+    n = valid.sum(axis=0)
+
+    # distance of each valid close from the newest one in its column
+    position = np.cumsum(valid, axis=0) - 1
+    from_end = n - 1 - position
+
+    last = np.where(valid & (from_end == 0), values, 0.0).sum(axis=0)
+
+    in_ma = valid & (from_end < ma_window)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        moving_average = np.where(in_ma, values, 0.0).sum(axis=0) / in_ma.sum(axis=0)
+
+    # daily moves between consecutive valid closes inside the gap window;
+    # previous is the last valid close before each row
+    filled = np.where(valid, np.arange(len(values))[:, None], 0)
+    np.maximum.accumulate(filled, axis=0, out=filled)
+    previous = np.full_like(values, np.nan)
+    previous[1:] = np.take_along_axis(values, filled, axis=0)[:-1]
+    in_gap = valid & (position >= 1) & (from_end < gap_window - 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        moves = np.abs(values / previous - 1)
+    max_move = np.where(in_gap, moves, 0.0).max(axis=0, initial=0.0)
+
+    result = pd.DataFrame(
+        {
+            "observations": n,
+            "close": np.where(n > 0, last, np.nan),
+            "moving_average": moving_average,
+            "max_move": max_move,
+        },
+        index=panel.columns,
+    )
+    result["score"] = momentum_scores(panel, trading_days=trading_days)
+    result.index.name = "ticker"
+
+    result["has_data"] = result["observations"] > 0
+    result["above_ma"] = result["close"] > result["moving_average"]
+    result["within_gap"] = ~(result["max_move"] > max_stock_gap)
+    result["above_minimum"] = ~(result["score"] <= minimum_score_momentum)
+
+    return result
+
+
+def screen_windows(
+    history,
+    max_stock_gap=0.15,
+    minimum_score_momentum=40,
+    trading_days=252,
+):
+    """
+    Input:  store.HistoryWindows with "score", "ma" and "gap" windows and the
+            model's filter parameters.
+    Output: Same table as screen(). Each filter reads its own view of the
+            shared buffer, so windows count sessions: a day without a close
+            still takes its place in the window.
+    """
+    scored = history.window("score")
+    valid = ~np.isnan(scored)
+    n = valid.sum(axis=0)
+
+    # newest valid close of each column, none in an empty history
+    last = np.full(scored.shape[1], np.nan)
+    if len(scored):
+        last_row = len(scored) - 1 - np.argmax(valid[::-1], axis=0)
+        last = scored[last_row, np.arange(scored.shape[1])]
+
+    with np.errstate(divide="ignore", invalid="ignore"), warnings.catch_warnings():
+        # all-NaN columns average to NaN, which fails the filter below
+        warnings.simplefilter("ignore", RuntimeWarning)
+        moving_average = np.nanmean(history.window("ma"), axis=0)
+
+        # moves from the last valid close before each row, as screen() does,
+        # so a jump across a missing session still counts
+        gap = history.window("gap")
+        filled = np.where(~np.isnan(gap), np.arange(len(gap))[:, None], 0)
+        np.maximum.accumulate(filled, axis=0, out=filled)
+        previous = np.take_along_axis(gap, filled, axis=0)[:-1]
+        moves = np.abs(gap[1:] / previous - 1)
+        max_move = np.nan_to_num(np.nanmax(moves, axis=0, initial=0.0), nan=0.0)
+
+    result = pd.DataFrame(
+        {
+            "observations": n,
+            "close": np.where(n > 0, last, np.nan),
+            "moving_average": moving_average,
+            "max_move": max_move,
+            "score": _momentum_scores(scored, trading_days),
+        },
+        index=pd.Index(history.tickers, name="ticker"),
+    )
+
+    result["has_data"] = result["observations"] > 0
+    result["above_ma"] = result["close"] > result["moving_average"]
+    result["within_gap"] = ~(result["max_move"] > max_stock_gap)
+    result["above_minimum"] = ~(result["score"] <= minimum_score_momentum)
+
+    return result
+
+
+def rank(screened):
+    """
+    Input:  Output of screen().
+    Output: Tickers passing every filter, sorted by score.
+    """
+    passed = screened[
+        screened["has_data"]
+        & screened["above_ma"]
+        & screened["within_gap"]
+        & screened["above_minimum"]
+    ]
+    return passed[["score"]].sort_values(by=["score"], ascending=[False])
+
+
+def screen_store(
+    store,
+    tickers,
+    gap_window=125,
+    max_stock_gap=0.15,
+    minimum_score_momentum=40,
+    trading_days=252,
+    ma_window=100,
+    now=None,
+):
+    """
+    Input:  Price store, tickers, the model's filter parameters and the time
+            the windows end at, by default now.
+    Output: Same table as screen(), from the store's own screen when it keeps
+            rolling statistics and otherwise from one history read serving
+            the score, moving average and gap windows.
+    """
+    parameters = {
+        "gap_window": gap_window,
+        "max_stock_gap": max_stock_gap,
+        "minimum_score_momentum": minimum_score_momentum,
+        "trading_days": trading_days,
+    }
+    if hasattr(store, "screen"):
+        return store.screen(tickers, now=now, **parameters)
+
+    from store import history_windows
+
+    history = history_windows(
+        store,
+        tickers,
+        {"score": trading_days, "ma": ma_window, "gap": gap_window},
+        now=now,
+    )
+    return screen_windows(
+        history,
+        max_stock_gap=max_stock_gap,
+        minimum_score_momentum=minimum_score_momentum,
+        trading_days=trading_days,
+    )
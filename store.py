@@ -0,0 +1,773 @@
+"""
+Price storage backends.
+
+Every backend exposes the same interface used by ingestion and screening:
+
+    security(ticker, name, type)  -> handle for the security, created if new
+    last_date(security)           -> datetime of the newest stored close
+    write(security, hist)         -> store Alpaca bars, skipping stored days
+    history(tickers, trading_days) -> date x ticker DataFrame of closes
+    panel(tickers, trading_days)   -> the same closes as a panel.PricePanel
+
+history_windows(store, tickers, windows) serves several lookbacks as views
+into one read of the longest. Wrappers that adjust or cache closes also pass
+write_actions(actions) on, so
+a new corporate action reaches every layer, raw_since(tickers), the first
+day of each ticker's unadjusted bars, and gaps(trading_days), the sessions
+missing inside each security's stored range.
+
+The backend is selected with the PRICE_STORE environment variable.
+"""
+
+import bisect
+import json
+import os
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+import models
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from helper import SQLITE_MAX_VARIABLES, compact_history
+from panel import PricePanel
+from screener import screen_store
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from trading_calendar import last_session, sessions_between, window_start
+
+
+def bar_datetime(price):
+    # bar timestamps arrive as pandas Timestamps, which is far cheaper to
+    # convert directly than to format and re-parse with dateutil
+    return pd.Timestamp(price.t).to_pydatetime()
+
+
+def missing_ranges(sessions, stored):
+    """
+    Input:  Sorted session ordinals and the sorted ordinals stored for one
+            security.
+    Output: List of (first, last) ordinals of the runs of consecutive
+            sessions missing between the first and last stored day. Days
+            before the first bar, such as before a listing, are not gaps.
+    """
+    sessions = np.asarray(sessions)
+    stored = np.asarray(stored)
+    if len(stored) < 2:
+        return []
+
+    inside = sessions[(sessions > stored[0]) & (sessions < stored[-1])]
+    missing = inside[~np.isin(inside, stored)]
+    if not len(missing):
+        return []
+
+    # a run continues while the next missing day is the next session
+    positions = np.searchsorted(sessions, missing)
+    starts = np.flatnonzero(np.diff(positions, prepend=-2) != 1)
+    ends = np.append(starts[1:], len(missing)) - 1
+
+    return list(zip(missing[starts].tolist(), missing[ends].tolist()))
+
+
+def gap_dates(ranges):
+    # ordinal ranges as the datetimes ingestion requests bars with
+    return [
+        (datetime.fromordinal(first), datetime.fromordinal(last))
+        for first, last in ranges
+    ]
+
+
+class HistoryWindows(object):
+    """
+    Closes for several named lookbacks from one read. ``values`` is a single
+    C-contiguous session x ticker matrix sized to the longest window and
+    window(name) returns its last rows as a view, so every window shares the
+    same memory.
+    """
+
+    __slots__ = ("values", "index", "tickers", "lengths")
+
+    def __init__(self, panel, windows):
+        # the panel's own dtype, so float32 closes stay float32
+        self.values = np.ascontiguousarray(panel.to_numpy())
+        self.index = panel.index
+        self.tickers = panel.columns
+        self.lengths = {name: int(length) for name, length in windows.items()}
+
+    def window(self, name):
+        return self.values[-self.lengths[name] :]
+
+    def frame(self, name):
+        # DataFrame over the view, for code expecting a panel
+        length = self.lengths[name]
+        return pd.DataFrame(
+            self.window(name),
+            index=self.index[-length:],
+            columns=self.tickers,
+            copy=False,
+        )
+
+
+def history_windows(store, tickers, windows, now=None):
+    """
+    Input:  Price store, tickers, a dict of window name to trading days and
+            the time the windows end at, by default now.
+    Output: HistoryWindows over one store.panel read of the longest window.
+    """
+    return HistoryWindows(store.panel(tickers, max(windows.values()), now=now), windows)
+
+
+class SQLiteStore(object):
+    """
+    One row per (security, day) in the price table. Closes are read into
+    ``dtype`` matrices; float32 halves their memory.
+    """
+
+    def __init__(self, engine, db_session, dtype=np.float64):
+        self.engine = engine
+        self.db_session = db_session
+        self.dtype = np.dtype(dtype)
+
+    def security(self, ticker, name=None, type="stock"):
+        security = (
+            self.db_session.query(models.Security)
+            .filter(models.Security.ticker == ticker)
+            .first()
+        )
+        if not security:
+            security = models.Security(ticker=ticker, name=name, type="stock")
+            self.db_session.add(security)
+            self.db_session.commit()
+
+        return security
+
+    def last_date(self, security):
+        return (
+            self.db_session.query(sqlalchemy.func.max(models.Price.date))
+            .filter(models.Price.security_id == security.id)
+            .scalar()
+        )
+
+    def raw_since(self, tickers):
+        """
+        Output: Dict of ticker to the first day whose stored close is raw:
+                the day after the newest bar stored without an open (those
+                were adjusted at download) or else the first bar. Tickers
+                without bars are left out.
+        """
+        since = {}
+        for i in range(0, len(tickers), SQLITE_MAX_VARIABLES):
+            query = (
+                sqlalchemy.select(
+                    models.Security.ticker,
+                    sqlalchemy.func.max(
+                        sqlalchemy.case(
+                            (models.Price.open.is_(None), models.Price.date)
+                        )
+                    ),
+                    sqlalchemy.func.min(models.Price.date),
+                )
+                .join(models.Price, models.Price.security_id == models.Security.id)
+                .where(
+                    models.Security.ticker.in_(tickers[i : i + SQLITE_MAX_VARIABLES])
+                )
+                .group_by(models.Security.ticker)
+            )
+            for ticker, adjusted, first in self.db_session.execute(query):
+                since[ticker] = adjusted + timedelta(days=1) if adjusted else first
+
+        return since
+
+    def write(self, security, hist):
+        rows = [
+            {
+                # raw bars; splits and dividends are applied by AdjustedStore
+                "open": getattr(price, "o", None),
+                "high": getattr(price, "h", None),
+                "low": getattr(price, "l", None),
+                "close": price.c,
+                "volume": getattr(price, "v", None),
+                "date": bar_datetime(price),
+                "security_id": security.id,
+            }
+            for price in hist
+        ]
+        if rows:
+            # one executemany; bars already stored are skipped so re-runs are safe
+            self.db_session.execute(
+                sqlite_insert(models.Price.__table__).on_conflict_do_nothing(
+                    index_elements=["security_id", "date"]
+                ),
+                rows,
+            )
+        self.db_session.commit()
+
+        return len(rows)
+
+    def history(self, tickers, trading_days, now=None):
+        return self.panel(tickers, trading_days, now=now).to_frame()
+
+    def panel(self, tickers, trading_days, now=None):
+        return compact_history(
+            self.engine, tickers, trading_days, dtype=self.dtype, now=now
+        )
+
+    def gaps(self, trading_days=252 * 2, sessions=None):
+        """
+        Input:  Lookback in trading days and the session ordinals to check
+                against, by default the exchange calendar's.
+        Output: Dict of ticker to (start_date, end_date) ranges of missing
+                sessions, from one aggregate query over the price table and
+                a date query for the securities that come up short only.
+        """
+        past = window_start(trading_days)
+        price = models.Price.__table__
+        if sessions is None:
+            sessions = sessions_between(past, last_session())
+        sessions = np.unique(np.asarray(sessions, dtype=np.int64))
+
+        with self.engine.connect() as connection:
+
+            spans = pd.read_sql(
+                sqlalchemy.select(
+                    price.c.security_id,
+                    sqlalchemy.func.min(price.c.date).label("first"),
+                    sqlalchemy.func.max(price.c.date).label("last"),
+                    sqlalchemy.func.count().label("stored"),
+                )
+                .where(price.c.date >= past)
+                .group_by(price.c.security_id),
+                con=connection,
+            )
+            first = pd.to_datetime(spans["first"]).dt.date.map(date.toordinal)
+            last = pd.to_datetime(spans["last"]).dt.date.map(date.toordinal)
+            expected = np.searchsorted(
+                sessions, last.to_numpy(), side="right"
+            ) - np.searchsorted(sessions, first.to_numpy(), side="left")
+            short = spans["security_id"][spans["stored"].to_numpy() < expected].tolist()
+
+            gaps = {}
+            for i in range(0, len(short), SQLITE_MAX_VARIABLES):
+                stored = pd.read_sql(
+                    sqlalchemy.select(
+                        models.Security.ticker, price.c.security_id, price.c.date
+                    )
+                    .join(models.Security, models.Security.id == price.c.security_id)
+                    .where(
+                        price.c.security_id.in_(short[i : i + SQLITE_MAX_VARIABLES]),
+                        price.c.date >= past,
+                    ),
+                    con=connection,
+                )
+                stored["day"] = pd.to_datetime(stored["date"]).dt.date.map(
+                    date.toordinal
+                )
+                for ticker, days in stored.groupby("ticker")["day"]:
+                    ranges = missing_ranges(sessions, np.sort(days.to_numpy()))
+                    if ranges:
+                        gaps[ticker] = gap_dates(ranges)
+
+        return gaps
+
+
+class MemmapStore(object):
+    """
+    Closes kept as a row-major float64 matrix (day x ticker) in a raw file
+    that is memory-mapped on read, next to a JSON index of days and tickers.
+    New days are appended to the end of the file; columns are reserved in
+    blocks so new tickers rarely force a rewrite.
+    """
+
+    COLUMN_BLOCK = 256
+
+    def __init__(self, path):
+        self.path = path
+        self.data_path = os.path.join(path, "closes.f64")
+        self.index_path = os.path.join(path, "index.json")
+        os.makedirs(path, exist_ok=True)
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+        else:
+            index = {"capacity": self.COLUMN_BLOCK, "days": [], "securities": {}}
+
+        self.capacity = index["capacity"]
+        self.days = index["days"]
+        self.securities = index["securities"]
+        self.tickers = sorted(
+            self.securities, key=lambda ticker: self.securities[ticker]["column"]
+        )
+        self.rows = {day: row for row, day in enumerate(self.days)}
+
+        if not os.path.exists(self.data_path):
+            open(self.data_path, "wb").close()
+
+    def _matrix(self, mode="r"):
+        if not self.days:
+            return np.empty((0, self.capacity), dtype=np.float64)
+        return np.memmap(
+            self.data_path,
+            dtype=np.float64,
+            mode=mode,
+            shape=(len(self.days), self.capacity),
+        )
+
+    def _save_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "capacity": self.capacity,
+                    "days": self.days,
+                    "securities": self.securities,
+                },
+                f,
+            )
+        os.replace(tmp_path, self.index_path)
+
+    def _rebuild(self, days, capacity):
+        # rewrite the matrix when a day lands in the middle or columns run out
+        matrix = np.full((len(days), capacity), np.nan)
+        if self.days:
+            rows = np.searchsorted(np.asarray(days), self.days)
+            matrix[rows, : self.capacity] = self._matrix()
+
+        tmp_path = self.data_path + ".tmp"
+        matrix.tofile(tmp_path)
+        os.replace(tmp_path, self.data_path)
+
+        self.days = list(days)
+        self.capacity = capacity
+        self.rows = {day: row for row, day in enumerate(self.days)}
+
+    def _append_days(self, days):
+        with open(self.data_path, "ab") as f:
+            np.full((len(days), self.capacity), np.nan).tofile(f)
+
+        for day in days:
+            self.rows[day] = len(self.days)
+            self.days.append(day)
+
+    def security(self, ticker, name=None, type="stock"):
+        if ticker not in self.securities:
+            if len(self.tickers) == self.capacity:
+                self._rebuild(self.days, self.capacity + self.COLUMN_BLOCK)
+
+            self.securities[ticker] = {
+                "column": len(self.tickers),
+                "name": name,
+                "type": type,
+            }
+            self.tickers.append(ticker)
+            self._save_index()
+
+        return ticker
+
+    def last_date(self, security):
+        if not self.days:
+            return None
+
+        column = self._matrix()[:, self.securities[security]["column"]]
+        stored = np.flatnonzero(~np.isnan(column))
+        if not len(stored):
+            return None
+
+        return datetime.fromordinal(self.days[stored[-1]])
+
+    def raw_since(self, tickers):
+        """
+        Output: Dict of ticker to its first stored day, for tickers with bars.
+        """
+        matrix = self._matrix()
+        since = {}
+        for ticker in tickers:
+            if ticker not in self.securities:
+                continue
+            stored = np.flatnonzero(
+                ~np.isnan(matrix[:, self.securities[ticker]["column"]])
+            )
+            if len(stored):
+                since[ticker] = datetime.fromordinal(self.days[stored[0]])
+
+        return since
+
+    def write(self, security, hist):
+        if not len(hist):
+            return 0
+
+        days = [bar_datetime(price).date().toordinal() for price in hist]
+        closes = np.array([price.c for price in hist], dtype=np.float64)
+
+        new_days = sorted(set(days) - set(self.rows))
+        if new_days and self.days and new_days[0] < self.days[-1]:
+            self._rebuild(sorted(set(self.days) | set(new_days)), self.capacity)
+        elif new_days:
+            self._append_days(new_days)
+
+        matrix = self._matrix(mode="r+")
+        rows = np.array([self.rows[day] for day in days])
+        column = self.securities[security]["column"]
+
+        # days already stored are skipped so re-runs are safe
+        empty = np.isnan(matrix[rows, column])
+        matrix[rows[empty], column] = closes[empty]
+        matrix.flush()
+
+        self._save_index()
+
+        return int(empty.sum())
+
+    def history(self, tickers, trading_days, now=None):
+        return self.panel(tickers, trading_days, now=now).to_frame()
+
+    def panel(self, tickers, trading_days, now=None):
+        past = window_start(trading_days, now).toordinal()
+        start = bisect.bisect_left(self.days, past)
+        end = len(self.days)
+        if now is not None:
+            # days after an earlier clock's last session are left out
+            end = bisect.bisect_right(self.days, last_session(now).toordinal())
+
+        # a view into the mapped file, nothing is read until it is touched
+        block = self._matrix()[start:end, : len(self.tickers)]
+        has_data = ~np.isnan(block).all(axis=0)
+        columns = [
+            self.securities[ticker]["column"]
+            for ticker in dict.fromkeys(tickers)
+            if ticker in self.securities and has_data[self.securities[ticker]["column"]]
+        ]
+
+        if columns == list(range(len(self.tickers))):
+            values = block
+        else:
+            values = block[:, columns]
+
+        return PricePanel(values, self.days[start:end], columns, self.tickers)
+
+    def gaps(self, trading_days=252 * 2, sessions=None):
+        """
+        Input:  Lookback in trading days and the session ordinals to check
+                against, by default the exchange calendar's.
+        Output: Dict of ticker to (start_date, end_date) ranges of missing
+                sessions.
+        """
+        past = window_start(trading_days)
+        start = bisect.bisect_left(self.days, past.toordinal())
+        days = np.asarray(self.days[start:], dtype=np.int64)
+        if sessions is None:
+            sessions = sessions_between(past, last_session())
+        sessions = np.unique(np.asarray(sessions, dtype=np.int64))
+
+        stored = ~np.isnan(self._matrix()[start:, : len(self.tickers)])
+        # a full column has nothing missing unless the calendar has days
+        # the store never saw
+        complete = stored.all(axis=0) & np.isin(sessions, days).all()
+
+        gaps = {}
+        for column in np.flatnonzero(~complete):
+            ranges = missing_ranges(sessions, days[stored[:, column]])
+            if ranges:
+                gaps[self.tickers[column]] = gap_dates(ranges)
+
+        return gaps
+
+
+class AdjustedStore(object):
+    """
+    Store wrapper serving split and dividend adjusted closes. The wrapped
+    store keeps raw bars and models.CorporateAction the actions; each close is
+    multiplied on read by the product of the factors of every action that
+    went ex after it. The ex-dates and cumulative factors are cached per
+    ticker and dropped when a new action for it is written, so an action
+    never requires downloading the history again.
+    """
+
+    def __init__(self, store, db_session):
+        self.store = store
+        self.db_session = db_session
+        self.factors = {}
+
+    def security(self, ticker, name=None, type="stock"):
+        return self.store.security(ticker, name=name, type=type)
+
+    def last_date(self, security):
+        return self.store.last_date(security)
+
+    def write(self, security, hist):
+        return self.store.write(security, hist)
+
+    def gaps(self, trading_days=252 * 2, sessions=None):
+        return self.store.gaps(trading_days=trading_days, sessions=sessions)
+
+    def raw_since(self, tickers):
+        return self.store.raw_since(tickers)
+
+    def actions_since(self, tickers):
+        """
+        Input:  Tickers to fetch corporate actions for.
+        Output: Dict of ticker to the first ex-date to request: the day after
+                the last check recorded by checked(), or else the first day
+                whose stored close is raw. Tickers without bars are left out,
+                there is nothing to adjust yet.
+        """
+        tickers = list(dict.fromkeys(tickers))
+        since = self.store.raw_since(tickers)
+        for i in range(0, len(tickers), SQLITE_MAX_VARIABLES):
+            for check in self.db_session.query(models.CorporateActionCheck).filter(
+                models.CorporateActionCheck.ticker.in_(
+                    tickers[i : i + SQLITE_MAX_VARIABLES]
+                )
+            ):
+                if check.ticker in since:
+                    since[check.ticker] = check.date + timedelta(days=1)
+
+        return since
+
+    def checked(self, tickers, until):
+        """
+        Input:  Tickers whose actions were fetched through ``until``.
+        """
+        rows = [{"ticker": ticker, "date": until} for ticker in tickers]
+        if rows:
+            insert = sqlite_insert(models.CorporateActionCheck.__table__)
+            self.db_session.execute(
+                insert.on_conflict_do_update(
+                    index_elements=["ticker"], set_={"date": insert.excluded.date}
+                ),
+                rows,
+            )
+        self.db_session.commit()
+
+    def write_actions(self, actions):
+        """
+        Input:  Action dicts as returned by helper.corporate_actions.
+        Output: Number of new actions stored.
+        """
+        actions = [
+            action
+            for action in actions
+            if action["type"] == "split"
+            and action["ratio"]
+            or action["type"] == "dividend"
+            and action["cash"]
+        ]
+        if not actions:
+            return 0
+
+        # a dividend's factor is relative to the last raw close before it
+        dividends = [action for action in actions if action["type"] == "dividend"]
+        closes = pd.DataFrame(dtype=np.float64)
+        if dividends:
+            oldest = min(action["date"] for action in dividends)
+            closes = self.store.history(
+                list({action["ticker"] for action in dividends}),
+                # the window also takes the session before the oldest ex-date
+                len(sessions_between(oldest, last_session())) + 1,
+            )
+
+        rows = []
+        for action in actions:
+            if action["type"] == "split":
+                factor = action["ratio"]
+            else:
+                factor = 1.0
+                if action["ticker"] in closes.columns:
+                    before = closes[action["ticker"]].dropna()
+                    before = before[before.index < action["date"]]
+                    if len(before) and before.iloc[-1] > action["cash"]:
+                        factor = 1.0 - action["cash"] / before.iloc[-1]
+            rows.append(
+                {
+                    "ticker": action["ticker"],
+                    "type": action["type"],
+                    "date": action["date"],
+                    "ratio": action["ratio"],
+                    "cash": action["cash"],
+                    "factor": factor,
+                }
+            )
+
+        # announcements already stored are skipped so re-runs are safe
+        inserted = self.db_session.execute(
+            sqlite_insert(models.CorporateAction.__table__).on_conflict_do_nothing(
+                index_elements=["ticker", "type", "date"]
+            ),
+            rows,
+        ).rowcount
+        self.db_session.commit()
+
+        for action in actions:
+            self.factors.pop(action["ticker"], None)
+
+        return inserted
+
+    def _load(self, tickers):
+        missing = [ticker for ticker in tickers if ticker not in self.factors]
+        actions = {}
+        for i in range(0, len(missing), SQLITE_MAX_VARIABLES):
+            chunk = missing[i : i + SQLITE_MAX_VARIABLES]
+            for ticker, day, factor in (
+                self.db_session.query(
+                    models.CorporateAction.ticker,
+                    models.CorporateAction.date,
+                    models.CorporateAction.factor,
+                )
+                .filter(models.CorporateAction.ticker.in_(chunk))
+                .order_by(models.CorporateAction.date)
+            ):
+                actions.setdefault(ticker, []).append((day.toordinal(), factor))
+
+        for ticker in missing:
+            if ticker not in actions:
+                self.factors[ticker] = None
+                continue
+
+            days, factors = zip(*actions[ticker])
+            # cumulative[i] multiplies closes before the i-th ex-date and
+            # after the previous one; closes after the last are raw
+            cumulative = np.append(np.cumprod(np.asarray(factors)[::-1])[::-1], 1.0)
+            self.factors[ticker] = (np.asarray(days), cumulative)
+
+        return self.factors
+
+    def history(self, tickers, trading_days, now=None):
+        return self.panel(tickers, trading_days, now=now).to_frame()
+
+    def panel(self, tickers, trading_days, now=None):
+        panel = self.store.panel(tickers, trading_days, now=now)
+        tickers = panel.columns
+        factors = self._load(list(tickers))
+        adjusted = [
+            column
+            for column, ticker in enumerate(tickers)
+            if factors[ticker] is not None
+        ]
+        if not adjusted:
+            return panel
+
+        # memory-mapped closes are read-only
+        if not panel.values.flags.writeable:
+            panel.values = panel.values.copy()
+        for column in adjusted:
+            ex_days, cumulative = factors[tickers[column]]
+            # an ex-date's own close is already ex the action
+            panel.values[:, column] *= cumulative[
+                np.searchsorted(ex_days, panel.days, side="right")
+            ]
+
+        return panel
+
+
+class PriceCache(object):
+    """
+    Per-run cache in front of a store. Closes are kept per (ticker, window,
+    first session) as day ordinal and close arrays, so every stage of a run
+    shares the rows read by the first one, with the least recently used
+    entries evicted past ``max_entries``.
+    """
+
+    def __init__(self, store, max_entries=5000):
+        self.store = store
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def security(self, ticker, name=None, type="stock"):
+        return self.store.security(ticker, name=name, type=type)
+
+    def last_date(self, security):
+        return self.store.last_date(security)
+
+    def write(self, security, hist):
+        ticker = getattr(security, "ticker", security)
+        for key in [key for key in self.entries if key[0] == ticker]:
+            del self.entries[key]
+
+        return self.store.write(security, hist)
+
+    def write_actions(self, actions):
+        tickers = {action["ticker"] for action in actions}
+        for key in [key for key in self.entries if key[0] in tickers]:
+            del self.entries[key]
+
+        return self.store.write_actions(actions)
+
+    def gaps(self, trading_days=252 * 2, sessions=None):
+        return self.store.gaps(trading_days=trading_days, sessions=sessions)
+
+    def raw_since(self, tickers):
+        return self.store.raw_since(tickers)
+
+    def _put(self, key, closes):
+        self.entries[key] = closes
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def panel(self, tickers, trading_days, now=None):
+        tickers = list(dict.fromkeys(tickers))
+        trading_days = int(trading_days)
+        # windows ending on another session are other entries
+        past = window_start(trading_days, now)
+
+        found = {}
+        missing = []
+        for ticker in tickers:
+            key = (ticker, trading_days, past)
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                found[ticker] = self.entries[key]
+            else:
+                missing.append(ticker)
+
+        self.hits += len(found)
+        self.misses += len(missing)
+
+        if not missing:
+            return PricePanel.from_columns(
+                {ticker: found[ticker] for ticker in tickers},
+                dtype=found[tickers[0]][1].dtype if tickers else np.float64,
+            )
+
+        # misses are read compactly; tickers without data are cached too so
+        # they are not re-queried
+        panel = self.store.panel(missing, trading_days, now=now)
+        for ticker in missing:
+            found[ticker] = panel.column(ticker)
+            self._put((ticker, trading_days, past), found[ticker])
+        if len(found) == len(missing):
+            return panel
+
+        return PricePanel.from_columns(
+            {ticker: found[ticker] for ticker in tickers}, dtype=panel.values.dtype
+        )
+
+    def history(self, tickers, trading_days, now=None):
+        return self.panel(tickers, trading_days, now=now).to_frame()
+
+    def screen(self, tickers, now=None, **parameters):
+        return screen_store(self.store, tickers, now=now, **parameters)
+
+
+def open_store(engine=None, db_session=None):
+    """
+    Input:  SQLite engine and session, used by the default backend.
+    Output: Price store selected by PRICE_STORE ("sqlite" or "memmap"),
+            serving split and dividend adjusted closes.
+    """
+    backend = os.getenv("PRICE_STORE", "sqlite")
+    if backend == "sqlite":
+        store = SQLiteStore(
+            engine, db_session, dtype=os.getenv("PRICE_DTYPE", "float64")
+        )
+    elif backend == "memmap":
+        store = MemmapStore(os.getenv("PRICE_STORE_PATH", "prices"))
+    else:
+        raise ValueError('invalid price store: "%s"' % backend)
+
+    # corporate actions live in the database next to the securities
+    if db_session is not None:
+        store = AdjustedStore(store, db_session)
+
+    return store
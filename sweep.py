@@ -0,0 +1,192 @@
+"""
+Parameter sweep over the model section of algo_settings.cfg.
+
+The price panel is loaded once and saved as a read-only .npy file that every
+worker process memory-maps, then each configuration is backtested on a
+process pool and summarized as one row of the results table.
+
+    python sweep.py --start 2016-01-01 \
+        --grid portfolio_size=10,20,30 --grid vola_window=20,60 \
+        --samples 50 --workers 8 --output sweep.csv
+"""
+
+import argparse
+import configparser
+import itertools
+import os
+import random
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from backtest import TRADING_DAYS_IN_YEAR, performance, run_backtest
+from helper import model_parameters
+from log import log
+
+SWEEP_PARAMETERS = [
+    "trend_window_days",
+    "vola_window",
+    "portfolio_size",
+    "minimum_score_momentum",
+    "slope_window_days",
+    "max_stock_gap",
+]
+
+# panel shared by the configurations a worker runs
+_panel = None
+
+
+def save_panel(panel, path):
+    np.save(os.path.join(path, "closes.npy"), panel.to_numpy(dtype=np.float64))
+    np.save(
+        os.path.join(path, "dates.npy"), panel.index.to_numpy(dtype="datetime64[ns]")
+    )
+    np.save(os.path.join(path, "tickers.npy"), np.array(panel.columns, dtype=str))
+
+
+def load_panel(path):
+    return pd.DataFrame(
+        np.load(os.path.join(path, "closes.npy"), mmap_mode="r"),
+        index=pd.DatetimeIndex(np.load(os.path.join(path, "dates.npy"))),
+        columns=np.load(os.path.join(path, "tickers.npy")),
+        copy=False,
+    )
+
+
+def _init_worker(path):
+    global _panel
+    _panel = load_panel(path)
+
+
+def _run_configuration(parameters, start, end, frequency):
+    results = run_backtest(
+        _panel, parameters, start=start, end=end, frequency=frequency
+    )
+    return dict(parameters, **performance(results["equity"], results["rebalances"]))
+
+
+def parse_grid(values, defaults):
+    """
+    Input:  ``name=v1,v2,...`` strings and the default model parameters.
+    Output: List of parameter dicts covering every combination.
+    """
+    grid = {name: [defaults[name]] for name in SWEEP_PARAMETERS}
+    for value in values:
+        name, options = value.split("=", 1)
+        if name not in grid:
+            raise ValueError('invalid sweep parameter: "%s"' % name)
+        grid[name] = [type(defaults[name])(option) for option in options.split(",")]
+
+    return [
+        dict(defaults, **dict(zip(grid, combination)))
+        for combination in itertools.product(*grid.values())
+    ]
+
+
+def sweep(panel, configurations, start=None, end=None, frequency="M", workers=None):
+    """
+    Input:  Price panel and the parameter dicts to evaluate.
+    Output: DataFrame with one row of parameters and performance per
+            configuration.
+    """
+    path = tempfile.mkdtemp(prefix="sweep-")
+    try:
+        save_panel(panel, path)
+
+        rows = []
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(path,)
+        ) as executor:
+            futures = {
+                executor.submit(
+                    _run_configuration, parameters, start, end, frequency
+                ): parameters
+                for parameters in configurations
+            }
+            for future in as_completed(futures):
+                try:
+                    rows.append(future.result())
+                except Exception as e:
+                    log(f"{futures[future]}: {e}", "error")
+                    continue
+
+                log(
+                    "{0}/{1} configurations".format(len(rows), len(configurations)),
+                    "info",
+                )
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+    if not rows:
+        return pd.DataFrame(columns=SWEEP_PARAMETERS)
+
+    return pd.DataFrame(rows).sort_values(by=["cagr"], ascending=[False])
+
+
+if __name__ == "__main__":
+    import sqlalchemy
+    from database import init_db
+    from dotenv import find_dotenv, load_dotenv
+    from store import open_store
+    from trading_calendar import sessions_between
+    from universe import constituents
+
+    load_dotenv(find_dotenv())
+
+    arguments = argparse.ArgumentParser(description="Sweep the model parameters")
+    arguments.add_argument("--start", required=True, help="first rebalance date")
+    arguments.add_argument("--end", default=None, help="last date of the backtest")
+    arguments.add_argument("--frequency", default="M", choices=["M", "W"])
+    arguments.add_argument(
+        "--grid", action="append", default=[], help="name=v1,v2,... to sweep"
+    )
+    arguments.add_argument(
+        "--samples", type=int, default=None, help="random sample of the grid"
+    )
+    arguments.add_argument("--seed", type=int, default=None)
+    arguments.add_argument("--workers", type=int, default=None)
+    arguments.add_argument("--output", default="sweep.csv")
+    args = arguments.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(f'{os.getenv("CONFIG_FILE_ABSOLUTE_PATH")}/algo_settings.cfg')
+    defaults = model_parameters(config["model"])
+
+    configurations = parse_grid(args.grid, defaults)
+    if args.samples is not None and args.samples < len(configurations):
+        configurations = random.Random(args.seed).sample(configurations, args.samples)
+
+    engine = sqlalchemy.create_engine("sqlite:///securities.db")
+    # tables and columns added since the database was created
+    init_db(engine)
+    db_session = sqlalchemy.orm.Session(bind=engine)
+    store = open_store(engine=engine, db_session=db_session)
+
+    companies = constituents(db_session, sources=os.getenv("SP_CONSITUENTS").split(","))
+
+    trading_days = (
+        len(sessions_between(pd.Timestamp(args.start), datetime.now()))
+        + TRADING_DAYS_IN_YEAR
+    )
+    panel = store.history(
+        tickers=[company["Symbol"] for company in companies] + [defaults["market"]],
+        trading_days=trading_days,
+    )
+
+    log(f"Sweeping {len(configurations)} configurations", "info")
+    results = sweep(
+        panel,
+        configurations,
+        start=args.start,
+        end=args.end,
+        frequency=args.frequency,
+        workers=args.workers,
+    )
+    results.to_csv(args.output, index=False)
+
+    if len(results):
+        log("Best configuration", "success")
+        print(results.head(1).T)
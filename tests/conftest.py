@@ -0,0 +1,28 @@
+import threading
+
+import pytest
+
+
+class FakeClock(object):
+    """
+    Monotonic clock that only moves when slept on, shared by the code under
+    test and the fake APIs.
+    """
+
+    def __init__(self, now=0.0):
+        self.now = now
+        self.sleeps = []
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
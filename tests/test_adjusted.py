@@ -0,0 +1,155 @@
+from datetime import timedelta
+from types import SimpleNamespace
+
+import models
+import numpy as np
+import pytest
+import sqlalchemy
+from database import Base
+from rolling import RollingStatistics
+from store import AdjustedStore, MemmapStore, SQLiteStore
+from trading_calendar import last_session, sessions_back
+
+DAYS = [sessions_back(n, last_session()) for n in range(9, -1, -1)]
+CLOSES = [100.0, 102.0, 104.0, 103.0, 105.0, 52.0, 50.0, 49.0, 50.0, 51.0]
+
+
+def split(ticker, day, ratio):
+    return {
+        "ticker": ticker,
+        "type": "split",
+        "date": day,
+        "ratio": ratio,
+        "cash": None,
+    }
+
+
+def dividend(ticker, day, cash):
+    return {
+        "ticker": ticker,
+        "type": "dividend",
+        "date": day,
+        "ratio": None,
+        "cash": cash,
+    }
+
+
+def bars(closes, days=DAYS, open=1.0):
+    return [SimpleNamespace(t=day, o=open, c=close) for day, close in zip(days, closes)]
+
+
+@pytest.fixture
+def db_session():
+    engine = sqlalchemy.create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    return sqlalchemy.orm.Session(bind=engine, expire_on_commit=False)
+
+
+@pytest.fixture(params=["sqlite", "memmap"])
+def store(request, db_session, tmp_path):
+    if request.param == "sqlite":
+        inner = SQLiteStore(db_session.get_bind(), db_session)
+    else:
+        inner = MemmapStore(str(tmp_path))
+    store = AdjustedStore(inner, db_session)
+    store.write(store.security("A"), bars(CLOSES))
+
+    return store
+
+
+def closes(store, ticker="A"):
+    return store.panel([ticker], len(DAYS))[ticker].to_numpy()
+
+
+def test_split_and_dividend_factors(store):
+    # 2:1 split ex DAYS[5], $1 dividend ex DAYS[7] against the 50.0 close before
+    store.write_actions([split("A", DAYS[5], 0.5), dividend("A", DAYS[7], 1.0)])
+
+    dividend_factor = 1.0 - 1.0 / 50.0
+    expected = np.array(CLOSES)
+    expected[:5] *= 0.5 * dividend_factor
+    expected[5:7] *= dividend_factor
+
+    np.testing.assert_allclose(closes(store), expected)
+    # the ex-dates' own closes are already ex the action
+    assert closes(store)[7] == CLOSES[7]
+    action = (
+        store.db_session.query(models.CorporateAction).filter_by(type="dividend").one()
+    )
+    assert action.factor == pytest.approx(dividend_factor)
+
+
+def test_actions_on_the_first_stored_day(store):
+    store.write_actions([split("A", DAYS[0], 0.5), dividend("A", DAYS[0], 1.0)])
+
+    # nothing is stored before them, and the dividend has no close to scale
+    np.testing.assert_allclose(closes(store), CLOSES)
+    factors = {
+        action.type: action.factor
+        for action in store.db_session.query(models.CorporateAction)
+    }
+    assert factors == {"split": 0.5, "dividend": 1.0}
+
+
+def test_rewritten_actions_are_skipped(store):
+    assert store.write_actions([split("A", DAYS[5], 0.5)]) == 1
+    assert store.write_actions([split("A", DAYS[5], 0.5)]) == 0
+
+    assert closes(store)[0] == CLOSES[0] * 0.5
+
+
+def test_new_action_invalidates_factors_and_rolling_state(store, db_session):
+    rolling = RollingStatistics(store, db_session, window=len(DAYS), ma_window=5)
+    rolling.write_actions([split("A", DAYS[5], 0.5)])
+    rolling.screen(["A"], trading_days=len(DAYS))
+    assert rolling.states["A"] is not None
+    assert store.factors["A"] is not None
+    np.testing.assert_allclose(
+        np.frombuffer(rolling.states["A"].closes)[:5], np.array(CLOSES[:5]) * 0.5
+    )
+
+    rolling.write_actions([split("A", DAYS[8], 0.25)])
+
+    assert "A" not in store.factors
+    assert rolling.states["A"] is None
+    assert db_session.query(models.RollingState).count() == 0
+
+    screened = rolling.screen(["A"], trading_days=len(DAYS))
+    expected = np.array(CLOSES)
+    expected[:5] *= 0.5 * 0.25
+    expected[5:8] *= 0.25
+    np.testing.assert_allclose(np.frombuffer(rolling.states["A"].closes), expected)
+    assert screened.at["A", "close"] == CLOSES[-1]
+
+
+def test_raw_since_cuts_over_after_legacy_rows(db_session):
+    store = AdjustedStore(SQLiteStore(db_session.get_bind(), db_session), db_session)
+    # rows downloaded adjusted, before bars were stored raw, have no open
+    store.write(store.security("LEGACY"), bars(CLOSES[:4], DAYS[:4], open=None))
+    store.write(store.security("LEGACY"), bars(CLOSES[4:], DAYS[4:]))
+    store.write(store.security("RAW"), bars(CLOSES[2:], DAYS[2:]))
+    store.security("EMPTY")
+
+    since = store.actions_since(["LEGACY", "RAW", "EMPTY"])
+
+    assert since == {"LEGACY": DAYS[3] + timedelta(days=1), "RAW": DAYS[2]}
+
+    store.checked(["RAW"], DAYS[6])
+    assert store.actions_since(["LEGACY", "RAW", "EMPTY"]) == {
+        "LEGACY": DAYS[3] + timedelta(days=1),
+        "RAW": DAYS[6] + timedelta(days=1),
+    }
+
+
+def test_legacy_rows_take_only_later_actions(db_session):
+    store = AdjustedStore(SQLiteStore(db_session.get_bind(), db_session), db_session)
+    store.write(store.security("A"), bars(CLOSES[:4], DAYS[:4], open=None))
+    store.write(store.security("A"), bars(CLOSES[4:], DAYS[4:]))
+
+    store.write_actions([split("A", DAYS[5], 0.5)])
+
+    # the legacy closes were adjusted up to their download, the split after
+    # it applies to them as to the raw ones
+    np.testing.assert_allclose(
+        closes(store), np.array(CLOSES) * ([0.5] * 5 + [1.0] * 5)
+    )
@@ -0,0 +1,257 @@
+import sys
+from collections import Counter
+from datetime import datetime, time
+from types import SimpleNamespace
+
+import models
+import numpy as np
+import pytest
+import sqlalchemy
+import universe
+from broker import BrokerSnapshot, SimulatedBroker
+from database import Base
+from pipeline import run_rebalance
+from rolling import RollingStatistics
+from store import SQLiteStore
+from trading_calendar import last_session, sessions_back
+
+TICKERS = [f"T{i}" for i in range(30)]
+
+PARAMETERS = {
+    "trend_window_days": 200,
+    "vola_window": 20,
+    "portfolio_size": 10,
+    "minimum_score_momentum": 0,
+    "slope_window_days": 125,
+    "max_stock_gap": 0.15,
+    "market": "SPY",
+}
+
+
+class CountingBroker(SimulatedBroker):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requests = Counter()
+
+    def get_account(self):
+        self.requests["get_account"] += 1
+        return super().get_account()
+
+    def list_positions(self):
+        self.requests["list_positions"] += 1
+        return super().list_positions()
+
+    def get_position(self, symbol):
+        self.requests["get_position"] += 1
+        return super().get_position(symbol)
+
+    def list_assets(self, status=None):
+        self.requests["list_assets"] += 1
+        return super().list_assets(status=status)
+
+    def get_asset(self, symbol):
+        self.requests["get_asset"] += 1
+        return super().get_asset(symbol)
+
+
+class DirectBroker(object):
+    """
+    The snapshot's interface with a request per lookup, the way the rebalance
+    queried Alpaca before the snapshot.
+    """
+
+    def __init__(self, api):
+        self.api = api
+        self.calls = 1
+        self.saved_calls = 0
+        self.portfolio_value = round(float(api.get_account().equity), 3)
+
+    def positions(self):
+        self.calls += 1
+        return self.api.list_positions()
+
+    def position(self, symbol):
+        self.calls += 1
+        return self.api.get_position(symbol)
+
+    def is_tradable(self, symbol):
+        self.calls += 1
+        return self.api.get_asset(symbol).tradable is True
+
+
+class Macro(object):
+    def yoy(self):
+        return 1.0
+
+
+@pytest.fixture
+def market(monkeypatch):
+    monkeypatch.setenv("SP_CONSITUENTS", "500")
+
+    engine = sqlalchemy.create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    db_session = sqlalchemy.orm.Session(bind=engine, expire_on_commit=False)
+    store = SQLiteStore(engine, db_session)
+
+    rng = np.random.default_rng(0)
+    days = [sessions_back(n, last_session()) for n in range(299, -1, -1)]
+    prices = {}
+    for ticker in TICKERS + ["SPY"]:
+        drift = 0.002 if ticker == "SPY" else rng.normal(0.0008, 0.001)
+        closes = 100 * np.exp(np.cumsum(rng.normal(drift, 0.01, len(days))))
+        store.write(
+            store.security(ticker),
+            [
+                SimpleNamespace(t=day, c=float(close))
+                for day, close in zip(days, closes)
+            ],
+        )
+        prices[ticker] = float(closes[-1])
+
+    snapshot = models.ConstituentSnapshot("500", datetime.now())
+    db_session.add(snapshot)
+    db_session.flush()
+    db_session.add_all(
+        models.Constituent(snapshot_id=snapshot.id, ticker=ticker, name=ticker)
+        for ticker in TICKERS
+    )
+    db_session.commit()
+
+    return store, db_session, prices
+
+
+def simulated(prices):
+    return CountingBroker(
+        positions={"T1": 10, "T2": 5, "T3": 7, "GONE": 3},
+        prices=dict(prices, GONE=5.0),
+        untradable={"T3"},
+    )
+
+
+def test_rebalance_fetches_broker_state_once(market):
+    store, db_session, prices = market
+    api = simulated(prices)
+    broker = BrokerSnapshot(api)
+
+    result = run_rebalance(
+        PARAMETERS, broker, store, db_session, dry_run=True, macro=Macro()
+    )
+
+    assert result["plan"].orders
+    assert api.requests == Counter(get_account=1, list_positions=1, list_assets=1)
+    assert broker.calls == 3
+    assert broker.lookups > broker.calls
+
+
+def test_saved_calls_match_a_run_without_the_snapshot(market):
+    store, db_session, prices = market
+    snapshot = BrokerSnapshot(simulated(prices))
+    direct = DirectBroker(simulated(prices))
+
+    planned = [
+        run_rebalance(
+            PARAMETERS, broker, store, db_session, dry_run=True, macro=Macro()
+        )
+        for broker in (snapshot, direct)
+    ]
+
+    assert [
+        (order.symbol, order.side, order.qty) for order in planned[0]["plan"].orders
+    ] == [(order.symbol, order.side, order.qty) for order in planned[1]["plan"].orders]
+    assert snapshot.saved_calls == direct.calls - snapshot.calls
+    assert snapshot.saved_calls > 0
+
+
+def test_live_rebalance_fills_orders(market):
+    store, db_session, prices = market
+    api = simulated(prices)
+
+    result = run_rebalance(
+        PARAMETERS,
+        BrokerSnapshot(api),
+        store,
+        db_session,
+        live_trade=True,
+        macro=Macro(),
+    )
+
+    assert result["orders"]
+    assert all(order["status"] == "filled" for order in result["orders"])
+    # GONE left the universe and is sold, T3 cannot be traded and is kept
+    assert api.positions["GONE"] == 0
+    assert api.positions["T3"] == 7
+    for order in result["plan"].orders:
+        if order.side == "buy":
+            assert api.positions[order.symbol] > 0
+
+
+def test_past_clock_ends_every_window(market):
+    store, db_session, prices = market
+    now = datetime.combine(sessions_back(40, last_session()), time(12))
+
+    # the same prices without the sessions after the clock's last session
+    engine = sqlalchemy.create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    truncated = SQLiteStore(
+        engine, sqlalchemy.orm.Session(bind=engine, expire_on_commit=False)
+    )
+    history = store.history(TICKERS + ["SPY"], 300)
+    for ticker, closes in history.loc[: last_session(now)].items():
+        truncated.write(
+            truncated.security(ticker),
+            [SimpleNamespace(t=day, c=float(close)) for day, close in closes.items()],
+        )
+
+    results = [
+        run_rebalance(
+            PARAMETERS,
+            BrokerSnapshot(simulated(prices)),
+            prices_store,
+            db_session,
+            clock=lambda: now,
+            dry_run=True,
+            macro=Macro(),
+        )
+        for prices_store in (RollingStatistics(store, db_session), truncated)
+    ]
+
+    assert not results[0]["ranking_table"].empty
+    assert results[0]["ranking_table"].equals(results[1]["ranking_table"])
+    assert results[0]["plan"] == results[1]["plan"]
+
+
+class RecordingSES(object):
+    sent = []
+
+    def __init__(self, **kwargs):
+        pass
+
+    def send_html_email(self, to_address, subject, content):
+        self.sent.append(to_address)
+
+
+def test_constituent_and_email_calls_are_counted(market, monkeypatch):
+    store, db_session, prices = market
+    # a stale snapshot is re-requested and comes back unchanged
+    monkeypatch.setenv("CONSTITUENTS_TTL_DAYS", "0")
+    monkeypatch.setattr(
+        universe.requests,
+        "get",
+        lambda url, headers, timeout: SimpleNamespace(status_code=304),
+    )
+    monkeypatch.setenv("EMAIL_POSITIONS", "true")
+    monkeypatch.setenv("TO_ADDRESSES", "a@example.com,b@example.com")
+    monkeypatch.setitem(sys.modules, "SES", SimpleNamespace(AmazonSES=RecordingSES))
+
+    result = run_rebalance(
+        PARAMETERS,
+        BrokerSnapshot(simulated(prices)),
+        store,
+        db_session,
+        macro=Macro(),
+    )
+
+    calls = {stage.name: stage.calls for stage in result["run_report"].stages}
+    assert calls["constituents"] == {"wiki_requests": 1}
+    assert calls["report"] == {"ses_sends": 2}
+    assert RecordingSES.sent == ["a@example.com", "b@example.com"]
@@ -0,0 +1,75 @@
+from datetime import datetime
+
+import models
+import pytest
+import sqlalchemy
+from daemon import Daemon, parse_schedule
+from database import Base
+
+
+@pytest.fixture
+def db_session():
+    engine = sqlalchemy.create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    return sqlalchemy.orm.Session(bind=engine)
+
+
+def test_failed_job_rolls_back_the_shared_session(db_session):
+    db_session.add(models.Security(ticker="A", name="A", type="stock"))
+    db_session.commit()
+
+    def failing():
+        # the ticker is unique, the flush raises IntegrityError
+        db_session.add(models.Security(ticker="A", name="A", type="stock"))
+        db_session.flush()
+
+    def counting():
+        return db_session.query(models.Security).count()
+
+    errors = []
+
+    def recover(name, error):
+        errors.append((name, type(error).__name__))
+        db_session.rollback()
+
+    daemon = Daemon(
+        {
+            "ingest": (failing, parse_schedule("daily", "16:30")),
+            "rebalance": (counting, parse_schedule("wed", "11:00")),
+        },
+        clock=lambda: datetime(2026, 10, 19, 12, 0),
+        on_error=recover,
+    )
+
+    daemon.run_job("ingest")
+    daemon.run_job("rebalance")
+
+    assert errors == [("ingest", "IntegrityError")]
+    assert daemon.jobs["ingest"]["failures"] == 1
+    assert daemon.jobs["rebalance"]["last_error"] is None
+    assert daemon.status()["status"] == "degraded"
+
+
+def test_without_recovery_the_session_stays_broken(db_session):
+    db_session.add(models.Security(ticker="A", name="A", type="stock"))
+    db_session.commit()
+
+    def failing():
+        db_session.add(models.Security(ticker="A", name="A", type="stock"))
+        db_session.flush()
+
+    def counting():
+        return db_session.query(models.Security).count()
+
+    daemon = Daemon(
+        {
+            "ingest": (failing, parse_schedule("daily", "16:30")),
+            "rebalance": (counting, parse_schedule("wed", "11:00")),
+        },
+        clock=lambda: datetime(2026, 10, 19, 12, 0),
+    )
+
+    daemon.run_job("ingest")
+    daemon.run_job("rebalance")
+
+    assert "rolled back" in daemon.jobs["rebalance"]["last_error"]
@@ -0,0 +1,115 @@
+import pytest
+from broker import SimulatedBroker
+from execution import BUY, SELL, OrderExecutor
+
+
+class CountingBroker(SimulatedBroker):
+    def __init__(self, *args, fail=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fail = set(fail)
+        self.submitted = []
+        self.listings = []
+
+    def submit_order(self, symbol, qty, side, **kwargs):
+        if symbol in self.fail:
+            raise ConnectionError(f"{symbol} timed out")
+        order = super().submit_order(symbol, qty, side, **kwargs)
+        with self.lock:
+            self.submitted.append((side, symbol))
+        return order
+
+    def list_orders(self, status=None, symbols=None, limit=None, **kwargs):
+        self.listings.append(list(symbols))
+        return super().list_orders(status=status, symbols=symbols, limit=limit)
+
+
+def executor(broker, clock, **kwargs):
+    return OrderExecutor(broker, clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_batch_submit_sells_before_buys(clock):
+    symbols = [f"T{i}" for i in range(250)]
+    broker = CountingBroker(
+        positions={symbol: 10 for symbol in symbols[:120]},
+        prices={symbol: 10.0 for symbol in symbols},
+        clock=clock,
+    )
+    orders = executor(broker, clock)
+    for symbol in symbols[:120]:
+        orders.queue(symbol, SELL, 10)
+    for symbol in symbols[120:]:
+        orders.queue(symbol, BUY, "5")
+
+    results = orders.execute()
+
+    assert len(results) == 250
+    assert all(order["status"] == "filled" for order in results)
+    sides = [side for side, _ in broker.submitted]
+    assert sides == [SELL] * 120 + [BUY] * 130
+    # one listing per 100 symbols and wave instead of one request per order
+    assert [len(symbols) for symbols in broker.listings] == [100, 20, 100, 30]
+    assert orders.requests == 250 + 4
+    assert broker.positions["T0"] == 0 and broker.positions["T249"] == 5
+
+
+def test_polls_until_filled(clock):
+    broker = CountingBroker(prices={"A": 20.0}, fill_delay=3.0, clock=clock)
+    orders = executor(broker, clock, poll_interval=1.0)
+    orders.queue("A", BUY, 4)
+
+    (order,) = orders.execute()
+
+    assert order["status"] == "filled"
+    assert order["filled_qty"] == 4.0
+    assert order["filled_avg_price"] == 20.0
+    assert order["fill_latency"] == pytest.approx(3.0)
+    assert len(broker.listings) == 4
+    assert clock.sleeps == [1.0, 1.0, 1.0]
+
+
+def test_partial_fills(clock):
+    broker = CountingBroker(prices={"A": 20.0}, liquidity={"A": 4}, clock=clock)
+    orders = executor(broker, clock, poll_interval=1.0)
+    orders.queue("A", BUY, 10)
+
+    (order,) = orders.execute()
+
+    assert order["status"] == "filled"
+    assert order["filled_qty"] == 10.0
+    assert len(broker.listings) == 3
+    assert broker.positions["A"] == 10
+
+
+def test_partial_fill_left_at_timeout(clock):
+    broker = CountingBroker(prices={"A": 20.0}, liquidity={"A": 4}, clock=clock)
+    orders = executor(broker, clock, poll_interval=1.0, timeout=1.0)
+    orders.queue("A", BUY, 10)
+
+    (order,) = orders.execute()
+
+    assert order["status"] == "partially_filled"
+    assert order["filled_qty"] == 8.0
+    assert "fill_latency" not in order
+    assert broker.positions["A"] == 8
+
+
+def test_submit_errors_and_rejections(clock):
+    broker = CountingBroker(prices={"A": 20.0, "B": 30.0}, fail={"B"}, clock=clock)
+    orders = executor(broker, clock)
+    orders.queue("A", BUY, 1)
+    orders.queue("B", BUY, 1)
+    orders.queue("C", BUY, 1)
+    orders.queue("D", BUY, 0)
+
+    results = {order["symbol"]: order for order in orders.execute()}
+
+    assert sorted(results) == ["A", "B", "C"]
+    assert results["A"]["status"] == "filled"
+    assert results["B"]["status"] == "error"
+    assert results["B"]["error"] == "B timed out"
+    assert "id" not in results["B"]
+    # Alpaca rejects symbols it cannot trade, a final status
+    assert results["C"]["status"] == "rejected"
+    assert "fill_latency" in results["C"]
+    # the failed order is never polled for
+    assert broker.listings == [["A", "C"]]
@@ -0,0 +1,75 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+import sqlalchemy
+from database import Base
+from store import MemmapStore, SQLiteStore, missing_ranges
+from trading_calendar import last_session, sessions_between, window_start
+
+TRADING_DAYS = 252 * 2
+
+
+def test_consecutive_missing_sessions_collapse_to_one_range():
+    # day 4 is a holiday, so 3 and 5 are consecutive sessions
+    sessions = [1, 2, 3, 5, 6, 7, 8, 9, 10]
+
+    assert missing_ranges(sessions, [1, 2, 6, 9, 10]) == [(3, 5), (7, 8)]
+    assert missing_ranges(sessions, [1, 3, 5, 10]) == [(2, 2), (6, 9)]
+
+
+def test_days_before_the_first_bar_are_not_gaps():
+    sessions = [1, 2, 3, 5, 6, 7]
+
+    assert missing_ranges(sessions, [5, 6, 7]) == []
+    assert missing_ranges(sessions, [3, 7]) == [(5, 6)]
+    assert missing_ranges(sessions, [7]) == []
+    assert missing_ranges(sessions, []) == []
+
+
+def holiday(sessions):
+    """
+    Input:  Session ordinals.
+    Output: Index of the last session followed by a weekday holiday, with at
+            least two sessions after the holiday.
+    """
+    for i in range(len(sessions) - 4, 0, -1):
+        between = range(sessions[i] + 1, sessions[i + 1])
+        if any(datetime.fromordinal(day).weekday() < 5 for day in between):
+            return i
+
+
+@pytest.fixture(params=["sqlite", "memmap"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        engine = sqlalchemy.create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        db_session = sqlalchemy.orm.Session(bind=engine, expire_on_commit=False)
+        return SQLiteStore(engine, db_session)
+
+    return MemmapStore(str(tmp_path))
+
+
+def write(store, ticker, days):
+    store.write(
+        store.security(ticker),
+        [
+            SimpleNamespace(t=datetime.fromordinal(int(day)), c=100.0 + i)
+            for i, day in enumerate(days)
+        ],
+    )
+
+
+def test_store_gaps(store):
+    sessions = sessions_between(window_start(TRADING_DAYS), last_session()).tolist()
+    i = holiday(sessions)
+    # the session before the holiday and the two after it
+    run = sessions[i : i + 3]
+
+    write(store, "FULL", sessions)
+    write(store, "HOLEY", [day for day in sessions if day not in run])
+    write(store, "LISTED", sessions[-100:])
+
+    assert store.gaps(TRADING_DAYS) == {
+        "HOLEY": [(datetime.fromordinal(run[0]), datetime.fromordinal(run[-1]))]
+    }
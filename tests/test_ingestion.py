@@ -0,0 +1,280 @@
+import threading
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from helper import batch_windows, corporate_actions, price_histories
+from ingestion import RateLimiter, fetch_windows
+
+START = datetime(2024, 1, 2)
+END = datetime(2024, 3, 28)
+
+
+class FakeBars(object):
+    """
+    Alpaca bars stub: one multi-symbol request returns each symbol's bars
+    tagged with ``S``, the way the client yields them across pages.
+    """
+
+    def __init__(self, bars_per_symbol=3, delisted=()):
+        self.bars_per_symbol = bars_per_symbol
+        self.delisted = set(delisted)
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def get_bars(self, symbols, timeframe, start, end, adjustment=None):
+        with self.lock:
+            self.requests.append((list(symbols), start, end, adjustment))
+        for day in range(self.bars_per_symbol):
+            for symbol in symbols:
+                if symbol in self.delisted:
+                    continue
+                yield SimpleNamespace(
+                    S=symbol,
+                    t=datetime.strptime(start, "%Y-%m-%d") + timedelta(days=day),
+                    c=100.0 + day,
+                )
+
+
+class RecordingStore(object):
+    def __init__(self):
+        self.writes = []
+
+    def write(self, security, hist):
+        self.writes.append((security, len(hist), threading.current_thread()))
+
+
+def test_rate_limiter_waits_for_tokens(clock):
+    limiter = RateLimiter(60, per=60.0, burst=3, clock=clock, sleep=clock.sleep)
+
+    for _ in range(3):
+        limiter.acquire()
+    assert clock.sleeps == []
+
+    # an empty bucket refills one token per second
+    limiter.acquire()
+    assert clock.sleeps == [pytest.approx(1.0)]
+    clock.now += 2.5
+    limiter.acquire()
+    limiter.acquire()
+    assert len(clock.sleeps) == 1
+    limiter.acquire()
+    assert clock.sleeps[-1] == pytest.approx(0.5)
+
+
+def test_rate_limiter_caps_the_burst(clock):
+    limiter = RateLimiter(60, per=60.0, burst=2, clock=clock, sleep=clock.sleep)
+    clock.now += 600
+
+    for _ in range(3):
+        limiter.acquire()
+
+    assert len(clock.sleeps) == 1
+
+
+def test_batch_windows_groups_by_day_and_chunks():
+    windows = [(f"T{i}", START, END) for i in range(250)]
+    # the same calendar days at another time of day share the batch
+    windows.append(("LATE", START + timedelta(hours=9), END))
+    windows.append(("NEW", datetime(2023, 1, 3), END))
+
+    batches = batch_windows(windows, batch_size=100)
+
+    assert [(len(tickers), start) for tickers, start, _ in batches] == [
+        (100, START),
+        (100, START),
+        (51, START),
+        (1, datetime(2023, 1, 3)),
+    ]
+    assert batches[2][0][-1] == "LATE"
+    assert sorted(ticker for tickers, _, _ in batches for ticker in tickers) == sorted(
+        ticker for ticker, _, _ in windows
+    )
+
+
+def test_price_histories_splits_bars_per_symbol():
+    api = FakeBars(bars_per_symbol=4, delisted=["EMPTY"])
+
+    histories = price_histories(api, ["A", "B", "EMPTY"], START, END)
+
+    assert api.requests == [(["A", "B", "EMPTY"], "2024-01-02", "2024-03-28", "raw")]
+    assert {ticker: len(bars) for ticker, bars in histories.items()} == {
+        "A": 4,
+        "B": 4,
+        "EMPTY": 0,
+    }
+    assert all(bar.S == "A" for bar in histories["A"])
+
+
+def test_fetch_windows_writes_from_the_calling_thread():
+    api = FakeBars()
+    store = RecordingStore()
+    tickers = [f"T{i}" for i in range(25)]
+
+    inserted = fetch_windows(
+        api,
+        store,
+        {ticker: ticker for ticker in tickers},
+        [(ticker, START, END) for ticker in tickers],
+        workers=4,
+        requests_per_minute=10000,
+        symbols_per_request=10,
+    )
+
+    assert inserted == 25 * 3
+    assert sorted(len(symbols) for symbols, _, _, _ in api.requests) == [5, 10, 10]
+    assert sorted(security for security, _, _ in store.writes) == sorted(tickers)
+    assert {thread for _, _, thread in store.writes} == {threading.current_thread()}
+
+
+class FlakyBars(FakeBars):
+    """
+    Fails the first ``failures`` requests, the last one after its first page.
+    """
+
+    def __init__(self, failures, **kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures
+        self.calls = 0
+
+    def get_bars(self, symbols, *args, **kwargs):
+        self.calls += 1
+        bars = super().get_bars(symbols, *args, **kwargs)
+        if self.calls > self.failures:
+            return bars
+        return self._fail(bars, len(symbols))
+
+    def _fail(self, bars, page):
+        for _ in range(page):
+            yield next(bars)
+        raise ConnectionError("429 Too Many Requests")
+
+
+def test_fetch_windows_retries_with_backoff(clock):
+    api = FlakyBars(failures=2)
+    store = RecordingStore()
+
+    inserted = fetch_windows(
+        api,
+        store,
+        {"A": "A", "B": "B"},
+        [("A", START, END), ("B", START, END)],
+        requests_per_minute=10000,
+        sleep=clock.sleep,
+    )
+
+    assert api.calls == 3
+    assert clock.sleeps == [1.0, 2.0]
+    # bars from a failed attempt's pages are not written twice
+    assert inserted == 2 * 3
+    assert sorted((security, bars) for security, bars, _ in store.writes) == [
+        ("A", 3),
+        ("B", 3),
+    ]
+
+
+def test_fetch_windows_gives_up_after_the_retries(clock):
+    api = FlakyBars(failures=10)
+    store = RecordingStore()
+
+    inserted = fetch_windows(
+        api,
+        store,
+        {"A": "A"},
+        [("A", START, END)],
+        requests_per_minute=10000,
+        retries=2,
+        backoff=0.5,
+        sleep=clock.sleep,
+    )
+
+    assert inserted == 0
+    assert store.writes == []
+    assert api.calls == 3
+    assert clock.sleeps == [0.5, 1.0]
+
+
+def test_fetch_windows_skips_failed_batches():
+    class FailingBars(FakeBars):
+        def get_bars(self, symbols, *args, **kwargs):
+            if "BAD" in symbols:
+                raise ConnectionError("reset by peer")
+            return super().get_bars(symbols, *args, **kwargs)
+
+    store = RecordingStore()
+
+    inserted = fetch_windows(
+        FailingBars(),
+        store,
+        {"A": "A", "BAD": "BAD"},
+        [("A", START, END), ("BAD", datetime(2024, 2, 1), END)],
+        requests_per_minute=10000,
+        retries=0,
+    )
+
+    assert inserted == 3
+    assert [security for security, _, _ in store.writes] == ["A"]
+
+
+def test_corporate_actions_pages_by_window():
+    class FakeAnnouncements(object):
+        def __init__(self):
+            self.requests = []
+
+        def get(self, path, params):
+            self.requests.append((params["since"], params["until"]))
+            announcements = {
+                "2024-01-10": {
+                    "ca_type": "split",
+                    "target_symbol": "A",
+                    "ex_date": "2024-01-10",
+                    "old_rate": "1",
+                    "new_rate": "2",
+                },
+                "2024-05-02": {
+                    "ca_type": "dividend",
+                    "initiating_symbol": "B",
+                    "ex_date": "2024-05-02",
+                    "cash": "0.5",
+                },
+                "2024-06-03": {
+                    "ca_type": "split",
+                    "target_symbol": "OTHER",
+                    "ex_date": "2024-06-03",
+                    "old_rate": "1",
+                    "new_rate": "4",
+                },
+            }
+            return [
+                announcement
+                for day, announcement in announcements.items()
+                if params["since"] <= day <= params["until"]
+            ]
+
+    api = FakeAnnouncements()
+
+    actions = corporate_actions(
+        api, ["A", "B"], datetime(2024, 1, 1), datetime(2024, 7, 1)
+    )
+
+    assert api.requests == [
+        ("2024-01-01", "2024-03-30"),
+        ("2024-03-31", "2024-06-28"),
+        ("2024-06-29", "2024-07-01"),
+    ]
+    assert actions == [
+        {
+            "ticker": "A",
+            "type": "split",
+            "date": datetime(2024, 1, 10),
+            "ratio": 0.5,
+            "cash": None,
+        },
+        {
+            "ticker": "B",
+            "type": "dividend",
+            "date": datetime(2024, 5, 2),
+            "ratio": None,
+            "cash": 0.5,
+        },
+    ]
@@ -0,0 +1,89 @@
+import pandas as pd
+from execution import BUY, SELL
+from planner import PlannedOrder, plan_rebalance
+
+
+def targets(**rows):
+    return pd.DataFrame(
+        [(price, weight) for price, weight in rows.values()],
+        index=pd.Index(list(rows)),
+        columns=["price", "weight"],
+    )
+
+
+def test_orders_reach_target_quantities():
+    plan = plan_rebalance(
+        {"AAA": 5, "BBB": 20},
+        targets(AAA=(10.0, 0.2), BBB=(20.0, 0.2)),
+        portfolio_value=1000.0,
+    )
+
+    assert plan.orders == (
+        PlannedOrder("BBB", SELL, 10),
+        PlannedOrder("AAA", BUY, 15),
+    )
+    assert [(p.security, p.action, p.qty, p.diff) for p in plan.positions] == [
+        ("AAA", BUY, 20, 15),
+        ("BBB", SELL, 10, -10),
+    ]
+    assert plan.market_weight == 0.4
+
+
+def test_sells_are_ordered_before_buys():
+    plan = plan_rebalance(
+        {"OLD": 7, "CUT": 30},
+        targets(NEW=(10.0, 0.1), CUT=(10.0, 0.1), ADD=(5.0, 0.1)),
+        portfolio_value=1000.0,
+    )
+
+    sides = [order.side for order in plan.orders]
+    assert sides == sorted(sides, key=lambda side: side != SELL)
+    assert set(plan.sells) == {
+        PlannedOrder("CUT", SELL, 20),
+        PlannedOrder("OLD", SELL, 7),
+    }
+    assert set(plan.buys) == {
+        PlannedOrder("NEW", BUY, 10),
+        PlannedOrder("ADD", BUY, 20),
+    }
+
+
+def test_kept_position_rounding_to_zero_is_sold():
+    plan = plan_rebalance(
+        {"PRICEY": 3},
+        targets(PRICEY=(900.0, 0.05)),
+        portfolio_value=1000.0,
+    )
+
+    assert plan.orders == (PlannedOrder("PRICEY", SELL, 3),)
+    (position,) = plan.positions
+    assert (position.qty, position.diff) == (0, -3)
+    assert plan.market_weight == 0
+
+
+def test_untradable_holdings_are_left_out_of_both_sides():
+    plan = plan_rebalance(
+        {"HALT": 10, "AAA": 10},
+        targets(HALT=(10.0, 0.5), AAA=(10.0, 0.1), NEWHALT=(10.0, 0.1)),
+        portfolio_value=1000.0,
+        untradable=["HALT", "NEWHALT"],
+    )
+
+    assert plan.orders == ()
+    assert [position.security for position in plan.positions] == ["AAA"]
+
+
+def test_empty_targets_liquidate_tradable_holdings():
+    plan = plan_rebalance(
+        {"AAA": 4, "BBB": 9, "HALT": 2},
+        targets().iloc[:0],
+        portfolio_value=1000.0,
+        untradable=["HALT"],
+    )
+
+    assert plan.positions == ()
+    assert plan.buys == ()
+    assert plan.orders == (
+        PlannedOrder("AAA", SELL, 4),
+        PlannedOrder("BBB", SELL, 9),
+    )
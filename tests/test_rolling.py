@@ -0,0 +1,122 @@
+from types import SimpleNamespace
+
+import models
+import numpy as np
+import pandas as pd
+import pytest
+import sqlalchemy
+from database import Base
+from rolling import RollingStatistics, _buffers
+from screener import screen
+from store import SQLiteStore
+from trading_calendar import last_session, sessions_back
+
+WINDOW = 252
+MA_WINDOW = 100
+
+
+def write(rolling, ticker, series):
+    rolling.write(
+        rolling.security(ticker),
+        [SimpleNamespace(t=day, c=float(close)) for day, close in series.items()],
+    )
+
+
+@pytest.fixture
+def closes():
+    rng = np.random.default_rng(11)
+    index = pd.DatetimeIndex(
+        [sessions_back(i, last_session()) for i in range(319, -1, -1)]
+    )
+    return pd.DataFrame(
+        100 * np.exp(np.cumsum(rng.normal(0.001, 0.015, (len(index), 3)), axis=0)),
+        index=index,
+        columns=["AAA", "BBB", "CCC"],
+    )
+
+
+@pytest.fixture
+def store():
+    engine = sqlalchemy.create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    db_session = sqlalchemy.orm.Session(bind=engine, expire_on_commit=False)
+
+    return SQLiteStore(engine, db_session), db_session
+
+
+def rolling_store(store):
+    sqlite_store, db_session = store
+    return RollingStatistics(sqlite_store, db_session, WINDOW, MA_WINDOW)
+
+
+def assert_sums_match(state, closes):
+    days, buffered = _buffers(state)
+    np.testing.assert_array_equal(buffered, closes.to_numpy())
+    assert list(days) == [day.toordinal() for day in closes.index.date]
+
+    y = np.log(closes.to_numpy())
+    x = np.arange(len(y))
+    assert state.sum_y == pytest.approx(y.sum(), rel=1e-12)
+    assert state.sum_xy == pytest.approx((x * y).sum(), rel=1e-12)
+    assert state.sum_yy == pytest.approx((y * y).sum(), rel=1e-12)
+    assert state.sum_ma == pytest.approx(closes.iloc[-MA_WINDOW:].sum(), rel=1e-12)
+
+
+def test_incremental_writes_past_a_full_window_match_the_screen(closes, store):
+    rolling = rolling_store(store)
+    tickers = list(closes.columns)
+    for ticker in tickers:
+        write(rolling, ticker, closes[ticker].iloc[:-60])
+    rolling.screen(tickers)
+
+    # one session at a time for AAA, the rest in a single batch each
+    for day in closes.index[-60:]:
+        write(rolling, "AAA", closes["AAA"].loc[[day]])
+    for ticker in tickers[1:]:
+        write(rolling, ticker, closes[ticker].iloc[-60:])
+
+    for ticker in tickers:
+        state = rolling.states[ticker]
+        assert state.updates == 60
+        assert_sums_match(state, closes[ticker].iloc[-WINDOW:])
+
+    parameters = dict(gap_window=90, max_stock_gap=0.15, minimum_score_momentum=0)
+    screened = rolling.screen(tickers, **parameters)
+    reference = screen(closes.iloc[-WINDOW:], ma_window=MA_WINDOW, **parameters)
+
+    assert rolling.misses == len(tickers) and rolling.hits == len(tickers)
+    pd.testing.assert_frame_equal(
+        screened.sort_index(), reference.loc[screened.index].sort_index(), rtol=1e-9
+    )
+
+
+def test_rewriting_stored_sessions_keeps_the_state(closes, store):
+    rolling = rolling_store(store)
+    write(rolling, "AAA", closes["AAA"])
+    rolling.screen(["AAA"])
+    state = rolling.states["AAA"]
+
+    write(rolling, "AAA", closes["AAA"].iloc[-5:])
+
+    assert rolling.states["AAA"] is state
+    assert state.updates == 0
+    assert_sums_match(state, closes["AAA"].iloc[-WINDOW:])
+
+
+def test_backfill_inside_the_window_drops_the_state(closes, store):
+    rolling = rolling_store(store)
+    _, db_session = store
+    series = closes["AAA"]
+    missing = series.index[-30]
+    write(rolling, "AAA", series.drop(missing))
+    rolling.screen(["AAA"])
+    assert rolling.states["AAA"] is not None
+
+    write(rolling, "AAA", series.loc[[missing]])
+
+    assert rolling.states["AAA"] is None
+    assert db_session.query(models.RollingState).count() == 0
+
+    # the next read rebuilds the state with the backfilled session
+    rolling.screen(["AAA"])
+    assert_sums_match(rolling.states["AAA"], series.iloc[-WINDOW:])
@@ -0,0 +1,185 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+import sqlalchemy
+from database import Base
+from helper import momentum_score
+from rolling import RollingStatistics
+from screener import rank, screen, screen_store
+from store import SQLiteStore
+from trading_calendar import last_session, sessions_back
+
+MA_WINDOW = 100
+GAP_WINDOW = 90
+MAX_STOCK_GAP = 0.15
+
+
+def sessions(n):
+    return pd.DatetimeIndex(
+        [sessions_back(i, last_session()) for i in range(n - 1, -1, -1)]
+    )
+
+
+@pytest.fixture
+def closes():
+    rng = np.random.default_rng(7)
+    index = sessions(300)
+    frame = pd.DataFrame(
+        100 * np.exp(np.cumsum(rng.normal(0.001, 0.01, (len(index), 6)), axis=0)),
+        index=index,
+        columns=["UP", "HOLES", "SHORT", "TINY", "FLAT", "JUMP"],
+    )
+    frame.loc[rng.random(len(index)) < 0.1, "HOLES"] = np.nan
+    frame.iloc[:-60, frame.columns.get_loc("SHORT")] = np.nan
+    frame.iloc[:-1, frame.columns.get_loc("TINY")] = np.nan
+    frame["FLAT"] = 50.0
+    # a 30% move across a missing session inside the gap window
+    frame.iloc[-20:, frame.columns.get_loc("JUMP")] *= 1.3
+    frame.iloc[-21, frame.columns.get_loc("JUMP")] = np.nan
+
+    return frame
+
+
+def expected(frame, score_window=252, ma_window=MA_WINDOW, gap_window=GAP_WINDOW):
+    """
+    The per-ticker filters the screen replaced, run on each column's valid
+    closes; the windows are counted in rows of ``frame``.
+    """
+    rows = {}
+    for ticker in frame.columns:
+        scored = frame[ticker].iloc[-score_window:].dropna()
+        if scored.empty:
+            continue
+        moves = frame[ticker].iloc[-gap_window:].dropna().pct_change().abs()
+        rows[ticker] = {
+            "close": scored.iloc[-1],
+            "moving_average": frame[ticker].iloc[-ma_window:].dropna().mean(),
+            "max_move": moves.max() if moves.notna().any() else 0.0,
+            # linregress defines r = 0 for a constant series, though rounding
+            # in its sums yields NaN at some lengths
+            "score": (
+                0.0
+                if len(scored) > 1 and scored.nunique() == 1
+                else momentum_score(scored)
+            ),
+        }
+
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+
+def by_valid_closes(frame, score_window=252):
+    # screen() and the rolling states count windows in valid closes
+    columns = {}
+    for ticker in frame.columns:
+        valid = frame[ticker].iloc[-score_window:].dropna()
+        # each column's valid closes end on the last row
+        columns[ticker] = pd.Series(
+            valid.to_numpy(), index=range(score_window - len(valid), score_window)
+        )
+    return pd.DataFrame(columns, index=range(score_window))
+
+
+def assert_matches(screened, reference):
+    screened = screened.loc[screened["has_data"]]
+    assert sorted(screened.index) == sorted(reference.index)
+    screened = screened.loc[reference.index]
+
+    np.testing.assert_allclose(screened["close"], reference["close"])
+    np.testing.assert_allclose(
+        screened["moving_average"], reference["moving_average"], rtol=1e-12
+    )
+    np.testing.assert_allclose(screened["max_move"], reference["max_move"], atol=1e-12)
+    np.testing.assert_allclose(
+        screened["score"], reference["score"], rtol=1e-9, atol=1e-9, equal_nan=True
+    )
+
+    assert (
+        screened["above_ma"] == (reference["close"] > reference["moving_average"])
+    ).all()
+    assert (screened["within_gap"] == ~(reference["max_move"] > MAX_STOCK_GAP)).all()
+
+
+def parameters(**overrides):
+    return dict(
+        gap_window=GAP_WINDOW,
+        max_stock_gap=MAX_STOCK_GAP,
+        minimum_score_momentum=0,
+        **overrides,
+    )
+
+
+def test_screen_matches_the_per_ticker_helpers(closes):
+    panel = closes.iloc[-252:]
+
+    screened = screen(panel, ma_window=MA_WINDOW, **parameters())
+
+    assert_matches(screened, expected(by_valid_closes(panel)))
+    # too short to regress, and a flat series has r = 0
+    assert np.isnan(screened.at["TINY", "score"])
+    assert screened.at["FLAT", "score"] == 0.0
+    assert momentum_score(closes["FLAT"].iloc[-100:]) == 0.0
+    assert not screened.at["FLAT", "above_ma"]
+    assert not screened.at["JUMP", "within_gap"]
+    assert screened.at["JUMP", "max_move"] == pytest.approx(0.3, abs=0.05)
+
+
+def test_screen_handles_histories_shorter_than_the_windows(closes):
+    panel = closes.iloc[-252:][["SHORT", "TINY"]]
+
+    screened = screen(panel, ma_window=MA_WINDOW, **parameters())
+
+    assert screened.at["SHORT", "observations"] == 60
+    assert_matches(screened, expected(by_valid_closes(panel)))
+
+
+def test_screen_ranks_passing_tickers_by_score(closes):
+    screened = screen(closes.iloc[-252:], ma_window=MA_WINDOW, **parameters())
+
+    ranked = rank(screened)
+
+    assert "JUMP" not in ranked.index and "FLAT" not in ranked.index
+    assert list(ranked["score"]) == sorted(ranked["score"], reverse=True)
+
+
+@pytest.fixture
+def store(closes):
+    engine = sqlalchemy.create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    db_session = sqlalchemy.orm.Session(bind=engine, expire_on_commit=False)
+    store = SQLiteStore(engine, db_session)
+    for ticker in closes.columns:
+        series = closes[ticker].dropna()
+        store.write(
+            store.security(ticker),
+            [SimpleNamespace(t=day, c=float(close)) for day, close in series.items()],
+        )
+
+    return store, db_session
+
+
+def test_screen_store_windows_count_sessions(closes, store):
+    sqlite_store, _ = store
+
+    screened = screen_store(
+        sqlite_store, list(closes.columns), ma_window=MA_WINDOW, **parameters()
+    )
+
+    assert_matches(screened, expected(closes.iloc[-252:]))
+
+
+def test_screen_store_from_rolling_states(closes, store):
+    sqlite_store, db_session = store
+    rolling = RollingStatistics(sqlite_store, db_session, ma_window=MA_WINDOW)
+
+    cold = screen_store(rolling, list(closes.columns), **parameters())
+    warm = screen_store(
+        RollingStatistics(sqlite_store, db_session, ma_window=MA_WINDOW),
+        list(closes.columns),
+        **parameters(),
+    )
+
+    reference = expected(by_valid_closes(closes.iloc[-252:]))
+    assert_matches(cold, reference)
+    assert_matches(warm, reference)
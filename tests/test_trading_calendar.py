@@ -0,0 +1,31 @@
+from datetime import date, datetime, timezone
+
+import pytest
+from trading_calendar import EXCHANGE_TIMEZONE, last_session, window_start
+
+
+@pytest.mark.parametrize(
+    "now, session",
+    [
+        # Friday before and after the daily bar is published
+        (datetime(2026, 10, 16, 16, 14, tzinfo=EXCHANGE_TIMEZONE), date(2026, 10, 15)),
+        (datetime(2026, 10, 16, 16, 30, tzinfo=EXCHANGE_TIMEZONE), date(2026, 10, 16)),
+        # the weekend keeps Friday's session
+        (datetime(2026, 10, 18, 12, 0, tzinfo=EXCHANGE_TIMEZONE), date(2026, 10, 16)),
+        # 21:00 UTC is 17:00 in New York
+        (datetime(2026, 10, 19, 21, 0, tzinfo=timezone.utc), date(2026, 10, 19)),
+        # Thanksgiving evening
+        (datetime(2026, 11, 26, 18, 0, tzinfo=EXCHANGE_TIMEZONE), date(2026, 11, 25)),
+        # a date has no time of day, its own bar is not counted
+        (date(2026, 10, 16), date(2026, 10, 15)),
+    ],
+)
+def test_last_session_counts_today_after_the_close(now, session):
+    assert last_session(now) == datetime.combine(session, datetime.min.time())
+
+
+def test_window_start_ends_with_the_last_session():
+    now = datetime(2026, 10, 16, 17, 0, tzinfo=EXCHANGE_TIMEZONE)
+
+    assert window_start(5, now) == datetime(2026, 10, 12)
+    assert window_start(1, now) == datetime(2026, 10, 16)
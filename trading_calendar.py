@@ -0,0 +1,224 @@
+"""
+Offline NYSE trading calendar.
+
+Sessions from FIRST_YEAR to LAST_YEAR are computed once at import from the
+exchange's holiday rules and special closures into a sorted array of date
+ordinals. A second array, indexed by (ordinal - first ordinal), counts the
+sessions up to each calendar day, so every lookup below is O(1):
+
+    is_session(day)
+    previous_session(day) / next_session(day)
+    sessions_back(n, day)      -> session n sessions before day's session
+    sessions_between(start, end) -> session ordinals in [start, end]
+    last_session()             -> latest session with a complete daily bar
+    window_start(n)            -> first session of the last n complete ones
+
+Days may be dates, datetimes or pandas Timestamps; sessions are returned as
+datetimes at midnight, the way prices are stored. A session's daily bar is
+complete from DAILY_BAR_READY New York time on; naive datetimes are taken as
+the machine's local time. Closures announced after
+this was written (e.g. national days of mourning) must be added to
+SPECIAL_CLOSURES.
+"""
+
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+FIRST_YEAR = 1990
+LAST_YEAR = 2040
+
+EXCHANGE_TIMEZONE = ZoneInfo("America/New_York")
+
+# the daily bar is published shortly after the 16:00 close; early closes
+# finish before it
+DAILY_BAR_READY = time(16, 15)
+
+# unscheduled full-day closures
+SPECIAL_CLOSURES = [
+    date(1994, 4, 27),  # President Nixon's funeral
+    date(2001, 9, 11),  # September 11
+    date(2001, 9, 12),
+    date(2001, 9, 13),
+    date(2001, 9, 14),
+    date(2004, 6, 11),  # President Reagan's funeral
+    date(2007, 1, 2),  # President Ford's funeral
+    date(2012, 10, 29),  # Hurricane Sandy
+    date(2012, 10, 30),
+    date(2018, 12, 5),  # President George H. W. Bush's funeral
+    date(2025, 1, 9),  # President Carter's funeral
+]
+
+
+def _easter(year):
+    # anonymous Gregorian algorithm
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+
+    return date(year, month, day + 1)
+
+
+def _nth_weekday(year, month, weekday, n):
+    # n-th (1 based) weekday of the month, or the last one for n = -1
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _observed(day):
+    # Saturday holidays close the Friday before, Sunday ones the Monday after
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+
+def holidays(year):
+    """
+    Input:  Year.
+    Output: Set of the NYSE's regular full-day holidays that year.
+    """
+    days = {
+        _nth_weekday(year, 2, 0, 3),  # Washington's Birthday
+        _easter(year) - timedelta(days=2),  # Good Friday
+        _nth_weekday(year, 5, 0, -1),  # Memorial Day
+        _observed(date(year, 7, 4)),  # Independence Day
+        _nth_weekday(year, 9, 0, 1),  # Labor Day
+        _nth_weekday(year, 11, 3, 4),  # Thanksgiving
+        _observed(date(year, 12, 25)),  # Christmas
+    }
+    # a Saturday New Year's Day is not observed on the Friday before
+    if date(year, 1, 1).weekday() != 5:
+        days.add(_observed(date(year, 1, 1)))
+    if year >= 1998:
+        days.add(_nth_weekday(year, 1, 0, 3))  # Martin Luther King Jr. Day
+    if year >= 2022:
+        days.add(_observed(date(year, 6, 19)))  # Juneteenth
+
+    return days
+
+
+def _sessions():
+    first = date(FIRST_YEAR, 1, 1).toordinal()
+    days = np.arange(first, date(LAST_YEAR, 12, 31).toordinal() + 1, dtype=np.int32)
+    # ordinal 1 (0001-01-01) was a Monday
+    weekdays = (days - 1) % 7 < 5
+
+    closed = {
+        day.toordinal()
+        for year in range(FIRST_YEAR, LAST_YEAR + 1)
+        for day in holidays(year)
+    }
+    closed.update(day.toordinal() for day in SPECIAL_CLOSURES)
+    open_days = weekdays & ~np.isin(days, np.fromiter(closed, dtype=np.int32))
+
+    return first, days[open_days], np.cumsum(open_days, dtype=np.int32)
+
+
+FIRST_ORDINAL, SESSIONS, _COUNTS = _sessions()
+
+
+def _ordinal(day):
+    if isinstance(day, (int, np.integer)):
+        ordinal = int(day)
+    else:
+        ordinal = day.toordinal()
+
+    if not FIRST_ORDINAL <= ordinal < FIRST_ORDINAL + len(_COUNTS):
+        raise ValueError(
+            "{0} is outside the calendar ({1}-{2})".format(day, FIRST_YEAR, LAST_YEAR)
+        )
+    return ordinal
+
+
+def _session(index):
+    if not 0 <= index < len(SESSIONS):
+        raise ValueError("session outside the calendar")
+    return datetime.fromordinal(int(SESSIONS[index]))
+
+
+def _at_or_before(day):
+    # index into SESSIONS of the last session on or before the day
+    return int(_COUNTS[_ordinal(day) - FIRST_ORDINAL]) - 1
+
+
+def is_session(day):
+    ordinal = _ordinal(day)
+    index = _at_or_before(ordinal)
+    return index >= 0 and SESSIONS[index] == ordinal
+
+
+def previous_session(day):
+    """
+    Output: Last session strictly before the day.
+    """
+    return _session(_at_or_before(_ordinal(day) - 1))
+
+
+def next_session(day):
+    """
+    Output: First session strictly after the day.
+    """
+    return _session(_at_or_before(day) + 1)
+
+
+def sessions_back(n, day=None):
+    """
+    Input:  Number of sessions and a day, by default today.
+    Output: Session ``n`` sessions before the last session on or before the
+            day; n = 0 is that session itself.
+    """
+    return _session(_at_or_before(day or datetime.now()) - int(n))
+
+
+def sessions_between(start, end):
+    """
+    Output: Ordinals of the sessions from start to end, both inclusive, as a
+            view into SESSIONS.
+    """
+    first = _at_or_before(_ordinal(start) - 1) + 1
+    last = _at_or_before(end)
+
+    return SESSIONS[first : max(first, last + 1)]
+
+
+def last_session(now=None):
+    """
+    Input:  Current time, by default now.
+    Output: Latest session with a complete daily bar: today's once
+            DAILY_BAR_READY has passed in New York, otherwise the last one
+            before today.
+    """
+    if now is None or isinstance(now, datetime):
+        # naive datetimes are local time
+        now = (now or datetime.now()).astimezone(EXCHANGE_TIMEZONE)
+        today = datetime(now.year, now.month, now.day)
+        if now.time() >= DAILY_BAR_READY and is_session(today):
+            return today
+    else:
+        # a date carries no time of day, so its own bar is not counted
+        today = now
+
+    return previous_session(today)
+
+
+def window_start(trading_days, now=None):
+    """
+    Input:  Window length in sessions.
+    Output: First session of the ``trading_days`` sessions ending with
+            last_session(), so ``date >= window_start(n)`` selects n closes.
+    """
+    return sessions_back(int(trading_days) - 1, last_session(now))
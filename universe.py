@@ -0,0 +1,143 @@
+"""
+Cached, versioned constituent universe.
+
+Each constituent list is stored as dated snapshots in the database. Reads
+are served from the newest snapshot while it is younger than the TTL; after
+that the Wikipedia page is re-requested with If-None-Match/If-Modified-Since
+and a new snapshot is only written when the membership actually changed.
+Older snapshots stay around for point-in-time lookups.
+"""
+
+from datetime import datetime, timedelta
+
+import models
+import requests
+import sqlalchemy
+from helper import WIKI_CONSTITUENT_PAGES, parse_wiki_constituents_page
+from log import log
+
+CONSTITUENTS_TTL = timedelta(days=1)
+
+# Wikipedia requests made by this process, read by run reports
+wiki_requests = 0
+
+
+def _latest_snapshot(db_session, source, as_of=None):
+    query = db_session.query(models.ConstituentSnapshot).filter(
+        models.ConstituentSnapshot.source == source
+    )
+    if as_of is not None:
+        query = query.filter(models.ConstituentSnapshot.date <= as_of)
+
+    return query.order_by(sqlalchemy.desc(models.ConstituentSnapshot.date)).first()
+
+
+def _companies(snapshot):
+    return [
+        {"Symbol": constituent.ticker, "Name": constituent.name}
+        for constituent in sorted(snapshot.constituents, key=lambda c: c.id)
+    ]
+
+
+def _refresh(db_session, source, snapshot, now):
+    global wiki_requests
+
+    url, label = WIKI_CONSTITUENT_PAGES[source]
+
+    headers = {}
+    if snapshot is not None:
+        if snapshot.etag:
+            headers["If-None-Match"] = snapshot.etag
+        if snapshot.last_modified:
+            headers["If-Modified-Since"] = snapshot.last_modified
+
+    log("\nChecking {0} Wiki Constituents".format(label), "info")
+    wiki_requests += 1
+    response = requests.get(url, headers=headers, timeout=30)
+    if response.status_code == 304:
+        snapshot.checked_at = now
+        db_session.commit()
+        return snapshot
+    response.raise_for_status()
+
+    companies = parse_wiki_constituents_page(source, response.text)
+    log(
+        "{0} Companies found on Wikipedia: {1} Constituents Page".format(
+            len(companies), label
+        ),
+        "success",
+    )
+
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if snapshot is not None and _companies(snapshot) == companies:
+        snapshot.checked_at = now
+        snapshot.etag = etag
+        snapshot.last_modified = last_modified
+        db_session.commit()
+        return snapshot
+
+    snapshot = models.ConstituentSnapshot(
+        source, now, etag=etag, last_modified=last_modified
+    )
+    db_session.add(snapshot)
+    db_session.flush()
+    db_session.add_all(
+        [
+            models.Constituent(
+                snapshot_id=snapshot.id, ticker=company["Symbol"], name=company["Name"]
+            )
+            for company in companies
+        ]
+    )
+    db_session.commit()
+    db_session.refresh(snapshot)
+
+    return snapshot
+
+
+def constituents(db_session, sources, ttl=CONSTITUENTS_TTL, now=None):
+    """
+    Input:  Constituent list sources ("500", "400", "600", "aristocrats").
+    Output: List of {"Symbol", "Name"} dicts, as
+            parse_wiki_constituents_page returns them, served from the cache
+            whenever it is fresh.
+    """
+    now = now or datetime.now()
+
+    companies = []
+    for source in WIKI_CONSTITUENT_PAGES:
+        if source not in sources:
+            continue
+
+        snapshot = _latest_snapshot(db_session, source)
+        if snapshot is None or now - snapshot.checked_at >= ttl:
+            try:
+                snapshot = _refresh(db_session, source, snapshot, now)
+            except requests.RequestException as e:
+                db_session.rollback()
+                if snapshot is None:
+                    raise
+                log(f"{source} constituents refresh failed, using cache: {e}", "error")
+
+        companies += _companies(snapshot)
+
+    return companies
+
+
+def constituents_as_of(db_session, sources, as_of):
+    """
+    Input:  Constituent list sources and a date.
+    Output: Membership recorded by the newest snapshot taken on or before
+            ``as_of``; sources without one are skipped.
+    """
+    companies = []
+    for source in WIKI_CONSTITUENT_PAGES:
+        if source not in sources:
+            continue
+
+        snapshot = _latest_snapshot(db_session, source, as_of=as_of)
+        if snapshot is not None:
+            companies += _companies(snapshot)
+
+    return companies